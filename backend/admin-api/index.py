@@ -1,112 +1,555 @@
 '''
-Business: Admin API for getting stats, active chats, complaints, attachments
-Args: event with httpMethod, queryStringParameters; context with request_id
-Returns: JSON with statistics, chats, complaints or attachments
+Business: Admin API for getting stats, active chats, complaints, attachments, the combined dashboard and attachment files
+Args: event with httpMethod, queryStringParameters, headers, body (single or bulk moderation actions); context with request_id
+Returns: JSON with statistics, chats, complaints, attachments or all of them for endpoint=dashboard; live deltas for endpoint=events; attachment bytes for endpoint=file; Prometheus text for endpoint=metrics
 '''
 
+import functools
+import importlib
 import json
 import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import datetime, timedelta
+import re
+import time
+import base64
+import gzip
+import hashlib
+import hmac
+import secrets
+import select
+import sys
+import tempfile
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Any, Tuple, Optional, List, Set, Callable
+from datetime import datetime, timedelta, timezone
+
+class LazyModule:
+    """
+    Stand-in for a heavy module that imports it (plus listed submodules) on first attribute access.
+    Once loaded it rebinds the owning global to the real module, so later lookups cost nothing.
+    """
+    
+    def __init__(self, namespace: Dict[str, Any], name: str, *submodules: str):
+        self._namespace = namespace
+        self._name = name
+        self._submodules = submodules
+        self._module = None
+        self._lock = threading.Lock()
+    
+    def load(self):
+        with self._lock:
+            if self._module is None:
+                module = importlib.import_module(self._name)
+                for submodule in self._submodules:
+                    importlib.import_module(f'{self._name}.{submodule}')
+                self._namespace[self._name] = module
+                self._module = module
+        return self._module
+    
+    def __getattr__(self, attr: str):
+        return getattr(self._module or self.load(), attr)
+
+# psycopg2 and requests (urllib3, charset_normalizer, idna) dominate import time;
+# they load on the first request that needs them, never for an OPTIONS preflight
+psycopg2 = LazyModule(globals(), 'psycopg2', 'extensions', 'extras', 'pool')
+requests = LazyModule(globals(), 'requests')
 
 DATABASE_URL = os.environ.get('DATABASE_URL', '')
+TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+VK_GROUP_TOKEN = os.environ.get('VK_GROUP_TOKEN', '')
+VK_API_VERSION = '5.131'
+# API base URLs are overridable, as in the bots, so admin-api can be pointed at local stand-in servers
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+VK_API_URL = os.environ.get('VK_API_URL', 'https://api.vk.com/method').rstrip('/')
+ATTACHMENTS_PAGE_SIZE = int(os.environ.get('ATTACHMENTS_PAGE_SIZE', '100'))
+CHATS_PAGE_SIZE = 50
+COMPLAINTS_PAGE_SIZE = 50
+LIST_MAX_PAGE_SIZE = 500
+COMPLAINT_STATUSES = ('pending', 'reviewed', 'resolved', 'rejected')
+BULK_MAX_IDS = 1000
+PARTNER_NOTIFY_WORKERS = 8
+PARTNER_BLOCKED_NOTICE = '👋 Собеседник завершил диалог'
 
-def get_db_connection():
-    return psycopg2.connect(DATABASE_URL)
+# Connections are reused across invocations of a warm instance; the dashboard loads panels in parallel
+DB_POOL_MAX_CONNECTIONS = int(os.environ.get('DB_POOL_MAX_CONNECTIONS', '6'))
+DASHBOARD_MAX_WORKERS = 4
+# Open the pool, prepare dashboard statements and create the HTTP session at init rather than on the first request
+WARM_START = os.environ.get('WARM_START', 'false').lower() == 'true'
 
-def get_stats() -> Dict[str, Any]:
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+# Live events: the bots and moderation actions append deltas to admin_events, whose id is the client
+# cursor on every instance. The table trigger NOTIFYs this channel; one listener thread per instance
+# only wakes long polls early, and a wait never exceeds EVENTS_POLL_SECONDS before the table is read again
+ADMIN_EVENTS_CHANNEL = 'admin_events'
+EVENTS_LONG_POLL_SECONDS = 25
+EVENTS_POLL_SECONDS = 5
+EVENTS_PAGE_SIZE = 500
+EVENTS_RECONNECT_DELAY_SECONDS = 2
+
+# Telegram guarantees a getFile link for at least one hour; keep a margin
+FILE_URL_TTL_SECONDS = 55 * 60
+FILE_URL_CACHE_MAX_SIZE = 5000
+
+# Attachment proxy: captured files are read from attachment_blobs, which cleanup-attachments fills,
+# other files from Telegram through a size-bounded on-disk LRU; small files are also kept in an in-memory LRU
+ATTACHMENT_CACHE_DIR = os.environ.get('ATTACHMENT_CACHE_DIR', '/tmp/attachment-cache')
+ATTACHMENT_CACHE_MAX_BYTES = int(os.environ.get('ATTACHMENT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+# Upper bound of one response body: a larger file is only served to Range requests (413 without one)
+ATTACHMENT_MAX_RESPONSE_BYTES = 2 * 1024 * 1024
+ATTACHMENT_MAX_BYTES = 20 * 1024 * 1024
+HOT_CACHE_ITEM_MAX_BYTES = 256 * 1024
+HOT_CACHE_MAX_BYTES = 8 * 1024 * 1024
+CONTENT_TYPE_MIME = {
+    'photo': 'image/jpeg',
+    'video': 'video/mp4',
+    'animation': 'video/mp4',
+    'video_note': 'video/mp4',
+    'voice': 'audio/ogg',
+    'audio': 'audio/mpeg',
+    'sticker': 'image/webp',
+}
+
+# Admin sessions signed by admin-auth are verified locally with the shared secret; auth is
+# enforced once ADMIN_SESSION_SECRET is configured
+ADMIN_SESSION_SECRET = os.environ.get('ADMIN_SESSION_SECRET', '')
+ADMIN_SESSION_BIND_IP = os.environ.get('ADMIN_SESSION_BIND_IP', 'true').lower() == 'true'
+REVOCATION_REFRESH_SECONDS = 30
+
+# JSON GET responses are cached per endpoint+params for a short TTL; concurrent misses for the
+# same key wait for a single loader instead of each querying the database
+RESPONSE_CACHE_TTL_SECONDS = {
+    'stats': int(os.environ.get('STATS_CACHE_TTL_SECONDS', '10')),
+    'chats': 5,
+    'complaints': 5,
+    'attachments': 15,
+}
+RESPONSE_CACHE_MAX_ENTRIES = 256
+RESPONSE_CACHE_WAIT_SECONDS = 30
+GZIP_MIN_BYTES = 1024
+
+# endpoint=metrics: the admin session or this token as a Bearer header (for a Prometheus scraper)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+PROMETHEUS_LABEL_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+# Upper bounds (seconds) of the request, outbound call and DB checkout latency histograms; the last bucket is +Inf
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Opt-in sampling profiler: PROFILE_SAMPLE_RATE of invocations sample the handler thread and the
+# PROFILED_POOLS workers it dispatches to, and append collapsed stacks (route;thread;frame;...;frame count,
+# the flamegraph.pl / speedscope input) to PROFILE_DIR. Other threads (the admin-events listener, handlers
+# of concurrent invocations) are skipped so their time is not charged to the sampled route
+PROFILED_POOLS = ('dashboard', 'partner-notice')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000
+PROFILE_PATH = os.path.join(os.environ.get('PROFILE_DIR', '/tmp/profiles'), 'admin-api.collapsed')
+# Past this size the file is rotated to .collapsed.1, so the directory holds at most about twice the limit
+PROFILE_MAX_BYTES = int(os.environ.get('PROFILE_MAX_BYTES', str(16 * 1024 * 1024)))
+
+# Dashboard statements: name -> (parameter types, body), prepared once per pooled connection
+PREPARED_STATEMENTS = {
+    # Live gauges: each sub-select is served by a partial or last_active index
+    'stats_gauges': ('', """
+        SELECT
+            (SELECT COUNT(*) FROM t_p14838969_anon_talk_bot.users WHERE last_active > NOW() - INTERVAL '5 minutes') as active_users,
+            (SELECT COUNT(*) FROM t_p14838969_anon_talk_bot.chats WHERE is_active = TRUE) as active_chats,
+            (SELECT COUNT(*) FROM t_p14838969_anon_talk_bot.users WHERE is_searching = TRUE) as searching_users,
+            (SELECT COUNT(*) FROM t_p14838969_anon_talk_bot.complaints WHERE status = 'pending') as pending_complaints
+    """),
+    'stats_gender': ('', """
+        SELECT 
+            COUNT(*) FILTER (WHERE gender = 'male') as male_count,
+            COUNT(*) FILTER (WHERE gender = 'female') as female_count
+        FROM t_p14838969_anon_talk_bot.users 
+        WHERE last_active > NOW() - INTERVAL '24 hours'
+    """),
+    # Counters come from the per-minute rollup the bots maintain, so this reads
+    # at most hours x metrics x platforms rows regardless of traffic
+    'stats_rollup_24h': ('', """
+        SELECT date_trunc('hour', bucket) as hour_bucket, metric, platform, SUM(value) as total
+        FROM t_p14838969_anon_talk_bot.stats_rollup
+        WHERE bucket > NOW() - INTERVAL '24 hours'
+        GROUP BY 1, 2, 3
+        ORDER BY 1
+    """),
+    # Users waiting for a partner; served by the partial idx_users_searching index
+    'metrics_search_queue': ('', """
+        SELECT COALESCE(platform, 'telegram'), COALESCE(gender, 'not_set'), COUNT(*)
+        FROM t_p14838969_anon_talk_bot.users
+        WHERE is_searching = TRUE
+        GROUP BY 1, 2
+    """),
+}
+
+_file_url_cache: Dict[str, Tuple[str, float]] = {}
+_hot_cache: 'OrderedDict[str, bytes]' = OrderedDict()
+_hot_cache_bytes = 0
+_response_cache: 'OrderedDict[str, Tuple[str, str, float]]' = OrderedDict()
+_response_inflight: Dict[str, threading.Event] = {}
+# Bumped by every invalidation; a loader that started under an older generation does not store its result
+_response_cache_generation = 0
+_response_cache_lock = threading.Lock()
+_revoked_sessions: set = set()
+_revoked_loaded_at: Optional[float] = None
+_revocation_lock = threading.Lock()
+_db_pool: 'Optional[psycopg2.pool.ThreadedConnectionPool]' = None
+_db_pool_lock = threading.Lock()
+_connection_class: Optional[type] = None
+_http_session: 'Optional[requests.Session]' = None
+_http_session_lock = threading.Lock()
+_dashboard_executor = ThreadPoolExecutor(max_workers=DASHBOARD_MAX_WORKERS, thread_name_prefix='dashboard')
+_events_cond = threading.Condition()
+# Highest admin_events id announced by NOTIFY on this instance
+_events_notified_id = 0
+_events_listener: Optional[threading.Thread] = None
+# In-process metrics. Plain int updates without a lock, like the bots' counters: the GIL keeps them
+# consistent enough for monitoring, and a rare lost increment under thread contention is acceptable
+_request_metrics: Dict[str, 'LatencyHistogram'] = {}
+_responses: Dict[Tuple[str, str], int] = {}
+_api_metrics: Dict[str, 'LatencyHistogram'] = {}
+_api_responses: Dict[Tuple[str, str], int] = {}
+_db_checkout_metrics: Dict[str, 'LatencyHistogram'] = {}
+_profile_local = threading.local()
+_profile_sink_lock = threading.Lock()
+
+class PooledConnection:
+    """Connection checked out of the pool; close() hands it back instead of disconnecting"""
     
-    cursor.execute("SELECT COUNT(*) as total FROM users WHERE last_active > NOW() - INTERVAL '5 minutes'")
-    active_users = cursor.fetchone()['total']
+    def __init__(self, pool: 'psycopg2.pool.ThreadedConnectionPool', conn):
+        self._pool = pool
+        self._conn = conn
     
-    cursor.execute("SELECT COUNT(*) as total FROM chats WHERE is_active = TRUE")
-    active_chats = cursor.fetchone()['total']
+    def __getattr__(self, name: str):
+        return getattr(self._conn, name)
     
-    cursor.execute("SELECT COUNT(*) as total FROM users WHERE is_searching = TRUE")
-    searching_users = cursor.fetchone()['total']
+    # Attribute assignment and the with-block protocol bypass __getattr__, so forward them explicitly
+    @property
+    def autocommit(self) -> bool:
+        return self._conn.autocommit
     
-    cursor.execute("SELECT COUNT(*) as total FROM complaints WHERE status = 'pending'")
-    pending_complaints = cursor.fetchone()['total']
+    @autocommit.setter
+    def autocommit(self, value: bool):
+        self._conn.autocommit = value
     
-    cursor.execute("""
-        SELECT 
-            COUNT(*) FILTER (WHERE gender = 'male') as male_count,
-            COUNT(*) FILTER (WHERE gender = 'female') as female_count
-        FROM users 
-        WHERE last_active > NOW() - INTERVAL '24 hours'
-    """)
-    gender_stats = cursor.fetchone()
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
     
-    cursor.execute("""
-        SELECT 
-            EXTRACT(HOUR FROM started_at) as hour,
-            COUNT(*) as count
-        FROM chats
-        WHERE started_at > NOW() - INTERVAL '24 hours'
-        GROUP BY EXTRACT(HOUR FROM started_at)
-        ORDER BY hour
-    """)
-    hourly_stats = cursor.fetchall()
+    def __exit__(self, *exc_info):
+        return self._conn.__exit__(*exc_info)
     
-    cursor.execute("""
-        SELECT 
-            AVG(EXTRACT(EPOCH FROM (COALESCE(ended_at, NOW()) - started_at)) / 60) as avg_duration_minutes
-        FROM chats
-        WHERE started_at > NOW() - INTERVAL '24 hours'
-    """)
-    avg_duration = float(cursor.fetchone()['avg_duration_minutes'] or 0)
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._pool.putconn(conn, close=bool(conn.closed))
+
+class LatencyHistogram:
+    """Invocation count, failures and latency histogram of one endpoint, API method or connection source"""
     
-    cursor.execute("""
-        SELECT SUM(message_count) as total_messages
-        FROM chats
-        WHERE started_at > NOW() - INTERVAL '24 hours'
-    """)
-    total_messages = int(cursor.fetchone()['total_messages'] or 0)
+    __slots__ = ('count', 'errors', 'seconds_sum', 'bucket_counts')
+    
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds_sum = 0.0
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    
+    def observe(self, seconds: float, failed: bool):
+        self.count += 1
+        self.errors += failed
+        self.seconds_sum += seconds
+        self.bucket_counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+def observe_latency(histograms: Dict[str, LatencyHistogram], key: str, seconds: float, failed: bool = False):
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms.setdefault(key, LatencyHistogram())
+    histogram.observe(seconds, failed)
+
+def bump_counter(counters: Dict[Any, int], key: Any):
+    counters[key] = counters.get(key, 0) + 1
+
+def get_client_ip(event: Dict[str, Any]) -> str:
+    headers = event.get('headers', {})
+    return headers.get('x-forwarded-for', headers.get('x-real-ip', 'unknown')).split(',')[0].strip()
+
+def sign_session(session_id: str, expires_at: int, ip_address: str) -> str:
+    bound_ip = ip_address if ADMIN_SESSION_BIND_IP else ''
+    message = f'{session_id}.{expires_at}.{bound_ip}'.encode('utf-8')
+    digest = hmac.new(ADMIN_SESSION_SECRET.encode('utf-8'), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+def parse_session_token(session_token: str, ip_address: str) -> Optional[str]:
+    """Return the session id of a correctly signed, unexpired token bound to this IP"""
+    parts = session_token.split('.')
+    if not ADMIN_SESSION_SECRET or len(parts) != 3:
+        return None
+    session_id, expires_value, signature = parts
+    try:
+        expires_at = int(expires_value)
+    except ValueError:
+        return None
+    if expires_at < time.time():
+        return None
+    if not hmac.compare_digest(signature, sign_session(session_id, expires_at, ip_address)):
+        return None
+    return session_id
+
+def is_session_revoked(session_id: str) -> bool:
+    """Check the in-memory revocation list, reloading it from the DB every REVOCATION_REFRESH_SECONDS"""
+    global _revoked_sessions, _revoked_loaded_at
+    with _revocation_lock:
+        stale = _revoked_loaded_at is None or time.monotonic() - _revoked_loaded_at > REVOCATION_REFRESH_SECONDS
+        if stale:
+            try:
+                with pooled_connection() as conn, conn.cursor() as cursor:
+                    cursor.execute("SELECT session_token FROM admin_sessions WHERE is_active = FALSE AND expires_at > NOW()")
+                    _revoked_sessions = {row[0] for row in cursor.fetchall()}
+                _revoked_loaded_at = time.monotonic()
+            except psycopg2.Error:
+                # Keep serving the last known list; without one, fail closed
+                if _revoked_loaded_at is None:
+                    raise
+        return session_id in _revoked_sessions
+
+def verify_legacy_session(session_token: str) -> bool:
+    """Opaque tokens issued before signed sessions are checked against admin_sessions"""
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM admin_sessions WHERE session_token = %s AND is_active = TRUE AND expires_at > NOW()",
+            (session_token,)
+        )
+        valid = cursor.fetchone() is not None
+    return valid
+
+def is_authorized(event: Dict[str, Any], params: Dict[str, str]) -> bool:
+    if params.get('endpoint') == 'metrics' and METRICS_TOKEN and secrets.compare_digest(
+        get_header(event, 'authorization') or '', f'Bearer {METRICS_TOKEN}'
+    ):
+        return True
+    if not ADMIN_SESSION_SECRET:
+        return True
+    # Media is fetched with the header too (the panel renders object URLs), so the session token
+    # never appears in a URL, access log or Referer
+    session_token = get_header(event, 'x-session-token')
+    if not session_token:
+        return False
+    if '.' not in session_token:
+        return verify_legacy_session(session_token)
+    session_id = parse_session_token(session_token, get_client_ip(event))
+    return session_id is not None and not is_session_revoked(session_id)
+
+def preparing_connection_class() -> type:
+    """psycopg2 connection subclass that remembers which named statements its server session has prepared"""
+    global _connection_class
+    if _connection_class is None:
+        class PreparingConnection(psycopg2.extensions.connection):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.prepared: Set[str] = set()
+        _connection_class = PreparingConnection
+    return _connection_class
+
+def get_db_pool() -> 'psycopg2.pool.ThreadedConnectionPool':
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            _db_pool = psycopg2.pool.ThreadedConnectionPool(
+                0, DB_POOL_MAX_CONNECTIONS, DATABASE_URL, connection_factory=preparing_connection_class()
+            )
+        return _db_pool
+
+def get_db_connection():
+    """Check a connection out of the pool; the wait (including any handshake) feeds the checkout histogram"""
+    started = time.perf_counter()
+    pool = get_db_pool()
+    try:
+        conn = pool.getconn()
+    except psycopg2.pool.PoolError:
+        # Pool exhausted: fall back to a one-off connection rather than failing the request
+        conn = psycopg2.connect(DATABASE_URL, connection_factory=preparing_connection_class())
+        conn.autocommit = True
+        observe_latency(_db_checkout_metrics, 'fallback', time.perf_counter() - started)
+        return conn
+    if conn.closed:
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    # Each statement commits on its own, so a returned connection never holds an open transaction
+    conn.autocommit = True
+    observe_latency(_db_checkout_metrics, 'pool', time.perf_counter() - started)
+    return PooledConnection(pool, conn)
+
+@contextmanager
+def pooled_connection():
+    """get_db_connection() for a with block: the connection goes back to the pool even when the block raises"""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def prepare_statement(cursor, name: str):
+    """PREPARE a PREPARED_STATEMENTS entry unless this connection already has it"""
+    conn = cursor.connection
+    if name not in conn.prepared:
+        arg_types, sql = PREPARED_STATEMENTS[name]
+        cursor.execute(f"PREPARE {name}{f' ({arg_types})' if arg_types else ''} AS {sql}")
+        conn.prepared.add(name)
+
+def execute_prepared(cursor, name: str, params: Tuple = ()):
+    """Execute a PREPARED_STATEMENTS entry by name, preparing it on first use on this connection"""
+    prepare_statement(cursor, name)
+    if params:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+def api_method_label(url: str) -> str:
+    """Metrics label for an outbound call, e.g. telegram.getFile; never contains the bot token"""
+    if url.startswith(VK_API_URL):
+        return 'vk.' + url[len(VK_API_URL):].strip('/').split('?', 1)[0]
+    if url.startswith(TELEGRAM_API_URL):
+        path = url[len(TELEGRAM_API_URL):]
+        return 'telegram.file' if path.startswith('/file/') else 'telegram.' + path.rsplit('/', 1)[-1]
+    return 'other'
+
+def instrumented_request(request):
+    """Wrap Session.request so every outbound call feeds the API latency and status metrics"""
+    def instrumented(method: str, url: str, *args: Any, **kwargs: Any):
+        label = api_method_label(url)
+        started = time.perf_counter()
+        try:
+            response = request(method, url, *args, **kwargs)
+        except Exception as e:
+            observe_latency(_api_metrics, label, time.perf_counter() - started, True)
+            bump_counter(_api_responses, (label, type(e).__name__))
+            raise
+        status = str(response.status_code)
+        observe_latency(_api_metrics, label, time.perf_counter() - started, not status.startswith('2'))
+        bump_counter(_api_responses, (label, status))
+        return response
+    return instrumented
+
+def http_session() -> 'requests.Session':
+    """Shared session so Bot API and VK calls reuse kept-alive TLS connections"""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                session = requests.Session()
+                # get()/post() go through self.request, so the instance attribute covers every call
+                session.request = instrumented_request(session.request)
+                _http_session = session
+    return _http_session
+
+def resolve_file_url(file_id: str) -> Optional[str]:
+    """Resolve a Telegram file_id to a download URL through an in-process TTL cache"""
+    cached = _file_url_cache.get(file_id)
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    
+    try:
+        url = f'{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/getFile'
+        response = http_session().post(url, json={'file_id': file_id}, timeout=10)
+        file_path = response.json().get('result', {}).get('file_path') if response.status_code == 200 else None
+    except requests.RequestException:
+        return None
+    if not file_path:
+        return None
     
-    cursor.close()
-    conn.close()
+    file_url = f'{TELEGRAM_API_URL}/file/bot{TELEGRAM_BOT_TOKEN}/{file_path}'
+    _file_url_cache.pop(file_id, None)
+    _file_url_cache[file_id] = (file_url, time.monotonic() + FILE_URL_TTL_SECONDS)
+    while len(_file_url_cache) > FILE_URL_CACHE_MAX_SIZE:
+        _file_url_cache.pop(next(iter(_file_url_cache)))
+    return file_url
+
+def get_stats() -> Dict[str, Any]:
+    with pooled_connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        execute_prepared(cursor, 'stats_gauges')
+        gauges = cursor.fetchone()
+        
+        execute_prepared(cursor, 'stats_gender')
+        gender_stats = cursor.fetchone()
+        
+        execute_prepared(cursor, 'stats_rollup_24h')
+        rollup_rows = cursor.fetchall()
+    
+    hourly: Dict[Any, Dict[str, int]] = {}
+    totals: Dict[str, int] = {}
+    by_platform: Dict[str, Dict[str, int]] = {}
+    for row in rollup_rows:
+        total = int(row['total'] or 0)
+        bucket = hourly.setdefault(row['hour_bucket'], {})
+        bucket[row['metric']] = bucket.get(row['metric'], 0) + total
+        totals[row['metric']] = totals.get(row['metric'], 0) + total
+        platform_totals = by_platform.setdefault(row['platform'], {})
+        platform_totals[row['metric']] = platform_totals.get(row['metric'], 0) + total
+    
+    chats_ended = totals.get('chats_ended', 0)
+    avg_duration = totals.get('chat_duration_seconds', 0) / chats_ended / 60 if chats_ended else 0
     
     return {
-        'active_users': active_users,
-        'active_chats': active_chats,
-        'searching_users': searching_users,
-        'pending_complaints': pending_complaints,
+        'active_users': gauges['active_users'],
+        'active_chats': gauges['active_chats'],
+        'searching_users': gauges['searching_users'],
+        'pending_complaints': gauges['pending_complaints'],
         'gender_distribution': {
             'male': gender_stats['male_count'] or 0,
             'female': gender_stats['female_count'] or 0
         },
-        'hourly_stats': [{'hour': int(row['hour']), 'users': int(row['count']), 'chats': int(row['count'])} for row in hourly_stats],
+        'hourly_stats': [
+            {'hour': hour_bucket.hour, 'users': counts.get('searches', 0), 'chats': counts.get('chats_started', 0)}
+            for hour_bucket, counts in hourly.items()
+        ],
+        'platform_stats': by_platform,
         'avg_chat_duration_minutes': round(float(avg_duration), 2),
-        'total_messages_today': total_messages
+        'total_messages_today': totals.get('messages', 0)
     }
 
-def get_active_chats() -> list:
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+def get_active_chats(params: Dict[str, str]) -> Dict[str, Any]:
+    """Active chats, keyset-paginated on (started_at, id) DESC"""
+    limit = parse_page_limit(params, CHATS_PAGE_SIZE)
     
-    cursor.execute("""
-        SELECT 
-            c.id,
-            c.started_at,
-            c.message_count,
-            u1.gender as user1_gender,
-            u2.gender as user2_gender,
-            EXTRACT(EPOCH FROM (NOW() - c.started_at)) / 60 as duration_minutes
-        FROM chats c
-        JOIN users u1 ON c.user1_telegram_id = u1.telegram_id
-        JOIN users u2 ON c.user2_telegram_id = u2.telegram_id
-        WHERE c.is_active = TRUE
-        ORDER BY c.started_at DESC
-        LIMIT 50
-    """)
-    
-    chats = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    conditions = ["c.is_active = TRUE"]
+    args: list = []
+    
+    if params.get('cursor'):
+        cursor_started_at, cursor_id = decode_cursor(params['cursor'])
+        conditions.append("(c.started_at, c.id) < (%s, %s)")
+        args.extend([cursor_started_at, cursor_id])
+    
+    if params.get('platform'):
+        conditions.append("(c.user1_platform = %s OR c.user2_platform = %s)")
+        args.extend([params['platform'], params['platform']])
+    
+    args.append(limit + 1)
+    
+    with pooled_connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute(f"""
+            SELECT 
+                c.id,
+                c.started_at,
+                c.message_count,
+                u1.gender as user1_gender,
+                u2.gender as user2_gender,
+                EXTRACT(EPOCH FROM (NOW() - c.started_at)) / 60 as duration_minutes
+            FROM chats c
+            JOIN users u1 ON c.user1_telegram_id = u1.telegram_id
+            JOIN users u2 ON c.user2_telegram_id = u2.telegram_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY c.started_at DESC, c.id DESC
+            LIMIT %s
+        """, args)
+        
+        chats = cursor.fetchall()
+    
+    next_cursor = None
+    if len(chats) > limit:
+        chats = chats[:limit]
+        next_cursor = encode_cursor(chats[-1]['started_at'], chats[-1]['id'])
     
     result = []
     for chat in chats:
@@ -118,31 +561,80 @@ def get_active_chats() -> list:
             'duration_minutes': float(chat['duration_minutes'])
         })
     
-    return {'chats': result}
+    return {'chats': result, 'next_cursor': next_cursor}
 
-def get_complaints() -> list:
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+def parse_date_param(params: Dict[str, str], name: str) -> Optional[datetime]:
+    if not params.get(name):
+        return None
+    try:
+        return datetime.fromisoformat(params[name])
+    except ValueError:
+        raise ValueError(f'Invalid {name}')
+
+def get_complaints(params: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Complaints, keyset-paginated on (created_at, id) DESC.
+    Filters: status, platform (of the reporter), from/to on created_at.
+    """
+    limit = parse_page_limit(params, COMPLAINTS_PAGE_SIZE)
     
-    cursor.execute("""
-        SELECT 
-            c.id,
-            c.chat_id,
-            c.reporter_telegram_id,
-            c.reason,
-            c.status,
-            c.created_at,
-            ch.user1_telegram_id,
-            ch.user2_telegram_id
-        FROM complaints c
-        LEFT JOIN chats ch ON ch.id = c.chat_id
-        ORDER BY c.created_at DESC
-        LIMIT 50
-    """)
-    
-    complaints = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    conditions: List[str] = []
+    args: list = []
+    
+    if params.get('status'):
+        if params['status'] not in COMPLAINT_STATUSES:
+            raise ValueError('Invalid status')
+        # status = 'pending' is matched by the partial idx_complaints_status, ordered by (created_at, id)
+        conditions.append("c.status = %s")
+        args.append(params['status'])
+    
+    if params.get('platform'):
+        conditions.append("r.platform = %s")
+        args.append(params['platform'])
+    
+    created_from = parse_date_param(params, 'from')
+    if created_from:
+        conditions.append("c.created_at >= %s")
+        args.append(created_from)
+    
+    created_to = parse_date_param(params, 'to')
+    if created_to:
+        conditions.append("c.created_at < %s")
+        args.append(created_to)
+    
+    if params.get('cursor'):
+        cursor_created_at, cursor_id = decode_cursor(params['cursor'])
+        conditions.append("(c.created_at, c.id) < (%s, %s)")
+        args.extend([cursor_created_at, cursor_id])
+    
+    args.append(limit + 1)
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    with pooled_connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute(f"""
+            SELECT 
+                c.id,
+                c.chat_id,
+                c.reporter_telegram_id,
+                c.reason,
+                c.status,
+                c.created_at,
+                ch.user1_telegram_id,
+                ch.user2_telegram_id
+            FROM complaints c
+            LEFT JOIN chats ch ON ch.id = c.chat_id
+            LEFT JOIN users r ON r.telegram_id = c.reporter_telegram_id
+            {where_sql}
+            ORDER BY c.created_at DESC, c.id DESC
+            LIMIT %s
+        """, args)
+        
+        complaints = cursor.fetchall()
+    
+    next_cursor = None
+    if len(complaints) > limit:
+        complaints = complaints[:limit]
+        next_cursor = encode_cursor(complaints[-1]['created_at'], complaints[-1]['id'])
     
     result = []
     for complaint in complaints:
@@ -162,97 +654,746 @@ def get_complaints() -> list:
             'created_at': complaint['created_at'].isoformat()
         })
     
-    return {'complaints': result}
+    return {'complaints': result, 'next_cursor': next_cursor}
 
-def cleanup_old_attachments() -> int:
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def encode_cursor(sort_at: datetime, row_id: int) -> str:
+    return f"{sort_at.isoformat()}|{row_id}"
+
+def decode_cursor(cursor_value: str) -> Tuple[datetime, int]:
+    try:
+        sort_at, row_id = cursor_value.rsplit('|', 1)
+        return datetime.fromisoformat(sort_at), int(row_id)
+    except ValueError:
+        raise ValueError('Invalid cursor')
+
+def parse_page_limit(params: Dict[str, str], default: int) -> int:
+    try:
+        limit = int(params.get('limit', default))
+    except ValueError:
+        raise ValueError('Invalid limit')
+    return max(1, min(limit, LIST_MAX_PAGE_SIZE))
+
+def get_attachments(params: Dict[str, str]) -> Dict[str, Any]:
+    """Read-only attachments listing, keyset-paginated on (sent_at, id) DESC"""
+    limit = parse_page_limit(params, ATTACHMENTS_PAGE_SIZE)
     
-    cursor.execute("""
-        UPDATE t_p14838969_anon_talk_bot.messages
-        SET photo_url = NULL
-        WHERE photo_url IS NOT NULL 
-        AND sent_at < NOW() - INTERVAL '24 hours'
-    """)
+    conditions = [
+        "m.file_id IS NOT NULL",
+        "m.sent_at >= NOW() - INTERVAL '24 hours'"
+    ]
+    args: list = []
     
-    deleted_count = cursor.rowcount
-    cursor.close()
-    conn.close()
+    if params.get('cursor'):
+        cursor_sent_at, cursor_id = decode_cursor(params['cursor'])
+        conditions.append("(m.sent_at, m.id) < (%s, %s)")
+        args.extend([cursor_sent_at, cursor_id])
     
-    return deleted_count
-
-def get_attachments() -> Dict[str, Any]:
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    if params.get('content_type'):
+        conditions.append("m.content_type = %s")
+        args.append(params['content_type'])
     
-    cleanup_old_attachments()
+    if params.get('chat_id'):
+        try:
+            args.append(int(params['chat_id']))
+        except ValueError:
+            raise ValueError('Invalid chat_id')
+        conditions.append("m.chat_id = %s")
     
-    cursor.execute("""
-        SELECT 
-            m.id,
-            m.chat_id,
-            m.photo_url,
-            m.content_type,
-            m.sent_at,
-            u.gender as sender_gender
-        FROM t_p14838969_anon_talk_bot.messages m
-        JOIN t_p14838969_anon_talk_bot.users u ON m.sender_telegram_id = u.telegram_id
-        WHERE m.photo_url IS NOT NULL
-        AND m.sent_at >= NOW() - INTERVAL '24 hours'
-        ORDER BY m.sent_at DESC
-        LIMIT 100
-    """)
-    
-    attachments = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    if params.get('sender_gender'):
+        conditions.append("u.gender = %s")
+        args.append(params['sender_gender'])
+    
+    args.append(limit + 1)
+    
+    with pooled_connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute(f"""
+            SELECT 
+                m.id,
+                m.chat_id,
+                m.blob_sha256,
+                m.content_type,
+                m.sent_at,
+                u.gender as sender_gender
+            FROM t_p14838969_anon_talk_bot.messages m
+            JOIN t_p14838969_anon_talk_bot.users u ON m.sender_telegram_id = u.telegram_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY m.sent_at DESC, m.id DESC
+            LIMIT %s
+        """, args)
+        
+        attachments = cursor.fetchall()
+    
+    next_cursor = None
+    if len(attachments) > limit:
+        attachments = attachments[:limit]
+        last = attachments[-1]
+        next_cursor = encode_cursor(last['sent_at'], last['id'])
     
     result = []
     for att in attachments:
         result.append({
             'id': int(att['id']),
             'chat_id': int(att['chat_id']),
-            'photo_url': att['photo_url'],
+            'blob_sha256': att['blob_sha256'],
             'content_type': att['content_type'],
             'sent_at': att['sent_at'].isoformat(),
             'sender_gender': att['sender_gender'] or 'unknown'
         })
     
-    return {'attachments': result}
+    return {'attachments': result, 'next_cursor': next_cursor}
 
-def block_user(telegram_id: int) -> bool:
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def get_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Check an If-None-Match header value against a strong ETag"""
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return if_none_match.strip() == '*' or etag in tags
+
+def cached_json(endpoint: str, params: Dict[str, str], loader) -> Tuple[str, str]:
+    """Return (json body, etag) from the response cache, running loader once per key on a miss"""
+    key = json.dumps(sorted(params.items()))
+    while True:
+        with _response_cache_lock:
+            entry = _response_cache.get(key)
+            if entry and entry[2] > time.monotonic():
+                _response_cache.move_to_end(key)
+                return entry[0], entry[1]
+            inflight = _response_inflight.get(key)
+            if inflight is None:
+                inflight = threading.Event()
+                _response_inflight[key] = inflight
+                generation = _response_cache_generation
+                break
+        # Another request is loading this key; if it fails, the next loop iteration takes over
+        inflight.wait(RESPONSE_CACHE_WAIT_SECONDS)
     
-    cursor.execute(f"UPDATE users SET is_blocked = TRUE WHERE telegram_id = {telegram_id}")
+    try:
+        body = json.dumps(loader())
+        etag = '"' + hashlib.sha256(body.encode('utf-8')).hexdigest()[:32] + '"'
+        with _response_cache_lock:
+            # A moderation action invalidated the cache while this loader ran: its result may predate
+            # the change, so it is returned to this caller but not cached
+            if generation == _response_cache_generation:
+                _response_cache[key] = (body, etag, time.monotonic() + RESPONSE_CACHE_TTL_SECONDS.get(endpoint, 0))
+                _response_cache.move_to_end(key)
+                while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+                    _response_cache.popitem(last=False)
+        return body, etag
+    finally:
+        with _response_cache_lock:
+            _response_inflight.pop(key, None)
+        inflight.set()
+
+def invalidate_response_cache():
+    global _response_cache_generation
+    with _response_cache_lock:
+        _response_cache_generation += 1
+        _response_cache.clear()
+
+def json_response(event: Dict[str, Any], body: str, etag: str, max_age: int) -> Dict[str, Any]:
+    """Build a cacheable JSON response: 304 on a matching If-None-Match, gzip for large bodies"""
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'ETag',
+        'Cache-Control': f'private, max-age={max_age}',
+        'Vary': 'Accept-Encoding',
+        'ETag': etag
+    }
     
-    cursor.execute(f"""
-        UPDATE chats 
-        SET is_active = FALSE, ended_at = CURRENT_TIMESTAMP 
-        WHERE (user1_telegram_id = {telegram_id} OR user2_telegram_id = {telegram_id}) 
-        AND is_active = TRUE
-    """)
+    encoded = body.encode('utf-8')
+    use_gzip = len(encoded) >= GZIP_MIN_BYTES and 'gzip' in (get_header(event, 'accept-encoding') or '')
+    if use_gzip:
+        # A different representation needs its own strong validator
+        headers['ETag'] = etag[:-1] + '-gz"'
     
-    cursor.execute(f"UPDATE users SET is_in_chat = FALSE, current_chat_id = NULL WHERE telegram_id = {telegram_id}")
+    if_none_match = get_header(event, 'if-none-match')
+    if if_none_match and (etag_matches(if_none_match, etag) or etag_matches(if_none_match, headers['ETag'])):
+        return {'statusCode': 304, 'headers': headers, 'body': ''}
     
-    cursor.close()
-    conn.close()
+    if not use_gzip:
+        return {'statusCode': 200, 'headers': headers, 'body': body}
     
-    return True
+    headers['Content-Encoding'] = 'gzip'
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': base64.b64encode(gzip.compress(encoded, compresslevel=6)).decode('ascii'),
+        'isBase64Encoded': True
+    }
 
-def resolve_complaint(complaint_id: int, status: str) -> bool:
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def cache_path(file_unique_id: str) -> str:
+    return os.path.join(ATTACHMENT_CACHE_DIR, re.sub(r'[^A-Za-z0-9_-]', '_', file_unique_id))
+
+def evict_disk_cache():
+    """Drop least recently used cache files until the cache fits ATTACHMENT_CACHE_MAX_BYTES"""
+    entries = []
+    total = 0
+    for entry in os.scandir(ATTACHMENT_CACHE_DIR):
+        if entry.is_file() and not entry.name.startswith('.'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+    for _, size, path in sorted(entries):
+        if total <= ATTACHMENT_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def fetch_to_disk_cache(file_id: str, file_unique_id: str) -> Optional[str]:
+    """Return a local copy of a Telegram file, downloading it in chunks on a cache miss"""
+    path = cache_path(file_unique_id)
+    if os.path.exists(path):
+        os.utime(path)
+        return path
     
-    status_escaped = status.replace("'", "''")
-    cursor.execute(f"UPDATE complaints SET status = '{status_escaped}' WHERE id = {complaint_id}")
+    file_url = resolve_file_url(file_id)
+    if not file_url:
+        return None
     
-    cursor.close()
-    conn.close()
+    os.makedirs(ATTACHMENT_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=ATTACHMENT_CACHE_DIR, prefix='.incoming-')
+    try:
+        size = 0
+        with os.fdopen(fd, 'wb') as tmp, http_session().get(file_url, stream=True, timeout=30) as download:
+            if download.status_code != 200:
+                return None
+            for chunk in download.iter_content(ATTACHMENT_CHUNK_SIZE):
+                size += len(chunk)
+                if size > ATTACHMENT_MAX_BYTES:
+                    return None
+                tmp.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
     
-    return True
+    evict_disk_cache()
+    return path
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+def hot_cache_get(etag: str) -> Optional[bytes]:
+    data = _hot_cache.get(etag)
+    if data is not None:
+        _hot_cache.move_to_end(etag)
+    return data
+
+def hot_cache_put(etag: str, data: bytes):
+    global _hot_cache_bytes
+    if len(data) > HOT_CACHE_ITEM_MAX_BYTES or etag in _hot_cache:
+        return
+    _hot_cache[etag] = data
+    _hot_cache_bytes += len(data)
+    while _hot_cache_bytes > HOT_CACHE_MAX_BYTES:
+        _, evicted = _hot_cache.popitem(last=False)
+        _hot_cache_bytes -= len(evicted)
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single 'bytes=' range into inclusive (start, end); raises ValueError if unsatisfiable"""
+    if not range_header:
+        return None
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', range_header)
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    if match.group(1) == '':
+        start = max(0, size - int(match.group(2)))
+        end = size - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    if start >= size or start > end:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+def read_blob_range(sha256: str, start: int, length: int) -> bytes:
+    """Read [start, start + length) of a stored blob; uncompressed storage lets substring() fetch only that slice"""
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT substring(content FROM %s FOR %s) FROM t_p14838969_anon_talk_bot.attachment_blobs WHERE sha256 = %s",
+            (start + 1, length, sha256)
+        )
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] is not None else b''
+
+def read_range(path: str, start: int, length: int) -> bytes:
+    """Read [start, start + length) in ATTACHMENT_CHUNK_SIZE pieces"""
+    chunks = []
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(ATTACHMENT_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            length -= len(chunk)
+    return b''.join(chunks)
+
+def serve_attachment(event: Dict[str, Any], params: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Serve attachment bytes with ETag/Last-Modified revalidation and single-range requests.
+    A response never carries more than ATTACHMENT_MAX_RESPONSE_BYTES: a larger file is served only
+    in ranges (media elements request them on their own) and a request without Range gets 413.
+    """
+    try:
+        message_id = int(params.get('id', ''))
+        # messages is partitioned by day on sent_at; the key lets Postgres probe one partition
+        sent_at = datetime.fromisoformat(params.get('sent_at', ''))
+    except ValueError:
+        raise ValueError('id and sent_at required')
+    
+    with pooled_connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+        cursor.execute("""
+            SELECT m.file_id, m.file_unique_id, m.blob_sha256, m.content_type, m.sent_at, b.mime_type,
+                b.size_bytes AS blob_size, b.content IS NOT NULL AS blob_stored
+            FROM t_p14838969_anon_talk_bot.messages m
+            LEFT JOIN t_p14838969_anon_talk_bot.attachment_blobs b ON b.sha256 = m.blob_sha256
+            WHERE m.id = %s AND m.sent_at = %s AND m.file_id IS NOT NULL
+        """, (message_id, sent_at))
+        attachment = cursor.fetchone()
+    
+    not_found = {
+        'statusCode': 404,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': 'Attachment not found'})
+    }
+    if not attachment:
+        return not_found
+    
+    etag = f'"{attachment["blob_sha256"] or attachment["file_unique_id"] or attachment["file_id"]}"'
+    last_modified = attachment['sent_at'].replace(tzinfo=timezone.utc)
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'Content-Range, ETag',
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': formatdate(last_modified.timestamp(), usegmt=True),
+        'Cache-Control': 'private, max-age=86400'
+    }
+    
+    if_none_match = get_header(event, 'if-none-match')
+    if_modified_since = get_header(event, 'if-modified-since')
+    not_modified = False
+    if if_none_match:
+        not_modified = etag_matches(if_none_match, etag)
+    elif if_modified_since:
+        try:
+            not_modified = parsedate_to_datetime(if_modified_since) >= last_modified.replace(microsecond=0)
+        except (TypeError, ValueError):
+            not_modified = False
+    if not_modified:
+        return {'statusCode': 304, 'headers': headers, 'body': ''}
+    
+    data = hot_cache_get(etag)
+    if data is not None:
+        size = len(data)
+        read = None
+    elif attachment['blob_stored']:
+        size = attachment['blob_size']
+        read = functools.partial(read_blob_range, attachment['blob_sha256'])
+    else:
+        path = fetch_to_disk_cache(attachment['file_id'], attachment['file_unique_id'] or attachment['file_id'])
+        if not path:
+            return not_found
+        size = os.path.getsize(path)
+        read = functools.partial(read_range, path)
+    if data is None and size <= HOT_CACHE_ITEM_MAX_BYTES:
+        data = read(0, size)
+        hot_cache_put(etag, data)
+    
+    try:
+        requested = parse_range(get_header(event, 'range'), size)
+    except ValueError:
+        headers['Content-Range'] = f'bytes */{size}'
+        return {'statusCode': 416, 'headers': headers, 'body': ''}
+    
+    if requested is None:
+        if size > ATTACHMENT_MAX_RESPONSE_BYTES:
+            headers['Content-Type'] = 'application/json'
+            return {
+                'statusCode': 413,
+                'headers': headers,
+                'body': json.dumps({'error': 'Attachment is too large for one response, request it in ranges', 'size': size})
+            }
+        status, start, end = 200, 0, size - 1
+    else:
+        start, end = requested
+        # A shorter range than requested is valid; the client continues from Content-Range
+        end = min(end, start + ATTACHMENT_MAX_RESPONSE_BYTES - 1)
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    
+    length = end - start + 1 if size else 0
+    body = data[start:start + length] if data is not None else read(start, length)
+    
+    headers['Content-Type'] = attachment['mime_type'] or CONTENT_TYPE_MIME.get(attachment['content_type'], 'application/octet-stream')
+    headers['Content-Length'] = str(len(body))
+    return {
+        'statusCode': status,
+        'headers': headers,
+        'body': base64.b64encode(body).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+def notify_admin(cursor, event: Dict[str, Any]):
+    """Append a dashboard delta so other open dashboards see moderation changes"""
+    cursor.execute("INSERT INTO t_p14838969_anon_talk_bot.admin_events (payload) VALUES (%s)", (json.dumps(event),))
+
+def parse_id_list(value: Any, name: str) -> List[int]:
+    """Validate a JSON list of ids from a bulk action body, dropping duplicates"""
+    if not isinstance(value, list) or not value:
+        raise ValueError(f'{name} must be a non-empty list')
+    if len(value) > BULK_MAX_IDS:
+        raise ValueError(f'{name} accepts at most {BULK_MAX_IDS} ids')
+    try:
+        return list(dict.fromkeys(int(item) for item in value))
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must contain integer ids')
+
+def update_complaints(cursor, complaint_ids: List[int], status: str) -> Dict[str, str]:
+    """Set status on complaints inside the caller's transaction; per-id updated/unchanged/not_found"""
+    cursor.execute("""
+        UPDATE complaints c SET status = %s, reviewed_at = CURRENT_TIMESTAMP
+        FROM (SELECT id, status FROM complaints WHERE id = ANY(%s) FOR UPDATE) previous
+        WHERE c.id = previous.id
+        RETURNING c.id, previous.status
+    """, (status, complaint_ids))
+    previous = {row[0]: row[1] for row in cursor.fetchall()}
+    
+    changed = [complaint_id for complaint_id, old_status in previous.items() if old_status != status]
+    if changed:
+        pending_delta = sum(int(status == 'pending') - int(previous[complaint_id] == 'pending') for complaint_id in changed)
+        notify_admin(cursor, {
+            'type': 'complaints_updated',
+            'complaint_ids': changed,
+            'status': status,
+            'delta': {'pending_complaints': pending_delta}
+        })
+    
+    return {
+        str(complaint_id): 'not_found' if complaint_id not in previous
+        else 'unchanged' if previous[complaint_id] == status else 'updated'
+        for complaint_id in complaint_ids
+    }
+
+def send_partner_notice(partner: Dict[str, Any]) -> bool:
+    """Tell a user their chat was closed because the partner was blocked"""
+    try:
+        if partner['platform'] == 'vk':
+            response = http_session().post(f'{VK_API_URL}/messages.send', data={
+                'user_id': partner['platform_id'],
+                'message': PARTNER_BLOCKED_NOTICE,
+                'random_id': secrets.randbelow(2 ** 31),
+                'access_token': VK_GROUP_TOKEN,
+                'v': VK_API_VERSION
+            }, timeout=10)
+            return response.status_code == 200 and 'error' not in response.json()
+        response = http_session().post(
+            f'{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMessage',
+            json={'chat_id': partner['telegram_id'], 'text': PARTNER_BLOCKED_NOTICE},
+            timeout=10
+        )
+        return response.status_code == 200
+    except (requests.RequestException, ValueError):
+        return False
+
+def record_chats_ended(cursor, ended_by: List[int], durations: List[int]):
+    """Count chats ended by moderation, with their durations, towards stats_rollup like the bots' end_chat does"""
+    cursor.execute("""
+        INSERT INTO t_p14838969_anon_talk_bot.stats_rollup (bucket, metric, platform, gender, value)
+        SELECT date_trunc('minute', CURRENT_TIMESTAMP), c.metric, COALESCE(u.platform, 'telegram'),
+               CASE WHEN u.gender IN ('male', 'female') THEN u.gender ELSE 'unknown' END, SUM(c.value)
+        FROM unnest(%s::bigint[], %s::bigint[]) AS e(telegram_id, duration_seconds)
+        JOIN users u ON u.telegram_id = e.telegram_id
+        CROSS JOIN LATERAL (VALUES ('chats_ended', 1::bigint), ('chat_duration_seconds', e.duration_seconds)) AS c(metric, value)
+        GROUP BY 2, 3, 4
+        ON CONFLICT (bucket, metric, platform, gender) DO UPDATE SET value = stats_rollup.value + EXCLUDED.value
+    """, (ended_by, durations))
+
+def bulk_block(telegram_ids: List[int], complaint_ids: Optional[List[int]] = None) -> Dict[str, Any]:
+    """
+    Block users, end their active chats and optionally resolve complaints in one transaction.
+    Partners of the ended chats are notified after commit.
+    """
+    blocked_set = set(telegram_ids)
+    
+    with pooled_connection() as conn:
+        conn.autocommit = False
+        with conn, conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE users u SET is_blocked = TRUE, is_searching = FALSE
+                FROM (SELECT telegram_id, is_blocked FROM users WHERE telegram_id = ANY(%s) FOR UPDATE) previous
+                WHERE u.telegram_id = previous.telegram_id
+                RETURNING u.telegram_id, previous.is_blocked
+            """, (telegram_ids,))
+            was_blocked = {row[0]: row[1] for row in cursor.fetchall()}
+            
+            cursor.execute("""
+                UPDATE chats SET is_active = FALSE, ended_at = CURRENT_TIMESTAMP
+                WHERE is_active = TRUE AND (user1_telegram_id = ANY(%s) OR user2_telegram_id = ANY(%s))
+                RETURNING id, user1_telegram_id, user2_telegram_id, EXTRACT(EPOCH FROM (ended_at - started_at))
+            """, (telegram_ids, telegram_ids))
+            ended_chats = cursor.fetchall()
+            
+            partner_ids = {
+                member for _, user1, user2, _ in ended_chats for member in (user1, user2)
+                if member not in blocked_set
+            }
+            
+            cursor.execute("""
+                UPDATE users SET is_in_chat = FALSE, current_chat_id = NULL
+                WHERE telegram_id = ANY(%s) AND (is_in_chat = TRUE OR current_chat_id IS NOT NULL)
+                RETURNING telegram_id, platform, platform_id
+            """, (telegram_ids + list(partner_ids),))
+            partners = [
+                {'telegram_id': row[0], 'platform': row[1] or 'telegram', 'platform_id': row[2]}
+                for row in cursor.fetchall() if row[0] in partner_ids
+            ]
+            
+            if ended_chats:
+                # The blocked member ended the chat; their platform and gender label the rollup rows
+                record_chats_ended(
+                    cursor,
+                    [user1 if user1 in blocked_set else user2 for _, user1, user2, _ in ended_chats],
+                    [int(duration or 0) for *_, duration in ended_chats]
+                )
+            
+            for chat_id, *_ in ended_chats:
+                notify_admin(cursor, {'type': 'chat_ended', 'chat_id': chat_id, 'delta': {'active_chats': -1}})
+            
+            complaint_results = update_complaints(cursor, complaint_ids, 'resolved') if complaint_ids else {}
+    
+    notified = 0
+    if partners:
+        with ThreadPoolExecutor(max_workers=min(PARTNER_NOTIFY_WORKERS, len(partners)), thread_name_prefix='partner-notice') as pool:
+            notified = sum(pool.map(send_partner_notice, partners))
+    
+    return {
+        'success': True,
+        'results': {
+            str(telegram_id): 'not_found' if telegram_id not in was_blocked
+            else 'already_blocked' if was_blocked[telegram_id] else 'blocked'
+            for telegram_id in telegram_ids
+        },
+        'complaints': complaint_results,
+        'chats_ended': len(ended_chats),
+        'partners_notified': notified
+    }
+
+def bulk_resolve(complaint_ids: List[int], status: str) -> Dict[str, Any]:
+    if status not in COMPLAINT_STATUSES:
+        raise ValueError('Invalid status')
+    
+    with pooled_connection() as conn:
+        conn.autocommit = False
+        with conn, conn.cursor() as cursor:
+            results = update_complaints(cursor, complaint_ids, status)
+    
+    return {'success': True, 'results': results}
+
+PANEL_LOADERS = {
+    'stats': lambda params: get_stats(),
+    'chats': get_active_chats,
+    'complaints': get_complaints,
+    'attachments': get_attachments,
+}
+GET_ENDPOINTS = frozenset((*PANEL_LOADERS, 'dashboard', 'events', 'file', 'metrics'))
+
+def panel_params(panel: str, params: Dict[str, str]) -> Dict[str, str]:
+    """Params that identify a panel's data; stats takes none"""
+    if panel == 'stats':
+        return {'endpoint': panel}
+    scoped = {key: value for key, value in params.items() if key not in ('endpoint', 'panels')}
+    scoped['endpoint'] = panel
+    return scoped
+
+def load_panel(panel: str, params: Dict[str, str]) -> Tuple[str, str]:
+    scoped = panel_params(panel, params)
+    return cached_json(panel, scoped, lambda: PANEL_LOADERS[panel](scoped))
+
+def get_dashboard(params: Dict[str, str]) -> Tuple[str, str, int]:
+    """Load the requested panels concurrently and join their cached JSON bodies into one object"""
+    requested = params.get('panels') or ','.join(PANEL_LOADERS)
+    panels = list(dict.fromkeys(panel.strip() for panel in requested.split(',') if panel.strip()))
+    unknown = [panel for panel in panels if panel not in PANEL_LOADERS]
+    if not panels or unknown:
+        raise ValueError(f'Unknown panels: {", ".join(unknown)}' if unknown else 'No panels requested')
+    
+    # Paging and filter params apply to attachments; the other listings load their first page
+    results = list(_dashboard_executor.map(
+        lambda panel: load_panel(panel, params if panel == 'attachments' else {}),
+        panels
+    ))
+    
+    body = '{' + ', '.join(f'{json.dumps(panel)}: {panel_body}' for panel, (panel_body, _) in zip(panels, results)) + '}'
+    etag = '"' + hashlib.sha256(''.join(panel_etag for _, panel_etag in results).encode('utf-8')).hexdigest()[:32] + '"'
+    return body, etag, min(RESPONSE_CACHE_TTL_SECONDS[panel] for panel in panels)
+
+def listen_admin_events():
+    """Listener thread: LISTEN on the events channel and wake long polls waiting for a newer event id"""
+    global _events_notified_id
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(DATABASE_URL)
+            conn.autocommit = True
+            conn.cursor().execute(f'LISTEN {ADMIN_EVENTS_CHANNEL}')
+            
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                notified = [int(notification.payload) for notification in conn.notifies if notification.payload.isdigit()]
+                conn.notifies.clear()
+                if notified:
+                    with _events_cond:
+                        _events_notified_id = max(_events_notified_id, *notified)
+                        _events_cond.notify_all()
+        except (psycopg2.Error, OSError) as e:
+            print(f'[admin-api] event listener reconnecting: {e}')
+        finally:
+            if conn is not None:
+                conn.close()
+        time.sleep(EVENTS_RECONNECT_DELAY_SECONDS)
+
+def ensure_event_listener():
+    global _events_listener
+    with _events_cond:
+        if _events_listener is None:
+            _events_listener = threading.Thread(target=listen_admin_events, name='admin-events', daemon=True)
+            _events_listener.start()
+
+def fetch_events(since: int) -> List[Tuple[int, Dict[str, Any]]]:
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT id, payload FROM t_p14838969_anon_talk_bot.admin_events WHERE id > %s ORDER BY id LIMIT %s",
+            (since, EVENTS_PAGE_SIZE)
+        )
+        return cursor.fetchall()
+
+def event_id_range() -> Tuple[int, int]:
+    """(oldest, newest) retained event id, both 0 while the log is empty"""
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM t_p14838969_anon_talk_bot.admin_events")
+        return cursor.fetchone()
+
+def get_events(params: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Long-poll for dashboard deltas after the given cursor, the last admin_events id the client has seen.
+    reset=true only when the cursor cannot be continued (events after it were purged, or it is unknown)
+    and the client should reload the dashboard.
+    """
+    try:
+        timeout = max(0, min(int(params.get('timeout', EVENTS_LONG_POLL_SECONDS)), EVENTS_LONG_POLL_SECONDS))
+    except ValueError:
+        raise ValueError('Invalid timeout')
+    
+    oldest, newest = event_id_range()
+    if not params.get('cursor'):
+        return {'events': [], 'cursor': str(newest), 'reset': False}
+    since = int(params['cursor']) if params['cursor'].isdigit() else -1
+    # A cursor from before the purge horizon, or not an event id at all (e.g. from an older deployment)
+    if since > newest or since < oldest - 1:
+        return {'events': [], 'cursor': str(newest), 'reset': True}
+    
+    ensure_event_listener()
+    deadline = time.monotonic() + timeout
+    while True:
+        # Snapshot before reading: a NOTIFY that arrives after it is for a row the read may have missed
+        notified = _events_notified_id
+        events = fetch_events(since)
+        remaining = deadline - time.monotonic()
+        if events or remaining <= 0:
+            break
+        with _events_cond:
+            _events_cond.wait_for(lambda: _events_notified_id > notified, min(remaining, EVENTS_POLL_SECONDS))
+    
+    return {
+        'events': [payload for _, payload in events],
+        'cursor': str(events[-1][0] if events else since),
+        'reset': False
+    }
+
+def prometheus_labels(labels: Dict[str, Any]) -> str:
+    return ','.join(f'{key}="{str(value).translate(PROMETHEUS_LABEL_ESCAPES)}"' for key, value in labels.items())
+
+def metric_family(lines: List[str], name: str, kind: str, help_text: str):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+
+def sample(lines: List[str], name: str, labels: Dict[str, Any], value: Any):
+    lines.append(f'{name}{{{prometheus_labels(labels)}}} {value}')
+
+def histogram_samples(lines: List[str], name: str, labels: Dict[str, Any], histogram: LatencyHistogram):
+    """Exposition lines of one histogram; buckets are stored per-bucket and emitted cumulatively"""
+    cumulative = 0
+    for bound, bucket_count in zip((*LATENCY_BUCKETS, '+Inf'), histogram.bucket_counts):
+        cumulative += bucket_count
+        sample(lines, f'{name}_bucket', {**labels, 'le': bound}, cumulative)
+    sample(lines, f'{name}_sum', labels, histogram.seconds_sum)
+    sample(lines, f'{name}_count', labels, histogram.count)
+
+def render_metrics() -> str:
+    """
+    This instance's request, pool and outbound call metrics plus the search queue read from the database,
+    in the Prometheus text exposition format. Bot update and handler metrics are scraped from the bots themselves.
+    """
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        execute_prepared(cursor, 'metrics_search_queue')
+        search_queue = cursor.fetchall()
+    
+    lines: List[str] = []
+    metric_family(lines, 'bot_search_queue_depth', 'gauge', 'Users waiting for a partner, by platform and own gender')
+    for platform, gender, waiting in search_queue:
+        sample(lines, 'bot_search_queue_depth', {'platform': platform, 'gender': gender}, waiting)
+    
+    # Snapshot with list(): another thread may add a key while the page is rendered
+    request_metrics = list(_request_metrics.items())
+    metric_family(lines, 'admin_api_request_duration_seconds', 'histogram', 'Request latency per GET endpoint (POST actions as "post")')
+    for endpoint, histogram in request_metrics:
+        histogram_samples(lines, 'admin_api_request_duration_seconds', {'endpoint': endpoint}, histogram)
+    metric_family(lines, 'admin_api_responses_total', 'counter', 'Responses by endpoint and HTTP status')
+    for (endpoint, status), total in list(_responses.items()):
+        sample(lines, 'admin_api_responses_total', {'endpoint': endpoint, 'status': status}, total)
+    
+    pool = _db_pool
+    if pool is not None:
+        metric_family(lines, 'admin_api_db_pool_connections', 'gauge', 'Pooled database connections by state')
+        # ThreadedConnectionPool keeps checked-out connections in _used and idle ones in _pool
+        sample(lines, 'admin_api_db_pool_connections', {'state': 'in_use'}, len(pool._used))
+        sample(lines, 'admin_api_db_pool_connections', {'state': 'idle'}, len(pool._pool))
+    metric_family(
+        lines, 'admin_api_db_checkout_duration_seconds', 'histogram',
+        'Time to obtain a connection; source="fallback" are one-off connections opened while the pool was exhausted'
+    )
+    for source, histogram in list(_db_checkout_metrics.items()):
+        histogram_samples(lines, 'admin_api_db_checkout_duration_seconds', {'source': source}, histogram)
+    
+    metric_family(lines, 'admin_api_outbound_duration_seconds', 'histogram', 'Outbound Bot API and VK API latency')
+    for api, histogram in list(_api_metrics.items()):
+        histogram_samples(lines, 'admin_api_outbound_duration_seconds', {'api': api}, histogram)
+    metric_family(
+        lines, 'admin_api_outbound_responses_total', 'counter',
+        'Outbound responses by HTTP status (429 = rate limited) or exception name'
+    )
+    for (api, status), total in list(_api_responses.items()):
+        sample(lines, 'admin_api_outbound_responses_total', {'api': api, 'status': status}, total)
+    return '\n'.join(lines) + '\n'
+
+def request_label(event: Dict[str, Any]) -> str:
+    """Bounded metrics label for a request: the GET endpoint, or the lower-cased method otherwise"""
+    method = event.get('httpMethod', 'GET')
+    if method != 'GET':
+        return method.lower()
+    endpoint = (event.get('queryStringParameters') or {}).get('endpoint', 'stats')
+    return endpoint if endpoint in GET_ENDPOINTS else 'invalid'
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -261,25 +1402,55 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match, Range, X-Session-Token',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
     try:
+        params = event.get('queryStringParameters', {}) or {}
+        if not is_authorized(event, params):
+            return {
+                'statusCode': 401,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'error': 'Unauthorized'})
+            }
+        
         if method == 'GET':
-            params = event.get('queryStringParameters', {}) or {}
             endpoint = params.get('endpoint', 'stats')
             
-            if endpoint == 'stats':
-                data = get_stats()
-            elif endpoint == 'chats':
-                data = get_active_chats()
-            elif endpoint == 'complaints':
-                data = get_complaints()
-            elif endpoint == 'attachments':
-                data = get_attachments()
+            if endpoint in PANEL_LOADERS:
+                body, etag = load_panel(endpoint, params)
+                return json_response(event, body, etag, RESPONSE_CACHE_TTL_SECONDS[endpoint])
+            elif endpoint == 'dashboard':
+                body, etag, max_age = get_dashboard(params)
+                return json_response(event, body, etag, max_age)
+            elif endpoint == 'events':
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*',
+                        'Cache-Control': 'no-store'
+                    },
+                    'body': json.dumps(get_events(params))
+                }
+            elif endpoint == 'file':
+                return serve_attachment(event, params)
+            elif endpoint == 'metrics':
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'text/plain; version=0.0.4; charset=utf-8',
+                        'Access-Control-Allow-Origin': '*',
+                        'Cache-Control': 'no-store'
+                    },
+                    'body': render_metrics()
+                }
             else:
                 return {
                     'statusCode': 400,
@@ -289,15 +1460,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     },
                     'body': json.dumps({'error': 'Invalid endpoint'})
                 }
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps(data)
-            }
         
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
@@ -315,11 +1477,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'telegram_id required'})
                     }
                 
-                block_user(telegram_id)
-                
                 complaint_id = body.get('complaint_id')
-                if complaint_id:
-                    resolve_complaint(complaint_id, 'resolved')
+                complaint_ids = parse_id_list([complaint_id], 'complaint_id') if complaint_id else None
+                result = bulk_block(parse_id_list([telegram_id], 'telegram_id'), complaint_ids)
+                # Moderation changes what every cached listing shows
+                invalidate_response_cache()
                 
                 return {
                     'statusCode': 200,
@@ -327,7 +1489,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps({'success': True})
+                    'body': json.dumps(result)
+                }
+            
+            elif action == 'bulk_block':
+                telegram_ids = parse_id_list(body.get('telegram_ids'), 'telegram_ids')
+                complaint_ids = parse_id_list(body['complaint_ids'], 'complaint_ids') if body.get('complaint_ids') else None
+                result = bulk_block(telegram_ids, complaint_ids)
+                invalidate_response_cache()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps(result)
                 }
             
             elif action == 'resolve_complaint':
@@ -344,7 +1521,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'complaint_id required'})
                     }
                 
-                resolve_complaint(complaint_id, status)
+                result = bulk_resolve(parse_id_list([complaint_id], 'complaint_id'), status)
+                invalidate_response_cache()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps(result)
+                }
+            
+            elif action == 'bulk_resolve':
+                complaint_ids = parse_id_list(body.get('complaint_ids'), 'complaint_ids')
+                result = bulk_resolve(complaint_ids, body.get('status', 'resolved'))
+                invalidate_response_cache()
                 
                 return {
                     'statusCode': 200,
@@ -352,7 +1544,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps({'success': True})
+                    'body': json.dumps(result)
                 }
             
             else:
@@ -375,6 +1567,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'Method not allowed'})
             }
     
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'error': str(e)})
+        }
+    
     except Exception as e:
         return {
             'statusCode': 500,
@@ -383,4 +1585,89 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Access-Control-Allow-Origin': '*'
             },
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
+
+def tag_route(name: str):
+    """Tag the invocation with its route for a sampled profile"""
+    _profile_local.route = name
+
+def sample_stacks(stopped: threading.Event, stacks: Dict[str, int], handler: threading.Thread):
+    """Sampler thread: count the stacks of the handler thread and PROFILED_POOLS workers, rooted at the thread's name, until stopped"""
+    while not stopped.wait(PROFILE_INTERVAL_SECONDS):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            # Pool workers are named <prefix>_<n>; dropping n folds a whole pool into one root
+            root = names.get(thread_id, 'thread').rstrip('0123456789').rstrip('_')
+            if thread_id != handler.ident and root not in PROFILED_POOLS:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            frames.append(root)
+            stack = ';'.join(reversed(frames))
+            stacks[stack] = stacks.get(stack, 0) + 1
+
+def write_profile(route: str, stacks: Dict[str, int]):
+    """Append one invocation's collapsed stacks under its route, rotating the file past PROFILE_MAX_BYTES"""
+    if not stacks:
+        return
+    lines = ''.join(f'{route};{stack} {count}\n' for stack, count in stacks.items())
+    try:
+        with _profile_sink_lock:
+            os.makedirs(os.path.dirname(PROFILE_PATH), exist_ok=True)
+            with open(PROFILE_PATH, 'a', encoding='utf-8') as sink:
+                sink.write(lines)
+                full = sink.tell() > PROFILE_MAX_BYTES
+            if full:
+                os.replace(PROFILE_PATH, f'{PROFILE_PATH}.1')
+    except OSError:
+        # Profiles are diagnostics; a full or read-only disk must not fail the invocation
+        pass
+
+def profiled(function: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    """Run a PROFILE_SAMPLE_RATE fraction of invocations under sample_stacks; a no-op when the rate is 0"""
+    if PROFILE_SAMPLE_RATE <= 0:
+        return function
+    
+    @functools.wraps(function)
+    def sampled(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        if secrets.randbelow(1_000_000) >= PROFILE_SAMPLE_RATE * 1_000_000:
+            return function(event, context)
+        _profile_local.route = None
+        stacks: Dict[str, int] = {}
+        stopped = threading.Event()
+        sampler = threading.Thread(target=sample_stacks, args=(stopped, stacks, threading.current_thread()), name='stack-sampler', daemon=True)
+        sampler.start()
+        try:
+            return function(event, context)
+        finally:
+            stopped.set()
+            sampler.join()
+            write_profile(getattr(_profile_local, 'route', None) or 'unrouted', stacks)
+    return sampled
+
+@profiled
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    started = time.perf_counter()
+    endpoint = request_label(event)
+    tag_route(endpoint)
+    response = handle_request(event, context)
+    observe_latency(_request_metrics, endpoint, time.perf_counter() - started, response['statusCode'] >= 500)
+    bump_counter(_responses, (endpoint, str(response['statusCode'])))
+    return response
+
+def warm_up():
+    """Pay the import, connect and PREPARE costs during init instead of on the first request"""
+    http_session()
+    try:
+        with pooled_connection() as conn, conn.cursor() as cursor:
+            for name in PREPARED_STATEMENTS:
+                prepare_statement(cursor, name)
+    except psycopg2.Error:
+        # An unreachable database must not fail init; the first request connects on its own
+        pass
+
+if WARM_START:
+    warm_up()
@@ -4,15 +4,52 @@ Args: event with httpMethod, body, headers; context with request_id
 Returns: HTTP response with session token or error
 '''
 
+import functools
+import importlib
 import json
 import os
 import secrets
 import hashlib
-from typing import Dict, Any, Optional
+import hmac
+import base64
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Any, Optional, Set, List, Callable
 from datetime import datetime, timedelta
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import bcrypt
+
+class LazyModule:
+    """
+    Stand-in for a heavy module that imports it (plus listed submodules) on first attribute access.
+    Once loaded it rebinds the owning global to the real module, so later lookups cost nothing.
+    """
+    
+    def __init__(self, namespace: Dict[str, Any], name: str, *submodules: str):
+        self._namespace = namespace
+        self._name = name
+        self._submodules = submodules
+        self._module = None
+        self._lock = threading.Lock()
+    
+    def load(self):
+        with self._lock:
+            if self._module is None:
+                module = importlib.import_module(self._name)
+                for submodule in self._submodules:
+                    importlib.import_module(f'{self._name}.{submodule}')
+                self._namespace[self._name] = module
+                self._module = module
+        return self._module
+    
+    def __getattr__(self, attr: str):
+        return getattr(self._module or self.load(), attr)
+
+# Only login and legacy-token checks touch psycopg2/bcrypt; OPTIONS and signed-token
+# verification cold-start without importing them
+psycopg2 = LazyModule(globals(), 'psycopg2', 'extras')
+bcrypt = LazyModule(globals(), 'bcrypt')
 
 DATABASE_URL = os.environ.get('DATABASE_URL', '')
 ADMIN_PASSWORD_HASH = os.environ.get('ADMIN_PASSWORD_HASH', '')
@@ -21,94 +58,259 @@ MAX_ATTEMPTS = 5
 ATTEMPT_WINDOW_MINUTES = 15
 SESSION_DURATION_HOURS = 24
 
+# Sliding-window rate limit: per-IP attempt counts in one-minute buckets, kept in a bounded
+# in-process LRU and persisted to login_attempt_buckets so other instances see them
+RATE_LIMIT_BUCKET_SECONDS = 60
+RATE_LIMIT_BUCKETS = ATTEMPT_WINDOW_MINUTES * 60 // RATE_LIMIT_BUCKET_SECONDS
+RATE_LIMIT_MAX_TRACKED_IPS = 10000
+RATE_LIMIT_SYNC_SECONDS = 10
+
+# bcrypt runs on a small worker pool; once BCRYPT_WORKERS + BCRYPT_MAX_PENDING checks are in
+# flight further logins are shed with 429 instead of queueing CPU work
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', '2'))
+BCRYPT_MAX_PENDING = int(os.environ.get('BCRYPT_MAX_PENDING', '4'))
+BCRYPT_TIMEOUT_SECONDS = 10
+# Optional cache of recent successful checks, keyed by an HMAC of IP + password under a per-process
+# random salt; 0 disables it
+PASSWORD_CACHE_TTL_SECONDS = int(os.environ.get('PASSWORD_CACHE_TTL_SECONDS', '0'))
+PASSWORD_CACHE_MAX_SIZE = 256
+
+# Signed sessions: the token is "<session id>.<expires unix>.<HMAC-SHA256>", with the client IP
+# folded into the MAC, so verification needs no DB round trip. Only logouts are looked up,
+# from a revocation list cached in memory. Without a secret the legacy DB-backed tokens are issued.
+ADMIN_SESSION_SECRET = os.environ.get('ADMIN_SESSION_SECRET', '')
+ADMIN_SESSION_BIND_IP = os.environ.get('ADMIN_SESSION_BIND_IP', 'true').lower() == 'true'
+REVOCATION_REFRESH_SECONDS = 30
+# Sampling profiler as in admin-api: the handler thread and PROFILED_POOLS workers, collapsed into PROFILE_DIR
+PROFILED_POOLS = ('bcrypt',)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000
+PROFILE_PATH = os.path.join(os.environ.get('PROFILE_DIR', '/tmp/profiles'), 'admin-auth.collapsed')
+# Past this size the file is rotated to .collapsed.1, so the directory holds at most about twice the limit
+PROFILE_MAX_BYTES = int(os.environ.get('PROFILE_MAX_BYTES', str(16 * 1024 * 1024)))
+
+_revoked_sessions: Set[str] = set()
+_revoked_loaded_at: Optional[float] = None
+_revocation_lock = threading.Lock()
+_attempt_windows: 'OrderedDict[str, AttemptWindow]' = OrderedDict()
+_rate_limit_lock = threading.Lock()
+_bcrypt_pool = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix='bcrypt')
+_bcrypt_slots = threading.BoundedSemaphore(BCRYPT_WORKERS + BCRYPT_MAX_PENDING)
+_password_cache_salt = secrets.token_bytes(32)
+_password_cache: 'OrderedDict[bytes, float]' = OrderedDict()
+_password_cache_lock = threading.Lock()
+_profile_local = threading.local()
+_profile_sink_lock = threading.Lock()
+
+class PasswordCheckBusy(Exception):
+    """All bcrypt workers and queue slots are taken"""
+
 def get_db_connection():
     conn = psycopg2.connect(DATABASE_URL)
     conn.autocommit = True
     return conn
 
-def escape_sql(value: Any) -> str:
-    if value is None:
-        return 'NULL'
-    if isinstance(value, bool):
-        return 'TRUE' if value else 'FALSE'
-    if isinstance(value, (int, float)):
-        return str(value)
-    return f"'{str(value).replace(chr(39), chr(39)+chr(39))}'"
-
 def get_client_ip(event: Dict[str, Any]) -> str:
     headers = event.get('headers', {})
     return headers.get('x-forwarded-for', headers.get('x-real-ip', 'unknown')).split(',')[0].strip()
 
-def check_rate_limit(ip_address: str) -> bool:
-    conn = get_db_connection()
-    cursor = conn.cursor()
+class AttemptWindow:
+    """Fixed-size ring of per-minute attempt counters for one IP"""
+    
+    __slots__ = ('buckets', 'counts', 'synced_at')
     
-    time_threshold = datetime.now() - timedelta(minutes=ATTEMPT_WINDOW_MINUTES)
-    time_sql = escape_sql(time_threshold.isoformat())
-    ip_sql = escape_sql(ip_address)
+    def __init__(self):
+        self.buckets: List[int] = [0] * RATE_LIMIT_BUCKETS
+        self.counts: List[int] = [0] * RATE_LIMIT_BUCKETS
+        self.synced_at = time.monotonic()
     
+    def add(self, bucket: int, attempts: int = 1):
+        slot = bucket % RATE_LIMIT_BUCKETS
+        if self.buckets[slot] != bucket:
+            self.buckets[slot] = bucket
+            self.counts[slot] = 0
+        self.counts[slot] += attempts
+    
+    def set(self, bucket: int, attempts: int):
+        """Overwrite a bucket's count with the value shared through login_attempt_buckets"""
+        slot = bucket % RATE_LIMIT_BUCKETS
+        self.buckets[slot] = bucket
+        self.counts[slot] = attempts
+    
+    def total(self, bucket: int) -> int:
+        oldest = bucket - RATE_LIMIT_BUCKETS
+        return sum(count for start, count in zip(self.buckets, self.counts) if start > oldest)
+
+def current_bucket() -> int:
+    return int(time.time()) // RATE_LIMIT_BUCKET_SECONDS
+
+def load_attempt_window(ip_address: str) -> AttemptWindow:
+    """Return the IP's window, reloading it from login_attempt_buckets when older than RATE_LIMIT_SYNC_SECONDS"""
+    with _rate_limit_lock:
+        window = _attempt_windows.get(ip_address)
+        if window and time.monotonic() - window.synced_at < RATE_LIMIT_SYNC_SECONDS:
+            _attempt_windows.move_to_end(ip_address)
+            return window
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
     cursor.execute(
-        f"SELECT COUNT(*) as count FROM login_attempts "
-        f"WHERE ip_address = {ip_sql} AND attempted_at > {time_sql}"
+        "SELECT bucket, attempts FROM login_attempt_buckets WHERE ip_address = %s AND bucket > %s",
+        (ip_address, current_bucket() - RATE_LIMIT_BUCKETS)
     )
-    result = cursor.fetchone()
-    
+    rows = cursor.fetchall()
     cursor.close()
     conn.close()
     
-    return result[0] < MAX_ATTEMPTS
+    window = AttemptWindow()
+    for bucket, attempts in rows:
+        window.add(bucket, attempts)
+    
+    with _rate_limit_lock:
+        _attempt_windows[ip_address] = window
+        _attempt_windows.move_to_end(ip_address)
+        while len(_attempt_windows) > RATE_LIMIT_MAX_TRACKED_IPS:
+            _attempt_windows.popitem(last=False)
+    return window
+
+def check_rate_limit(ip_address: str) -> bool:
+    window = load_attempt_window(ip_address)
+    with _rate_limit_lock:
+        return window.total(current_bucket()) < MAX_ATTEMPTS
 
 def log_attempt(ip_address: str, success: bool):
+    """
+    Count the attempt in the IP's current bucket and keep it in the login_attempts audit log.
+    The upsert returns the bucket's count across all instances, so the next check on this
+    instance already sees attempts made through the others.
+    """
+    bucket = current_bucket()
+    window = load_attempt_window(ip_address)
+    
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    ip_sql = escape_sql(ip_address)
-    success_sql = 'TRUE' if success else 'FALSE'
-    
     cursor.execute(
-        f"INSERT INTO login_attempts (ip_address, success) VALUES ({ip_sql}, {success_sql})"
+        "INSERT INTO login_attempt_buckets (ip_address, bucket, attempts) VALUES (%s, %s, 1) "
+        "ON CONFLICT (ip_address, bucket) DO UPDATE SET attempts = login_attempt_buckets.attempts + 1 "
+        "RETURNING attempts",
+        (ip_address, bucket)
     )
+    attempts = cursor.fetchone()[0]
+    cursor.execute("INSERT INTO login_attempts (ip_address, success) VALUES (%s, %s)", (ip_address, success))
     
     cursor.close()
     conn.close()
+    
+    with _rate_limit_lock:
+        window.set(bucket, attempts)
+
+def password_cache_key(password: str, ip_address: str) -> bytes:
+    message = '\0'.join((ip_address, ADMIN_PASSWORD_HASH, password)).encode('utf-8')
+    return hmac.new(_password_cache_salt, message, hashlib.sha256).digest()
 
-def verify_password(password: str) -> bool:
+def verify_password(password: str, ip_address: str) -> bool:
+    """bcrypt check on the worker pool; raises PasswordCheckBusy when the queue is full"""
     if not ADMIN_PASSWORD_HASH:
         return False
-    return bcrypt.checkpw(password.encode('utf-8'), ADMIN_PASSWORD_HASH.encode('utf-8'))
+    
+    cache_key = password_cache_key(password, ip_address) if PASSWORD_CACHE_TTL_SECONDS > 0 else None
+    if cache_key:
+        with _password_cache_lock:
+            expires = _password_cache.get(cache_key)
+            if expires and expires > time.monotonic():
+                return True
+    
+    if not _bcrypt_slots.acquire(blocking=False):
+        raise PasswordCheckBusy()
+    future = _bcrypt_pool.submit(bcrypt.checkpw, password.encode('utf-8'), ADMIN_PASSWORD_HASH.encode('utf-8'))
+    # The slot is held until bcrypt actually finishes, even if this request stops waiting
+    future.add_done_callback(lambda _: _bcrypt_slots.release())
+    try:
+        valid = future.result(timeout=BCRYPT_TIMEOUT_SECONDS)
+    except FutureTimeoutError:
+        raise PasswordCheckBusy()
+    
+    if valid and cache_key:
+        with _password_cache_lock:
+            _password_cache[cache_key] = time.monotonic() + PASSWORD_CACHE_TTL_SECONDS
+            _password_cache.move_to_end(cache_key)
+            while len(_password_cache) > PASSWORD_CACHE_MAX_SIZE:
+                _password_cache.popitem(last=False)
+    return valid
+
+def sign_session(session_id: str, expires_at: int, ip_address: str) -> str:
+    bound_ip = ip_address if ADMIN_SESSION_BIND_IP else ''
+    message = f'{session_id}.{expires_at}.{bound_ip}'.encode('utf-8')
+    digest = hmac.new(ADMIN_SESSION_SECRET.encode('utf-8'), message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+def parse_session_token(session_token: str, ip_address: str) -> Optional[str]:
+    """Return the session id of a correctly signed, unexpired token bound to this IP"""
+    parts = session_token.split('.')
+    if not ADMIN_SESSION_SECRET or len(parts) != 3:
+        return None
+    session_id, expires_value, signature = parts
+    try:
+        expires_at = int(expires_value)
+    except ValueError:
+        return None
+    if expires_at < time.time():
+        return None
+    if not hmac.compare_digest(signature, sign_session(session_id, expires_at, ip_address)):
+        return None
+    return session_id
+
+def is_session_revoked(session_id: str) -> bool:
+    """Check the in-memory revocation list, reloading it from the DB every REVOCATION_REFRESH_SECONDS"""
+    global _revoked_sessions, _revoked_loaded_at
+    with _revocation_lock:
+        stale = _revoked_loaded_at is None or time.monotonic() - _revoked_loaded_at > REVOCATION_REFRESH_SECONDS
+        if stale:
+            try:
+                conn = get_db_connection()
+                cursor = conn.cursor()
+                cursor.execute("SELECT session_token FROM admin_sessions WHERE is_active = FALSE AND expires_at > NOW()")
+                _revoked_sessions = {row[0] for row in cursor.fetchall()}
+                cursor.close()
+                conn.close()
+                _revoked_loaded_at = time.monotonic()
+            except psycopg2.Error:
+                # Keep serving the last known list; without one, fail closed
+                if _revoked_loaded_at is None:
+                    raise
+        return session_id in _revoked_sessions
 
 def create_session(ip_address: str, user_agent: str) -> str:
-    session_token = secrets.token_urlsafe(48)
+    session_id = secrets.token_hex(16) if ADMIN_SESSION_SECRET else secrets.token_urlsafe(48)
     
     conn = get_db_connection()
     cursor = conn.cursor()
     
     expires_at = datetime.now() + timedelta(hours=SESSION_DURATION_HOURS)
     
-    token_sql = escape_sql(session_token)
-    ip_sql = escape_sql(ip_address)
-    ua_sql = escape_sql(user_agent)
-    expires_sql = escape_sql(expires_at.isoformat())
-    
     cursor.execute(
-        f"INSERT INTO admin_sessions (session_token, ip_address, user_agent, expires_at) "
-        f"VALUES ({token_sql}, {ip_sql}, {ua_sql}, {expires_sql})"
+        "INSERT INTO admin_sessions (session_token, ip_address, user_agent, expires_at) VALUES (%s, %s, %s, %s)",
+        (session_id, ip_address, user_agent, expires_at)
     )
     
     cursor.close()
     conn.close()
     
-    return session_token
+    if not ADMIN_SESSION_SECRET:
+        return session_id
+    
+    expires_unix = int(time.time()) + SESSION_DURATION_HOURS * 3600
+    return f'{session_id}.{expires_unix}.{sign_session(session_id, expires_unix, ip_address)}'
 
-def verify_session(session_token: str, ip_address: str) -> bool:
+def verify_legacy_session(session_token: str) -> bool:
+    """Opaque tokens issued before signed sessions are checked against admin_sessions"""
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    token_sql = escape_sql(session_token)
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
     
     cursor.execute(
-        f"SELECT * FROM admin_sessions "
-        f"WHERE session_token = {token_sql} AND is_active = TRUE"
+        "SELECT expires_at FROM admin_sessions WHERE session_token = %s AND is_active = TRUE",
+        (session_token,)
     )
     session = cursor.fetchone()
     
@@ -123,16 +325,103 @@ def verify_session(session_token: str, ip_address: str) -> bool:
     
     return True
 
+def verify_session(session_token: str, ip_address: str) -> bool:
+    if '.' not in session_token:
+        return bool(session_token) and verify_legacy_session(session_token)
+    
+    session_id = parse_session_token(session_token, ip_address)
+    return session_id is not None and not is_session_revoked(session_id)
+
 def logout_session(session_token: str):
+    """
+    Revoke the session behind a token. A signed token is checked against the IP it was issued to,
+    not the caller's, so logging out still works after the client's address changed.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    token_sql = escape_sql(session_token)
-    cursor.execute(f"UPDATE admin_sessions SET is_active = FALSE WHERE session_token = {token_sql}")
+    if '.' in session_token:
+        session_id = session_token.split('.', 1)[0]
+        cursor.execute("SELECT ip_address FROM admin_sessions WHERE session_token = %s", (session_id,))
+        row = cursor.fetchone()
+        if row is None or parse_session_token(session_token, row[0] or '') is None:
+            cursor.close()
+            conn.close()
+            return
+    else:
+        session_id = session_token
+    
+    cursor.execute("UPDATE admin_sessions SET is_active = FALSE WHERE session_token = %s", (session_id,))
     
     cursor.close()
     conn.close()
+    
+    # Other instances pick the revocation up on their next refresh
+    with _revocation_lock:
+        _revoked_sessions.add(session_id)
+
+def tag_route(name: str):
+    """Tag the invocation with its route for a sampled profile"""
+    _profile_local.route = name
+
+def sample_stacks(stopped: threading.Event, stacks: Dict[str, int], handler: threading.Thread):
+    """Sampler thread: count the stacks of the handler thread and PROFILED_POOLS workers, rooted at the thread's name, until stopped"""
+    while not stopped.wait(PROFILE_INTERVAL_SECONDS):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            # Pool workers are named <prefix>_<n>; dropping n folds a whole pool into one root
+            root = names.get(thread_id, 'thread').rstrip('0123456789').rstrip('_')
+            if thread_id != handler.ident and root not in PROFILED_POOLS:
+                continue
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            frames.append(root)
+            stack = ';'.join(reversed(frames))
+            stacks[stack] = stacks.get(stack, 0) + 1
+
+def write_profile(route: str, stacks: Dict[str, int]):
+    """Append one invocation's collapsed stacks under its route, rotating the file past PROFILE_MAX_BYTES"""
+    if not stacks:
+        return
+    lines = ''.join(f'{route};{stack} {count}\n' for stack, count in stacks.items())
+    try:
+        with _profile_sink_lock:
+            os.makedirs(os.path.dirname(PROFILE_PATH), exist_ok=True)
+            with open(PROFILE_PATH, 'a', encoding='utf-8') as sink:
+                sink.write(lines)
+                full = sink.tell() > PROFILE_MAX_BYTES
+            if full:
+                os.replace(PROFILE_PATH, f'{PROFILE_PATH}.1')
+    except OSError:
+        # Profiles are diagnostics; a full or read-only disk must not fail the invocation
+        pass
+
+def profiled(function: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    """Run a PROFILE_SAMPLE_RATE fraction of invocations under sample_stacks; a no-op when the rate is 0"""
+    if PROFILE_SAMPLE_RATE <= 0:
+        return function
+    
+    @functools.wraps(function)
+    def sampled(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        if secrets.randbelow(1_000_000) >= PROFILE_SAMPLE_RATE * 1_000_000:
+            return function(event, context)
+        _profile_local.route = None
+        stacks: Dict[str, int] = {}
+        stopped = threading.Event()
+        sampler = threading.Thread(target=sample_stacks, args=(stopped, stacks, threading.current_thread()), name='stack-sampler', daemon=True)
+        sampler.start()
+        try:
+            return function(event, context)
+        finally:
+            stopped.set()
+            sampler.join()
+            write_profile(getattr(_profile_local, 'route', None) or 'unrouted', stacks)
+    return sampled
 
+@profiled
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if event.get('httpMethod') == 'OPTIONS':
         return {
@@ -153,6 +442,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if method == 'POST':
             body = json.loads(event.get('body', '{}'))
             action = body.get('action', 'login')
+            tag_route(action if action in ('login', 'verify', 'logout') else 'invalid')
             
             if action == 'login':
                 password = body.get('password', '')
@@ -166,7 +456,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         })
                     }
                 
-                if verify_password(password):
+                try:
+                    password_valid = verify_password(password, ip_address)
+                except PasswordCheckBusy:
+                    # Not a failed login: a shed attempt never got a password verdict, so retrying
+                    # reveals nothing and must not use up the IP's MAX_ATTEMPTS budget
+                    return {
+                        'statusCode': 429,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*',
+                            'Retry-After': '1'
+                        },
+                        'body': json.dumps({
+                            'error': 'Сервер перегружен. Повторите попытку через секунду'
+                        })
+                    }
+                
+                if password_valid:
                     log_attempt(ip_address, True)
                     user_agent = event.get('headers', {}).get('user-agent', 'unknown')
                     session_token = create_session(ip_address, user_agent)
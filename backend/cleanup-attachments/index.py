@@ -1,62 +1,617 @@
 '''
-Business: Cleanup old attachments older than 24 hours
+Business: Capture attachments into the blob store, clean up attachments older than 24 hours and rotate daily messages partitions
 Args: event with httpMethod; context with request_id
 Returns: JSON with cleanup statistics
 '''
 
+import functools
 import json
 import os
-from typing import Dict, Any
+import secrets
+import sys
+import threading
+import time
+import hashlib
+import mimetypes
+import tempfile
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple, Callable
 import psycopg2
+import requests
 
 DATABASE_URL = os.environ.get('DATABASE_URL', '')
+SCHEMA = 't_p14838969_anon_talk_bot'
+PARTITION_PREFIX = 'messages_p'
+# Message rows (text history behind complaints) are kept unless a retention is configured; 0 = never drop.
+# Attachments expire separately after ATTACHMENT_TTL_HOURS
+MESSAGES_RETENTION_DAYS = int(os.environ.get('MESSAGES_RETENTION_DAYS', '0'))
+MESSAGES_PARTITIONS_AHEAD = int(os.environ.get('MESSAGES_PARTITIONS_AHEAD', '7'))
+ATTACHMENT_TTL_HOURS = 24
+CLEANUP_BATCH_SIZE = int(os.environ.get('CLEANUP_BATCH_SIZE', '500'))
+CLEANUP_TIME_BUDGET_SECONDS = float(os.environ.get('CLEANUP_TIME_BUDGET_SECONDS', '20'))
+CLEANUP_REMAINING_COUNT_CAP = 10000
+BRIDGE_CACHE_MAX_AGE_DAYS = int(os.environ.get('BRIDGE_CACHE_MAX_AGE_DAYS', '30'))
+STATS_ROLLUP_RETENTION_DAYS = int(os.environ.get('STATS_ROLLUP_RETENTION_DAYS', '30'))
+# Dashboards that fall further behind than this reload instead of replaying admin_events
+ADMIN_EVENTS_RETENTION_HOURS = int(os.environ.get('ADMIN_EVENTS_RETENTION_HOURS', '24'))
+LOGIN_ATTEMPTS_RETENTION_DAYS = int(os.environ.get('LOGIN_ATTEMPTS_RETENTION_DAYS', '30'))
+# Rate-limit buckets only matter for admin-auth's 15-minute window
+LOGIN_ATTEMPT_BUCKETS_RETENTION_SECONDS = 24 * 3600
+
+# Content-addressed attachment store: attachment_blobs.content keyed by SHA-256. Functions do not
+# share a filesystem, so the bytes live in the database that admin-api reads them from
+TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+ATTACHMENT_CAPTURE_BUDGET_SECONDS = float(os.environ.get('ATTACHMENT_CAPTURE_BUDGET_SECONDS', '20'))
+ATTACHMENT_CAPTURE_BATCH_SIZE = 50
+ATTACHMENT_MAX_BYTES = 20 * 1024 * 1024
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+# Downloads stay in memory up to this size and spill to a temporary file beyond it
+ATTACHMENT_SPOOL_MAX_BYTES = 1024 * 1024
+
+# Sampling profiler as in admin-api, over the handler thread only (this function has no worker pools)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000
+PROFILE_PATH = os.path.join(os.environ.get('PROFILE_DIR', '/tmp/profiles'), 'cleanup-attachments.collapsed')
+# Past this size the file is rotated to .collapsed.1, so the directory holds at most about twice the limit
+PROFILE_MAX_BYTES = int(os.environ.get('PROFILE_MAX_BYTES', str(16 * 1024 * 1024)))
+
+_profile_local = threading.local()
+_profile_sink_lock = threading.Lock()
 
 def get_db_connection():
     conn = psycopg2.connect(DATABASE_URL)
     conn.autocommit = True
     return conn
 
-def cleanup_old_attachments() -> Dict[str, Any]:
+def partition_name(day: date) -> str:
+    return f"{PARTITION_PREFIX}{day.strftime('%Y%m%d')}"
+
+def database_now(cursor) -> datetime:
+    """Current time on the database clock, comparable with the naive sent_at column"""
+    cursor.execute("SELECT LOCALTIMESTAMP")
+    return cursor.fetchone()[0]
+
+def list_message_partitions(cursor) -> List[date]:
+    """Return days of existing daily messages partitions (default partition excluded)"""
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        JOIN pg_namespace n ON n.oid = p.relnamespace
+        WHERE n.nspname = %s AND p.relname = 'messages'
+    """, (SCHEMA,))
+    
+    days = []
+    for (relname,) in cursor.fetchall():
+        if not relname.startswith(PARTITION_PREFIX):
+            continue
+        try:
+            days.append(datetime.strptime(relname[len(PARTITION_PREFIX):], '%Y%m%d').date())
+        except ValueError:
+            continue
+    return sorted(days)
+
+def list_default_partition_days(cursor) -> List[date]:
+    """Days that have rows in messages_default because their partition did not exist yet"""
+    cursor.execute(f"SELECT DISTINCT sent_at::date FROM {SCHEMA}.messages_default")
+    return sorted(row[0] for row in cursor.fetchall())
+
+def create_partition(cursor, day: date):
+    """
+    Create the day's partition and move rows already stored for that day out of messages_default.
+    CREATE TABLE ... PARTITION OF fails once the default partition holds rows for the range,
+    so the table is built standalone, filled and then attached.
+    """
+    name = partition_name(day)
+    # Keeps new rows for this day from landing in the default partition between the move and ATTACH
+    cursor.execute(f"LOCK TABLE {SCHEMA}.messages_default IN SHARE ROW EXCLUSIVE MODE")
+    cursor.execute(f"CREATE TABLE {SCHEMA}.{name} (LIKE {SCHEMA}.messages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cursor.execute(f"""
+        WITH moved AS (
+            DELETE FROM {SCHEMA}.messages_default
+            WHERE sent_at >= %s AND sent_at < %s
+            RETURNING *
+        )
+        INSERT INTO {SCHEMA}.{name} SELECT * FROM moved
+    """, (day, day + timedelta(days=1)))
+    cursor.execute(
+        f"ALTER TABLE {SCHEMA}.messages ATTACH PARTITION {SCHEMA}.{name} FOR VALUES FROM (%s) TO (%s)",
+        (day, day + timedelta(days=1))
+    )
+
+def create_missing_partitions(conn, cursor, existing: List[date], today: date) -> List[date]:
+    """
+    Create partitions for the next MESSAGES_PARTITIONS_AHEAD days and for every day stranded
+    in messages_default, each in its own transaction
+    """
+    with conn:
+        stranded = list_default_partition_days(cursor)
+    wanted = set(stranded) | {today + timedelta(days=offset) for offset in range(MESSAGES_PARTITIONS_AHEAD + 1)}
+    
+    created = []
+    for day in sorted(wanted - set(existing)):
+        with conn:
+            create_partition(cursor, day)
+        created.append(day)
+    return created
+
+def release_partition_blobs(cursor, name: str):
+    """Drop the blob references held by a partition that is about to be dropped"""
+    cursor.execute(f"""
+        UPDATE {SCHEMA}.attachment_blobs b
+        SET refcount = b.refcount - r.n
+        FROM (
+            SELECT blob_sha256, COUNT(*) AS n FROM {SCHEMA}.{name}
+            WHERE blob_sha256 IS NOT NULL
+            GROUP BY blob_sha256
+        ) r
+        WHERE b.sha256 = r.blob_sha256
+    """)
+
+def drop_expired_partitions(conn, cursor, existing: List[date], now: datetime) -> List[str]:
+    """
+    Detach and drop partitions whose whole range is older than MESSAGES_RETENTION_DAYS (0 keeps them forever).
+    Releasing a partition's blob references, DETACH and DROP commit together or not at all.
+    """
+    if MESSAGES_RETENTION_DAYS <= 0:
+        return []
+    
+    cutoff = now - timedelta(days=MESSAGES_RETENTION_DAYS)
+    dropped = []
+    for day in existing:
+        upper_bound = datetime.combine(day + timedelta(days=1), datetime.min.time())
+        if upper_bound > cutoff:
+            break
+        name = partition_name(day)
+        with conn:
+            release_partition_blobs(cursor, name)
+            cursor.execute(f"ALTER TABLE {SCHEMA}.messages DETACH PARTITION {SCHEMA}.{name}")
+            cursor.execute(f"DROP TABLE {SCHEMA}.{name}")
+        dropped.append(name)
+    return dropped
+
+def rotate_message_partitions() -> Dict[str, Any]:
     conn = get_db_connection()
+    # Partition maintenance runs as explicit transactions: `with conn` commits each step or rolls it back
+    conn.autocommit = False
     cursor = conn.cursor()
     
-    cursor.execute("""
-        UPDATE t_p14838969_anon_talk_bot.messages
-        SET photo_url = NULL
-        WHERE photo_url IS NOT NULL 
-        AND sent_at < NOW() - INTERVAL '24 hours'
-    """)
+    try:
+        with conn:
+            now = database_now(cursor)
+            existing = list_message_partitions(cursor)
+        created = create_missing_partitions(conn, cursor, existing, now.date())
+        dropped = drop_expired_partitions(conn, cursor, sorted(existing + created), now)
+    finally:
+        cursor.close()
+        conn.close()
     
-    deleted_count = cursor.rowcount
+    return {
+        'partitions_created': len(created),
+        'partitions_dropped': dropped
+    }
+
+def load_job_state(cursor, job: str) -> Optional[Dict[str, Any]]:
+    cursor.execute(
+        f"SELECT last_sent_at, last_id, cutoff, rows_processed FROM {SCHEMA}.cleanup_state WHERE job = %s",
+        (job,)
+    )
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return {'last_sent_at': row[0], 'last_id': row[1], 'cutoff': row[2], 'rows_processed': row[3]}
+
+def save_job_state(cursor, job: str, state: Dict[str, Any]):
+    cursor.execute(f"""
+        INSERT INTO {SCHEMA}.cleanup_state (job, last_sent_at, last_id, cutoff, rows_processed, updated_at)
+        VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (job) DO UPDATE SET
+            last_sent_at = EXCLUDED.last_sent_at,
+            last_id = EXCLUDED.last_id,
+            cutoff = EXCLUDED.cutoff,
+            rows_processed = EXCLUDED.rows_processed,
+            updated_at = CURRENT_TIMESTAMP
+    """, (job, state['last_sent_at'], state['last_id'], state['cutoff'], state['rows_processed']))
+
+def clear_job_state(cursor, job: str):
+    cursor.execute(f"DELETE FROM {SCHEMA}.cleanup_state WHERE job = %s", (job,))
+
+def count_remaining(cursor, state: Dict[str, Any]) -> int:
+    """Count rows left for the job, capped at CLEANUP_REMAINING_COUNT_CAP"""
+    cursor.execute(f"""
+        SELECT COUNT(*) FROM (
+            SELECT 1 FROM {SCHEMA}.messages
+            WHERE file_id IS NOT NULL
+            AND sent_at < %s
+            AND (sent_at, id) > (%s, %s)
+            LIMIT %s
+        ) remaining
+    """, (state['cutoff'], state['last_sent_at'], state['last_id'], CLEANUP_REMAINING_COUNT_CAP))
+    return cursor.fetchone()[0]
+
+def run_cleanup_job(job: str, max_age: timedelta) -> Dict[str, Any]:
+    """
+    Null file_id of attachments older than max_age (on the database clock) in key-ordered batches
+    of CLEANUP_BATCH_SIZE rows along idx_messages_file_sent_at.
+    Every batch commits on its own and the (sent_at, id) cursor is persisted, so a run that hits
+    CLEANUP_TIME_BUDGET_SECONDS resumes where it stopped on the next invocation.
+    """
+    started = time.monotonic()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    state = load_job_state(cursor, job)
+    resumed = state is not None
+    if not state:
+        state = {'last_sent_at': datetime.min, 'last_id': 0, 'cutoff': database_now(cursor) - max_age, 'rows_processed': 0}
+    
+    run_rows = 0
+    batches = 0
+    done = False
+    
+    while time.monotonic() - started < CLEANUP_TIME_BUDGET_SECONDS:
+        # Clearing the row and releasing its blob reference happen in one statement
+        cursor.execute(f"""
+            WITH batch AS (
+                SELECT id, sent_at, blob_sha256 FROM {SCHEMA}.messages
+                WHERE file_id IS NOT NULL
+                AND sent_at < %s
+                AND (sent_at, id) > (%s, %s)
+                ORDER BY sent_at, id
+                LIMIT %s
+            ),
+            cleared AS (
+                UPDATE {SCHEMA}.messages m
+                SET file_id = NULL, file_unique_id = NULL, blob_sha256 = NULL
+                FROM batch
+                WHERE m.id = batch.id AND m.sent_at = batch.sent_at
+                RETURNING m.sent_at, m.id, batch.blob_sha256
+            ),
+            released AS (
+                UPDATE {SCHEMA}.attachment_blobs b
+                SET refcount = b.refcount - r.n
+                FROM (
+                    SELECT blob_sha256, COUNT(*) AS n FROM cleared
+                    WHERE blob_sha256 IS NOT NULL
+                    GROUP BY blob_sha256
+                ) r
+                WHERE b.sha256 = r.blob_sha256
+            )
+            SELECT sent_at, id FROM cleared
+        """, (state['cutoff'], state['last_sent_at'], state['last_id'], CLEANUP_BATCH_SIZE))
+        
+        processed = cursor.fetchall()
+        batches += 1
+        run_rows += len(processed)
+        
+        if processed:
+            state['last_sent_at'], state['last_id'] = max(processed)
+            state['rows_processed'] += len(processed)
+        
+        if len(processed) < CLEANUP_BATCH_SIZE:
+            done = True
+            break
+        
+        save_job_state(cursor, job, state)
+    
+    elapsed = time.monotonic() - started
+    
+    if done:
+        clear_job_state(cursor, job)
+        remaining = 0
+    else:
+        remaining = count_remaining(cursor, state)
     
     cursor.close()
     conn.close()
     
+    rate = run_rows / elapsed if elapsed > 0 else 0
+    
     return {
-        'deleted_count': deleted_count,
-        'timestamp': 'NOW()'
+        'deleted_count': run_rows,
+        'batches': batches,
+        'elapsed_seconds': round(elapsed, 3),
+        'done': done,
+        'resumed': resumed,
+        'job_rows_processed': state['rows_processed'],
+        'remaining_estimate': remaining,
+        'remaining_capped': remaining >= CLEANUP_REMAINING_COUNT_CAP,
+        'estimated_seconds_remaining': round(remaining / rate, 1) if rate and remaining else 0,
+        'timestamp': datetime.now().isoformat()
     }
 
-def delete_all_attachments() -> Dict[str, Any]:
+def evict_stale_bridge_cache() -> int:
+    """Delete media bridge cache entries unused for BRIDGE_CACHE_MAX_AGE_DAYS, in CLEANUP_BATCH_SIZE batches"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute("""
-        UPDATE t_p14838969_anon_talk_bot.messages
-        SET photo_url = NULL
-        WHERE photo_url IS NOT NULL
-    """)
+    evicted = 0
+    while True:
+        cursor.execute(f"""
+            DELETE FROM {SCHEMA}.media_bridge_cache
+            WHERE (source_platform, source_key) IN (
+                SELECT source_platform, source_key FROM {SCHEMA}.media_bridge_cache
+                WHERE last_used_at < NOW() - make_interval(days => %s)
+                LIMIT %s
+            )
+        """, (BRIDGE_CACHE_MAX_AGE_DAYS, CLEANUP_BATCH_SIZE))
+        evicted += cursor.rowcount
+        if cursor.rowcount < CLEANUP_BATCH_SIZE:
+            break
     
-    deleted_count = cursor.rowcount
+    cursor.close()
+    conn.close()
+    
+    return evicted
+
+def delete_in_batches(cursor, table: str, condition: str, params: tuple) -> int:
+    """DELETE rows matching condition CLEANUP_BATCH_SIZE at a time, each batch its own transaction"""
+    deleted = 0
+    while True:
+        cursor.execute(f"""
+            DELETE FROM {SCHEMA}.{table}
+            WHERE ctid IN (SELECT ctid FROM {SCHEMA}.{table} WHERE {condition} LIMIT %s)
+        """, params + (CLEANUP_BATCH_SIZE,))
+        deleted += cursor.rowcount
+        if cursor.rowcount < CLEANUP_BATCH_SIZE:
+            return deleted
+
+def purge_old_stats_rollup() -> int:
+    """Delete stats_rollup buckets older than STATS_ROLLUP_RETENTION_DAYS, in CLEANUP_BATCH_SIZE batches"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    purged = delete_in_batches(
+        cursor, 'stats_rollup', "bucket < NOW() - make_interval(days => %s)", (STATS_ROLLUP_RETENTION_DAYS,)
+    )
+    cursor.close()
+    conn.close()
+    return purged
+
+def purge_old_admin_events() -> int:
+    """Delete dashboard events older than ADMIN_EVENTS_RETENTION_HOURS, keeping the newest so its id stays a valid cursor"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    purged = delete_in_batches(
+        cursor, 'admin_events',
+        f"created_at < NOW() - make_interval(hours => %s) AND id < (SELECT MAX(id) FROM {SCHEMA}.admin_events)",
+        (ADMIN_EVENTS_RETENTION_HOURS,)
+    )
+    cursor.close()
+    conn.close()
+    return purged
+
+def compact_auth_tables() -> Dict[str, int]:
+    """Purge old login attempts, stale rate-limit buckets and expired admin sessions"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    oldest_bucket = (int(time.time()) - LOGIN_ATTEMPT_BUCKETS_RETENTION_SECONDS) // 60
+    result = {
+        'login_attempts_purged': delete_in_batches(
+            cursor, 'login_attempts', "attempted_at < NOW() - make_interval(days => %s)", (LOGIN_ATTEMPTS_RETENTION_DAYS,)
+        ),
+        'login_attempt_buckets_purged': delete_in_batches(
+            cursor, 'login_attempt_buckets', "bucket < %s", (oldest_bucket,)
+        ),
+        'admin_sessions_purged': delete_in_batches(
+            cursor, 'admin_sessions', "expires_at < NOW()", ()
+        ),
+    }
+    
+    cursor.close()
+    conn.close()
+    
+    return result
+
+def purge_orphaned_blobs() -> int:
+    """Delete blobs whose refcount dropped to zero"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"DELETE FROM {SCHEMA}.attachment_blobs WHERE refcount <= 0")
+    purged = cursor.rowcount
+    cursor.close()
+    conn.close()
+    return purged
+
+def download_attachment(file_id: str, sink) -> Optional[Tuple[str, int, Optional[str]]]:
+    """Stream a Telegram file into sink, hashing on the fly; returns (sha256, size, mime_type)"""
+    response = requests.post(f'{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/getFile', json={'file_id': file_id}, timeout=10)
+    file_path = response.json().get('result', {}).get('file_path') if response.status_code == 200 else None
+    if not file_path:
+        return None
+    
+    digest = hashlib.sha256()
+    size = 0
+    with requests.get(f'{TELEGRAM_API_URL}/file/bot{TELEGRAM_BOT_TOKEN}/{file_path}', stream=True, timeout=30) as download:
+        if download.status_code != 200:
+            return None
+        for chunk in download.iter_content(ATTACHMENT_CHUNK_SIZE):
+            size += len(chunk)
+            if size > ATTACHMENT_MAX_BYTES:
+                return None
+            digest.update(chunk)
+            sink.write(chunk)
+    return digest.hexdigest(), size, mimetypes.guess_type(file_path)[0]
+
+def blob_exists(cursor, sha256: str) -> bool:
+    cursor.execute(f"SELECT 1 FROM {SCHEMA}.attachment_blobs WHERE sha256 = %s", (sha256,))
+    return cursor.fetchone() is not None
+
+def link_existing_blob(cursor, sent_at: datetime, message_id: int, sha256: str):
+    """Point a message at a stored blob and take a reference, atomically"""
+    cursor.execute(f"""
+        WITH linked AS (
+            UPDATE {SCHEMA}.messages SET blob_sha256 = %s
+            WHERE id = %s AND sent_at = %s AND blob_sha256 IS NULL
+            RETURNING 1
+        )
+        UPDATE {SCHEMA}.attachment_blobs
+        SET refcount = refcount + (SELECT COUNT(*) FROM linked)
+        WHERE sha256 = %s
+    """, (sha256, message_id, sent_at, sha256))
+
+def link_new_blob(cursor, sent_at: datetime, message_id: int, sha256: str, size: int, mime_type: Optional[str], content: bytes):
+    """Store a blob's bytes (or reuse a row with identical content) and link the message to it"""
+    cursor.execute(f"""
+        WITH linked AS (
+            UPDATE {SCHEMA}.messages SET blob_sha256 = %s
+            WHERE id = %s AND sent_at = %s AND blob_sha256 IS NULL
+            RETURNING 1
+        )
+        INSERT INTO {SCHEMA}.attachment_blobs (sha256, size_bytes, mime_type, refcount, content)
+        SELECT %s, %s, %s, COUNT(*), %s FROM linked
+        ON CONFLICT (sha256) DO UPDATE SET refcount = attachment_blobs.refcount + EXCLUDED.refcount
+    """, (sha256, message_id, sent_at, sha256, size, mime_type, psycopg2.Binary(content)))
+
+def store_attachment(cursor, sent_at: datetime, message_id: int, file_id: str) -> bool:
+    """Download an attachment and link it, uploading the bytes only if no blob has the same content"""
+    with tempfile.SpooledTemporaryFile(max_size=ATTACHMENT_SPOOL_MAX_BYTES) as spool:
+        downloaded = download_attachment(file_id, spool)
+        if not downloaded:
+            return False
+        sha256, size, mime_type = downloaded
+        if blob_exists(cursor, sha256):
+            link_existing_blob(cursor, sent_at, message_id, sha256)
+            return True
+        spool.seek(0)
+        link_new_blob(cursor, sent_at, message_id, sha256, size, mime_type, spool.read())
+    return True
+
+def capture_attachments() -> Dict[str, Any]:
+    """
+    Copy not yet captured attachments of the last 24 hours into attachment_blobs.
+    A file_unique_id that is already stored is linked without downloading it again;
+    every linked message holds one reference on attachment_blobs.refcount.
+    """
+    started = time.monotonic()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    captured = 0
+    deduplicated = 0
+    failed = 0
+    last_key = (datetime.min, 0)
+    
+    while time.monotonic() - started < ATTACHMENT_CAPTURE_BUDGET_SECONDS:
+        cursor.execute(f"""
+            SELECT sent_at, id, file_id, file_unique_id FROM {SCHEMA}.messages
+            WHERE file_id IS NOT NULL AND blob_sha256 IS NULL
+            AND sent_at >= NOW() - make_interval(hours => %s)
+            AND (sent_at, id) > (%s, %s)
+            ORDER BY sent_at, id
+            LIMIT %s
+        """, (ATTACHMENT_TTL_HOURS, last_key[0], last_key[1], ATTACHMENT_CAPTURE_BATCH_SIZE))
+        pending = cursor.fetchall()
+        if not pending:
+            break
+        
+        for sent_at, message_id, file_id, file_unique_id in pending:
+            if time.monotonic() - started >= ATTACHMENT_CAPTURE_BUDGET_SECONDS:
+                break
+            last_key = (sent_at, message_id)
+            
+            sha256 = None
+            if file_unique_id:
+                # Only messages inside the TTL still hold a blob, so the window also prunes old partitions
+                cursor.execute(
+                    f"SELECT blob_sha256 FROM {SCHEMA}.messages WHERE file_unique_id = %s AND blob_sha256 IS NOT NULL "
+                    "AND sent_at >= NOW() - make_interval(hours => %s) LIMIT 1",
+                    (file_unique_id, ATTACHMENT_TTL_HOURS)
+                )
+                row = cursor.fetchone()
+                sha256 = row[0] if row else None
+            
+            if sha256:
+                link_existing_blob(cursor, sent_at, message_id, sha256)
+                deduplicated += 1
+                continue
+            
+            try:
+                stored = store_attachment(cursor, sent_at, message_id, file_id)
+            except (requests.RequestException, OSError, ValueError):
+                stored = False
+            if not stored:
+                failed += 1
+                continue
+            captured += 1
     
     cursor.close()
     conn.close()
     
     return {
-        'deleted_count': deleted_count,
-        'timestamp': 'NOW()'
+        'captured': captured,
+        'deduplicated': deduplicated,
+        'capture_failed': failed,
+        'capture_elapsed_seconds': round(time.monotonic() - started, 3)
     }
 
+def cleanup_old_attachments() -> Dict[str, Any]:
+    return run_cleanup_job('expired', timedelta(hours=ATTACHMENT_TTL_HOURS))
+
+def delete_all_attachments() -> Dict[str, Any]:
+    return run_cleanup_job('delete_all', timedelta(0))
+
+def tag_route(name: str):
+    """Tag the invocation with its route for a sampled profile"""
+    _profile_local.route = name
+
+def sample_stacks(stopped: threading.Event, stacks: Dict[str, int], handler: threading.Thread):
+    """Sampler thread: count the handler thread's stack, rooted at the thread's name, until stopped"""
+    while not stopped.wait(PROFILE_INTERVAL_SECONDS):
+        frame = sys._current_frames().get(handler.ident)
+        if frame is None:
+            continue
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        frames.append(handler.name)
+        stack = ';'.join(reversed(frames))
+        stacks[stack] = stacks.get(stack, 0) + 1
+
+def write_profile(route: str, stacks: Dict[str, int]):
+    """Append one invocation's collapsed stacks under its route, rotating the file past PROFILE_MAX_BYTES"""
+    if not stacks:
+        return
+    lines = ''.join(f'{route};{stack} {count}\n' for stack, count in stacks.items())
+    try:
+        with _profile_sink_lock:
+            os.makedirs(os.path.dirname(PROFILE_PATH), exist_ok=True)
+            with open(PROFILE_PATH, 'a', encoding='utf-8') as sink:
+                sink.write(lines)
+                full = sink.tell() > PROFILE_MAX_BYTES
+            if full:
+                os.replace(PROFILE_PATH, f'{PROFILE_PATH}.1')
+    except OSError:
+        # Profiles are diagnostics; a full or read-only disk must not fail the invocation
+        pass
+
+def profiled(function: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    """Run a PROFILE_SAMPLE_RATE fraction of invocations under sample_stacks; a no-op when the rate is 0"""
+    if PROFILE_SAMPLE_RATE <= 0:
+        return function
+    
+    @functools.wraps(function)
+    def sampled(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        if secrets.randbelow(1_000_000) >= PROFILE_SAMPLE_RATE * 1_000_000:
+            return function(event, context)
+        _profile_local.route = None
+        stacks: Dict[str, int] = {}
+        stopped = threading.Event()
+        sampler = threading.Thread(target=sample_stacks, args=(stopped, stacks, threading.current_thread()), name='stack-sampler', daemon=True)
+        sampler.start()
+        try:
+            return function(event, context)
+        finally:
+            stopped.set()
+            sampler.join()
+            write_profile(getattr(_profile_local, 'route', None) or 'unrouted', stacks)
+    return sampled
+
+@profiled
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method = event.get('httpMethod', 'GET')
     
@@ -76,11 +631,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         body_str = event.get('body', '')
         body = json.loads(body_str) if body_str else {}
         delete_all = body.get('delete_all', False)
+        tag_route('delete_all' if delete_all else 'cleanup')
         
         if delete_all:
             result = delete_all_attachments()
         else:
-            result = cleanup_old_attachments()
+            result = rotate_message_partitions()
+            result.update(cleanup_old_attachments())
+            result.update(capture_attachments())
+            result['bridge_cache_evicted'] = evict_stale_bridge_cache()
+            result['stats_rollup_purged'] = purge_old_stats_rollup()
+            result['admin_events_purged'] = purge_old_admin_events()
+            result.update(compact_auth_tables())
+        
+        result['blobs_deleted'] = purge_orphaned_blobs()
         
         return {
             'statusCode': 200,
@@ -1,52 +1,610 @@
 '''
 Business: Telegram webhook handler for anonymous chat bot
-Args: event with httpMethod, body; context with request_id
-Returns: HTTP response with statusCode 200
+Args: event with httpMethod, body, headers; context with request_id
+Returns: HTTP response with statusCode 200; Prometheus metrics text for a GET bearing METRICS_TOKEN
 '''
 
+import functools
+import importlib
 import json
 import os
-from typing import Dict, Any, Optional
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import requests
+import re
+import secrets
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Tuple, Iterator, Set, NamedTuple, Callable, FrozenSet
+
+class LazyModule:
+    """
+    Stand-in for a heavy module that imports it (plus listed submodules) on first attribute access.
+    Once loaded it rebinds the owning global to the real module, so later lookups cost nothing.
+    """
+    
+    def __init__(self, namespace: Dict[str, Any], name: str, *submodules: str):
+        self._namespace = namespace
+        self._name = name
+        self._submodules = submodules
+        self._module = None
+        self._lock = threading.Lock()
+    
+    def load(self):
+        with self._lock:
+            if self._module is None:
+                module = importlib.import_module(self._name)
+                for submodule in self._submodules:
+                    importlib.import_module(f'{self._name}.{submodule}')
+                self._namespace[self._name] = module
+                self._module = module
+        return self._module
+    
+    def __getattr__(self, attr: str):
+        return getattr(self._module or self.load(), attr)
+
+# psycopg2 and requests (urllib3, charset_normalizer, idna) dominate import time;
+# they load on the first update that needs them, never for an OPTIONS preflight
+psycopg2 = LazyModule(globals(), 'psycopg2', 'extensions', 'pool')
+requests = LazyModule(globals(), 'requests')
 
 BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
 DATABASE_URL = os.environ.get('DATABASE_URL', '')
 VK_GROUP_TOKEN = os.environ.get('VK_GROUP_TOKEN', '')
 VK_API_VERSION = '5.131'
+# API base URLs are overridable so the bot can be pointed at local stand-in servers
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+VK_API_URL = os.environ.get('VK_API_URL', 'https://api.vk.com/method').rstrip('/')
+
+# Connections are pooled per warm instance so prepared statements outlive a single update
+DB_POOL_MAX_CONNECTIONS = int(os.environ.get('DB_POOL_MAX_CONNECTIONS', '4'))
+# Upper bounds (seconds) of the route, API call and DB checkout latency histograms; the last bucket is +Inf
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SEARCH_GATE_TEXT = '⏳ Идёт поиск собеседника... Используйте "❌ Отменить поиск" для отмены'
+NOT_IN_CHAT_TEXT = '⚠️ Вы не в диалоге. Используйте "Найти собеседника"'
+# Open the pool, prepare hot statements and create the HTTP session at init rather than on the first update
+WARM_START = os.environ.get('WARM_START', 'false').lower() == 'true'
+# Fraction of updates traced (0 disables); each sampled update appends its spans as NDJSON lines to TRACE_PATH
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0'))
+TRACE_PATH = os.environ.get('TRACE_PATH', '/tmp/traces/telegram-bot.ndjson')
+# Past this size the sink is rotated to TRACE_PATH.1, so a long-lived instance keeps at most two files
+TRACE_MAX_BYTES = int(os.environ.get('TRACE_MAX_BYTES', str(16 * 1024 * 1024)))
+# Table a statement touches, used to name spans of ad-hoc (non-prepared) queries
+SQL_TABLE_PATTERN = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+(?:\w+\.)?(\w+)', re.IGNORECASE)
+# GET / serves this instance's metrics in Prometheus text format to a scraper presenting it as a Bearer token;
+# unset disables the endpoint
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+PROMETHEUS_LABEL_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+# Sampling profiler as in admin-api, over the handler thread only (this function has no worker pools)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000
+PROFILE_PATH = os.path.join(os.environ.get('PROFILE_DIR', '/tmp/profiles'), 'telegram-bot.collapsed')
+# Past this size the file is rotated to .collapsed.1, so the directory holds at most about twice the limit
+PROFILE_MAX_BYTES = int(os.environ.get('PROFILE_MAX_BYTES', str(16 * 1024 * 1024)))
+
+class UserRow(NamedTuple):
+    """The users columns the bot reads, in select order; built straight from a plain cursor tuple"""
+    telegram_id: int
+    username: Optional[str]
+    gender: Optional[str]
+    platform: Optional[str]
+    platform_id: Optional[str]
+    is_searching: bool
+    is_in_chat: bool
+    current_chat_id: Optional[int]
+    is_blocked: bool
+    last_search_gender: Optional[str]
+
+# Explicit column list: a prepared SELECT * would break once a migration adds a column
+USER_COLUMNS = ', '.join(UserRow._fields)
+
+# Hot-path statements: name -> (parameter types, body), prepared once per pooled connection
+PREPARED_STATEMENTS = {
+    'user_by_telegram_id': (
+        'bigint',
+        f"SELECT {USER_COLUMNS} FROM t_p14838969_anon_talk_bot.users WHERE telegram_id = $1"
+    ),
+    'user_touch': (
+        'bigint',
+        f"UPDATE t_p14838969_anon_talk_bot.users SET last_active = CURRENT_TIMESTAMP WHERE telegram_id = $1 RETURNING {USER_COLUMNS}"
+    ),
+    'partner_of_user': (
+        'bigint',
+        f"SELECT {', '.join(f'p.{column}' for column in USER_COLUMNS.split(', '))} "
+        "FROM t_p14838969_anon_talk_bot.users u "
+        "JOIN t_p14838969_anon_talk_bot.chats c ON c.id = u.current_chat_id AND c.is_active = TRUE "
+        "JOIN t_p14838969_anon_talk_bot.users p ON p.telegram_id = "
+        "CASE WHEN c.user1_telegram_id = u.telegram_id THEN c.user2_telegram_id ELSE c.user1_telegram_id END "
+        "WHERE u.telegram_id = $1 AND u.is_in_chat = TRUE"
+    ),
+    'chat_message_count_bump': (
+        'bigint',
+        "UPDATE t_p14838969_anon_talk_bot.chats SET message_count = message_count + 1 WHERE id = $1"
+    ),
+    'message_insert': (
+        'bigint, bigint, varchar, text, text, text',
+        "INSERT INTO t_p14838969_anon_talk_bot.messages "
+        "(chat_id, sender_telegram_id, content_type, file_id, file_unique_id, text_content) "
+        "VALUES ($1, $2, $3, $4, $5, $6) RETURNING id, sent_at"
+    ),
+    'stats_bump': (
+        'varchar, bigint, bigint',
+        "INSERT INTO t_p14838969_anon_talk_bot.stats_rollup (bucket, metric, platform, gender, value) "
+        "SELECT date_trunc('minute', CURRENT_TIMESTAMP), $1, COALESCE(u.platform, 'telegram'), "
+        "CASE WHEN u.gender IN ('male', 'female') THEN u.gender ELSE 'unknown' END, $2 "
+        "FROM t_p14838969_anon_talk_bot.users u WHERE u.telegram_id = $3 "
+        "ON CONFLICT (bucket, metric, platform, gender) DO UPDATE SET value = stats_rollup.value + EXCLUDED.value"
+    ),
+}
+
+FILE_CONTENT_TYPES = ('photo', 'video', 'animation', 'document', 'audio', 'voice', 'video_note', 'sticker')
+# venue is checked before location: a venue message carries both keys
+STRUCTURED_CONTENT_TYPES = ('venue', 'location', 'contact', 'poll', 'dice')
+# Non-message update kinds counted under their own bot_updates_total label. The webhook body is
+# unauthenticated, so any other key is counted as 'other' rather than minting a new series
+UPDATE_KINDS = frozenset((
+    'edited_message', 'channel_post', 'edited_channel_post', 'business_connection', 'business_message',
+    'edited_business_message', 'deleted_business_messages', 'message_reaction', 'message_reaction_count',
+    'inline_query', 'chosen_inline_result', 'callback_query', 'shipping_query', 'pre_checkout_query',
+    'purchased_paid_media', 'poll', 'poll_answer', 'my_chat_member', 'chat_member', 'chat_join_request',
+    'chat_boost', 'removed_chat_boost'
+))
+
+# Text label for content that cannot be bridged to VK as media
+CONTENT_TYPE_LABELS = {
+    'photo': '📷 Фото',
+    'video': '🎬 Видео',
+    'animation': '🎞 GIF',
+    'document': '📎 Файл',
+    'audio': '🎵 Аудио',
+    'voice': '🎤 Голосовое сообщение',
+    'video_note': '⏺ Видео-кружок',
+    'sticker': '🙂 Стикер',
+    'venue': '📍 Место',
+    'location': '📍 Геопозиция',
+    'contact': '👤 Контакт',
+    'poll': '📊 Опрос',
+    'dice': '🎲 Кубик',
+}
+
+# Media bridge: files are streamed Telegram -> VK in fixed-size chunks, never held whole in memory
+MEDIA_BRIDGE_CHUNK_SIZE = 64 * 1024
+MEDIA_BRIDGE_MAX_BYTES = int(os.environ.get('MEDIA_BRIDGE_MAX_BYTES', str(20 * 1024 * 1024)))
+MEDIA_BRIDGE_MAX_CONCURRENT = int(os.environ.get('MEDIA_BRIDGE_MAX_CONCURRENT', '2'))
+MEDIA_BRIDGE_TIMEOUT = 30
+# VK has no group-token video upload, so everything except photos goes through docs
+VK_UPLOAD_KINDS = {
+    'photo': ('photo', None),
+    'voice': ('doc', 'audio_message'),
+}
+MIME_TYPES = {
+    'photo': 'image/jpeg',
+    'video': 'video/mp4',
+    'animation': 'video/mp4',
+    'audio': 'audio/mpeg',
+    'voice': 'audio/ogg',
+    'video_note': 'video/mp4',
+    'sticker': 'image/webp',
+}
+
+_bridge_slots = threading.BoundedSemaphore(MEDIA_BRIDGE_MAX_CONCURRENT)
+
+# file_unique_id -> VK attachment string; DB-backed (media_bridge_cache) with an in-process LRU in front
+BRIDGE_CACHE_LRU_SIZE = 1024
+BRIDGE_CACHE_TOUCH_INTERVAL = 6 * 3600
+
+_bridge_cache: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+_db_pool: 'Optional[psycopg2.pool.ThreadedConnectionPool]' = None
+_db_pool_lock = threading.Lock()
+_connection_class: Optional[type] = None
+_cursor_class: Optional[type] = None
+_http_session: 'Optional[requests.Session]' = None
+_http_session_lock = threading.Lock()
+# In-process metrics. Plain int updates without a lock, like every counter here: the GIL keeps them
+# consistent enough for monitoring, and a rare lost increment under thread contention is acceptable
+_update_counts: Dict[str, int] = {}
+_route_metrics: Dict[str, 'LatencyHistogram'] = {}
+_api_metrics: Dict[str, 'LatencyHistogram'] = {}
+_api_responses: Dict[Tuple[str, str], int] = {}
+_db_checkout_metrics: Dict[str, 'LatencyHistogram'] = {}
+_trace_local = threading.local()
+_trace_sink_lock = threading.Lock()
+_profile_sink_lock = threading.Lock()
+
+class MultipartStream:
+    """
+    multipart/form-data body whose file part is pulled lazily from a chunk iterator.
+    With a known size requests sends it with Content-Length, otherwise with chunked transfer.
+    """
+    
+    def __init__(self, field: str, filename: str, mime_type: str, chunks: Iterator[bytes], size: Optional[int] = None):
+        boundary = secrets.token_hex(16)
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        head = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: {mime_type}\r\n\r\n'
+        ).encode('utf-8')
+        tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        self.length = len(head) + size + len(tail) if size is not None else None
+        self._parts = self._chain(head, chunks, tail)
+        self._buffer = b''
+    
+    @staticmethod
+    def _chain(head: bytes, chunks: Iterator[bytes], tail: bytes) -> Iterator[bytes]:
+        yield head
+        for chunk in chunks:
+            if chunk:
+                yield chunk
+        yield tail
+    
+    def __len__(self) -> int:
+        return self.length or 0
+    
+    def __iter__(self) -> Iterator[bytes]:
+        if self._buffer:
+            yield self._buffer
+            self._buffer = b''
+        yield from self._parts
+    
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._parts, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+def limited_chunks(response: 'requests.Response', max_bytes: int) -> Iterator[bytes]:
+    """Iterate a streamed download, aborting once it grows past max_bytes"""
+    received = 0
+    for chunk in response.iter_content(MEDIA_BRIDGE_CHUNK_SIZE):
+        received += len(chunk)
+        if received > max_bytes:
+            raise ValueError(f'File exceeds {max_bytes} bytes')
+        yield chunk
+
+class LatencyHistogram:
+    """Invocation count, failures and latency histogram of one route, API method or connection source"""
+    
+    __slots__ = ('count', 'errors', 'seconds_sum', 'bucket_counts')
+    
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds_sum = 0.0
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    
+    def observe(self, seconds: float, failed: bool):
+        self.count += 1
+        self.errors += failed
+        self.seconds_sum += seconds
+        self.bucket_counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+def observe_latency(histograms: Dict[str, LatencyHistogram], key: str, seconds: float, failed: bool = False):
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms.setdefault(key, LatencyHistogram())
+    histogram.observe(seconds, failed)
+
+def bump_counter(counters: Dict[Any, int], key: Any):
+    counters[key] = counters.get(key, 0) + 1
+
+def observe_api_call(label: str, started: float, status: str):
+    """Record an outbound call's latency and response status (or exception name) under its API method"""
+    if label.startswith('upload.'):
+        # Upload servers are per-shard hosts; one series for all of them keeps the label set bounded
+        label = 'upload'
+    observe_latency(_api_metrics, label, time.perf_counter() - started, not status.startswith('2'))
+    bump_counter(_api_responses, (label, status))
+
+class Trace:
+    """Spans of one sampled update, kept in memory and appended to the sink when the update finishes"""
+    
+    __slots__ = ('trace_id', 'route', 'started', 'started_at', 'spans')
+    
+    def __init__(self):
+        self.trace_id = secrets.token_hex(8)
+        self.route = 'unrouted'
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.spans: List[Dict[str, Any]] = []
+
+def start_trace() -> Optional[Trace]:
+    """Bind a trace to this thread if the update falls into the sample; unsampled updates bind None"""
+    trace = None
+    if TRACE_SAMPLE_RATE > 0 and secrets.randbelow(1_000_000) < TRACE_SAMPLE_RATE * 1_000_000:
+        trace = Trace()
+    _trace_local.trace = trace
+    return trace
+
+def tag_route(name: str):
+    """Name the update after its route, for its trace and for a sampled profile"""
+    _trace_local.route = name
+    trace = getattr(_trace_local, 'trace', None)
+    if trace is not None:
+        trace.route = name
+
+def record_span(kind: str, name: str, started: float, **attributes: Any):
+    """Attach a span that began at perf_counter() reading `started` and ends now to the thread's trace"""
+    trace = getattr(_trace_local, 'trace', None)
+    if trace is None:
+        return
+    trace.spans.append({
+        'kind': kind,
+        'name': name,
+        'offset_ms': round((started - trace.started) * 1000, 3),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+        **attributes
+    })
+
+def finish_trace(trace: Optional[Trace], failed: bool):
+    """Unbind the trace and append its root span and child spans to the NDJSON sink in one write"""
+    _trace_local.trace = None
+    if trace is None:
+        return
+    root = {
+        'kind': 'update',
+        'name': trace.route,
+        'offset_ms': 0.0,
+        'duration_ms': round((time.perf_counter() - trace.started) * 1000, 3),
+        'platform': 'telegram',
+        'failed': failed
+    }
+    common = {'trace_id': trace.trace_id, 'route': trace.route, 'started_at': round(trace.started_at, 3)}
+    lines = ''.join(json.dumps({**common, **span}, ensure_ascii=False) + '\n' for span in [root, *trace.spans])
+    try:
+        with _trace_sink_lock:
+            os.makedirs(os.path.dirname(TRACE_PATH) or '.', exist_ok=True)
+            with open(TRACE_PATH, 'a', encoding='utf-8') as sink:
+                sink.write(lines)
+                full = sink.tell() > TRACE_MAX_BYTES
+            if full:
+                os.replace(TRACE_PATH, f'{TRACE_PATH}.1')
+    except OSError:
+        # Traces are diagnostics; a full or read-only disk must not fail the update
+        pass
+
+def statement_label(query: Any) -> str:
+    """Span name for a query: the prepared statement's name, otherwise its verb and table"""
+    if not isinstance(query, str):
+        return 'sql'
+    words = query.split(None, 2)
+    verb = words[0].upper() if words else 'SQL'
+    if verb in ('EXECUTE', 'PREPARE') and len(words) > 1:
+        name = words[1].split('(', 1)[0]
+        return name if verb == 'EXECUTE' else f'prepare {name}'
+    table = SQL_TABLE_PATTERN.search(query)
+    return f'{verb} {table.group(1)}' if table else verb
+
+def api_method_label(url: str) -> str:
+    """Span name for an outbound call, e.g. telegram.sendMessage; never contains the token in Bot API paths"""
+    if url.startswith(VK_API_URL):
+        return 'vk.' + url[len(VK_API_URL):].strip('/').split('?', 1)[0]
+    if url.startswith(TELEGRAM_API_URL):
+        path = url[len(TELEGRAM_API_URL):]
+        return 'telegram.file' if path.startswith('/file/') else 'telegram.' + path.rsplit('/', 1)[-1]
+    # VK upload servers: the host is enough, the query string carries signed parameters
+    return 'upload.' + url.split('/', 3)[2]
+
+def instrumented_request(request: Callable[..., 'requests.Response']) -> Callable[..., 'requests.Response']:
+    """Wrap Session.request so every call feeds the API metrics and, while an update is traced, becomes a span"""
+    def instrumented(method: str, url: str, *args: Any, **kwargs: Any) -> 'requests.Response':
+        label = api_method_label(url)
+        started = time.perf_counter()
+        try:
+            response = request(method, url, *args, **kwargs)
+        except Exception as e:
+            observe_api_call(label, started, type(e).__name__)
+            record_span('http', label, started, method=method, error=type(e).__name__)
+            raise
+        observe_api_call(label, started, str(response.status_code))
+        record_span('http', label, started, method=method, status=response.status_code)
+        return response
+    return instrumented
 
-def send_vk_message(user_id: int, text: str, keyboard: Optional[Dict] = None) -> bool:
+def http_session() -> 'requests.Session':
+    """Shared session so Bot API and VK calls reuse kept-alive TLS connections"""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                session = requests.Session()
+                # get()/post() go through self.request, so the instance attribute covers every call
+                session.request = instrumented_request(session.request)
+                _http_session = session
+    return _http_session
+
+def vk_api_call(method: str, params: Dict[str, Any]) -> Optional[Any]:
+    """Call VK API method"""
+    params['access_token'] = VK_GROUP_TOKEN
+    params['v'] = VK_API_VERSION
+    
+    # Bounded like every bridge request: a stalled VK call must not hold a bridge slot or the webhook
+    response = http_session().post(f'{VK_API_URL}/{method}', data=params, timeout=MEDIA_BRIDGE_TIMEOUT)
+    result = response.json()
+    return result.get('response')
+
+def send_vk_message(user_id: int, text: str, keyboard: Optional[Dict] = None, attachment: Optional[str] = None) -> bool:
     """Send message to VK user"""
-    import random
-    url = 'https://api.vk.com/method/messages.send'
     params = {
         'user_id': user_id,
         'message': text,
-        'random_id': random.randint(0, 2147483647),
-        'access_token': VK_GROUP_TOKEN,
-        'v': VK_API_VERSION
+        'random_id': secrets.randbelow(2 ** 31)
     }
     
     if keyboard:
         params['keyboard'] = json.dumps(keyboard)
+    if attachment:
+        params['attachment'] = attachment
     
-    response = requests.post(url, data=params)
-    result = response.json()
-    return 'response' in result
+    return vk_api_call('messages.send', params) is not None
 
 def send_message(chat_id: int, text: str, reply_markup: Optional[Dict] = None) -> bool:
-    url = f'https://api.telegram.org/bot{BOT_TOKEN}/sendMessage'
+    url = f'{TELEGRAM_API_URL}/bot{BOT_TOKEN}/sendMessage'
     data = {'chat_id': chat_id, 'text': text, 'parse_mode': 'HTML'}
     if reply_markup:
         data['reply_markup'] = json.dumps(reply_markup)
     
-    response = requests.post(url, json=data)
+    response = http_session().post(url, json=data)
     return response.status_code == 200
 
-def send_cross_platform_message(user: Dict, text: str, keyboard: Optional[Dict] = None) -> bool:
-    """Send message to user on any platform"""
-    platform = user.get('platform', 'telegram')
+def upload_to_vk(vk_user_id: int, content_type: str, file_path: str, file_size: Optional[int]) -> Optional[str]:
+    """Stream a Telegram file into a VK messages upload server and return the attachment string"""
+    kind, doc_type = VK_UPLOAD_KINDS.get(content_type, ('doc', 'doc'))
+    
+    if kind == 'photo':
+        server = vk_api_call('photos.getMessagesUploadServer', {'peer_id': vk_user_id})
+    else:
+        server = vk_api_call('docs.getMessagesUploadServer', {'peer_id': vk_user_id, 'type': doc_type})
+    if not server:
+        return None
+    
+    download = http_session().get(
+        f'{TELEGRAM_API_URL}/file/bot{BOT_TOKEN}/{file_path}',
+        stream=True,
+        timeout=MEDIA_BRIDGE_TIMEOUT
+    )
+    try:
+        if download.status_code != 200:
+            return None
+        body = MultipartStream(
+            'photo' if kind == 'photo' else 'file',
+            os.path.basename(file_path),
+            MIME_TYPES.get(content_type, 'application/octet-stream'),
+            limited_chunks(download, MEDIA_BRIDGE_MAX_BYTES),
+            file_size
+        )
+        uploaded = http_session().post(
+            server['upload_url'],
+            data=body,
+            headers={'Content-Type': body.content_type},
+            timeout=MEDIA_BRIDGE_TIMEOUT
+        ).json()
+    finally:
+        download.close()
+    
+    if kind == 'photo':
+        saved = vk_api_call('photos.saveMessagesPhoto', {
+            'server': uploaded.get('server'),
+            'photo': uploaded.get('photo'),
+            'hash': uploaded.get('hash')
+        })
+        if not saved:
+            return None
+        return f"photo{saved[0]['owner_id']}_{saved[0]['id']}"
+    
+    if 'file' not in uploaded:
+        return None
+    saved = vk_api_call('docs.save', {'file': uploaded['file']})
+    if not saved:
+        return None
+    item = saved[saved['type']]
+    attachment = f"{saved['type']}{item['owner_id']}_{item['id']}"
+    if item.get('access_key'):
+        attachment += f"_{item['access_key']}"
+    return attachment
+
+def remember_bridged(file_unique_id: str, attachment: str):
+    _bridge_cache[file_unique_id] = (attachment, time.monotonic())
+    _bridge_cache.move_to_end(file_unique_id)
+    while len(_bridge_cache) > BRIDGE_CACHE_LRU_SIZE:
+        _bridge_cache.popitem(last=False)
+
+def get_bridged_attachment(file_unique_id: str) -> Optional[str]:
+    """Cached VK attachment for a Telegram file; DB last_used_at is refreshed at most every few hours"""
+    cached = _bridge_cache.get(file_unique_id)
+    if cached and time.monotonic() - cached[1] < BRIDGE_CACHE_TOUCH_INTERVAL:
+        _bridge_cache.move_to_end(file_unique_id)
+        return cached[0]
+    
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "UPDATE t_p14838969_anon_talk_bot.media_bridge_cache SET last_used_at = CURRENT_TIMESTAMP "
+            "WHERE source_platform = 'telegram' AND source_key = %s RETURNING target_attachment",
+            (file_unique_id,)
+        )
+        row = cursor.fetchone()
+    
+    if not row:
+        _bridge_cache.pop(file_unique_id, None)
+        return None
+    remember_bridged(file_unique_id, row[0])
+    return row[0]
+
+def save_bridged_attachment(file_unique_id: str, attachment: str):
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO t_p14838969_anon_talk_bot.media_bridge_cache (source_platform, source_key, target_attachment) "
+            "VALUES ('telegram', %s, %s) "
+            "ON CONFLICT (source_platform, source_key) DO UPDATE SET "
+            "target_attachment = EXCLUDED.target_attachment, last_used_at = CURRENT_TIMESTAMP",
+            (file_unique_id, attachment)
+        )
+    remember_bridged(file_unique_id, attachment)
+
+def forget_bridged_attachment(file_unique_id: str):
+    _bridge_cache.pop(file_unique_id, None)
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM t_p14838969_anon_talk_bot.media_bridge_cache WHERE source_platform = 'telegram' AND source_key = %s",
+            (file_unique_id,)
+        )
+
+def bridge_media_to_vk(vk_user_id: int, content_type: str, file_id: str, file_unique_id: Optional[str], caption: Optional[str]) -> bool:
+    """Relay Telegram media to a VK user; False means the caller should fall back to text"""
+    if file_unique_id:
+        cached = get_bridged_attachment(file_unique_id)
+        if cached:
+            try:
+                if send_vk_message(vk_user_id, caption or '', attachment=cached):
+                    return True
+            except (requests.RequestException, ValueError):
+                return False
+            forget_bridged_attachment(file_unique_id)
+    
+    if not _bridge_slots.acquire(timeout=MEDIA_BRIDGE_TIMEOUT):
+        return False
+    try:
+        response = http_session().post(
+            f'{TELEGRAM_API_URL}/bot{BOT_TOKEN}/getFile', json={'file_id': file_id}, timeout=MEDIA_BRIDGE_TIMEOUT
+        )
+        result = response.json().get('result', {}) if response.status_code == 200 else {}
+        file_path = result.get('file_path')
+        file_size = result.get('file_size')
+        if not file_path or (file_size and file_size > MEDIA_BRIDGE_MAX_BYTES):
+            return False
+        
+        attachment = upload_to_vk(vk_user_id, content_type, file_path, file_size)
+        if not attachment:
+            return False
+    except (requests.RequestException, ValueError, KeyError):
+        return False
+    finally:
+        _bridge_slots.release()
+    
+    # The slot is already released: only the download and upload are bounded by it
+    if file_unique_id:
+        save_bridged_attachment(file_unique_id, attachment)
+    try:
+        return send_vk_message(vk_user_id, caption or '', attachment=attachment)
+    except (requests.RequestException, ValueError):
+        return False
+
+def send_cross_platform_message(user: UserRow, text: str, keyboard: Optional[Dict] = None, media: Optional[Tuple[str, str, Optional[str]]] = None) -> bool:
+    """Send message to user on any platform; media is (content_type, file_id, file_unique_id) for VK users"""
+    platform = user.platform or 'telegram'
+    
+    if platform == 'vk' and media:
+        content_type, file_id, file_unique_id = media
+        if bridge_media_to_vk(int(user.platform_id), content_type, file_id, file_unique_id, text):
+            return True
+        text = '\n'.join(part for part in (CONTENT_TYPE_LABELS.get(content_type), text) if part)
     
     if platform == 'vk':
         vk_keyboard = None
@@ -54,108 +612,193 @@ def send_cross_platform_message(user: Dict, text: str, keyboard: Optional[Dict]
             vk_keyboard = {
                 'buttons': [[{'action': {'type': 'text', 'label': btn['text']}} for btn in row] for row in keyboard['keyboard']]
             }
-        return send_vk_message(int(user['platform_id']), text, vk_keyboard)
+        return send_vk_message(int(user.platform_id), text, vk_keyboard)
     else:
-        return send_message(user['telegram_id'], text, keyboard)
+        return send_message(user.telegram_id, text, keyboard)
 
-def send_photo(chat_id: int, photo_id: str, caption: Optional[str] = None) -> bool:
-    url = f'https://api.telegram.org/bot{BOT_TOKEN}/sendPhoto'
-    data = {'chat_id': chat_id, 'photo': photo_id}
-    if caption:
-        data['caption'] = caption
-        data['parse_mode'] = 'HTML'
+def copy_message(chat_id: int, from_chat_id: int, message_id: int) -> bool:
+    """Relay any message type as-is via copyMessage (no re-upload, no per-type payload)"""
+    url = f'{TELEGRAM_API_URL}/bot{BOT_TOKEN}/copyMessage'
+    data = {'chat_id': chat_id, 'from_chat_id': from_chat_id, 'message_id': message_id}
     
-    response = requests.post(url, json=data)
+    response = http_session().post(url, json=data)
     return response.status_code == 200
 
-def send_video(chat_id: int, video_id: str, caption: Optional[str] = None) -> bool:
-    url = f'https://api.telegram.org/bot{BOT_TOKEN}/sendVideo'
-    data = {'chat_id': chat_id, 'video': video_id}
-    if caption:
-        data['caption'] = caption
-        data['parse_mode'] = 'HTML'
-    
-    response = requests.post(url, json=data)
-    return response.status_code == 200
+def tracing_cursor_class() -> type:
+    """psycopg2 cursor subclass that records each execute() as a db span while an update is traced"""
+    global _cursor_class
+    if _cursor_class is None:
+        class TracingCursor(psycopg2.extensions.cursor):
+            def execute(self, query, vars=None):
+                if getattr(_trace_local, 'trace', None) is None:
+                    return super().execute(query, vars)
+                started = time.perf_counter()
+                try:
+                    super().execute(query, vars)
+                except Exception as e:
+                    record_span('db', statement_label(query), started, error=type(e).__name__)
+                    raise
+                record_span('db', statement_label(query), started, rows=self.rowcount)
+        _cursor_class = TracingCursor
+    return _cursor_class
 
-def send_voice(chat_id: int, voice_id: str, caption: Optional[str] = None) -> bool:
-    url = f'https://api.telegram.org/bot{BOT_TOKEN}/sendVoice'
-    data = {'chat_id': chat_id, 'voice': voice_id}
-    if caption:
-        data['caption'] = caption
-        data['parse_mode'] = 'HTML'
-    
-    response = requests.post(url, json=data)
-    return response.status_code == 200
+def preparing_connection_class() -> type:
+    """
+    psycopg2 connection subclass that remembers which named statements its server session has prepared.
+    Its cursors are tracing cursors, and the connect handshake itself is a span of the update that paid for it.
+    """
+    global _connection_class
+    if _connection_class is None:
+        class PreparingConnection(psycopg2.extensions.connection):
+            def __init__(self, *args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    super().__init__(*args, **kwargs)
+                except Exception as e:
+                    record_span('db', 'connect', started, error=type(e).__name__)
+                    raise
+                record_span('db', 'connect', started)
+                self.prepared: Set[str] = set()
+                self.cursor_factory = tracing_cursor_class()
+        _connection_class = PreparingConnection
+    return _connection_class
 
-def send_video_note(chat_id: int, video_note_id: str) -> bool:
-    url = f'https://api.telegram.org/bot{BOT_TOKEN}/sendVideoNote'
-    data = {'chat_id': chat_id, 'video_note': video_note_id}
+class PooledConnection:
+    """Connection checked out of the pool; close() hands it back instead of disconnecting"""
     
-    response = requests.post(url, json=data)
-    return response.status_code == 200
-
-def send_sticker(chat_id: int, sticker_id: str) -> bool:
-    url = f'https://api.telegram.org/bot{BOT_TOKEN}/sendSticker'
-    data = {'chat_id': chat_id, 'sticker': sticker_id}
+    def __init__(self, pool: 'psycopg2.pool.ThreadedConnectionPool', conn):
+        self._pool = pool
+        self._conn = conn
     
-    response = requests.post(url, json=data)
-    return response.status_code == 200
+    def __getattr__(self, name: str):
+        return getattr(self._conn, name)
+    
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._pool.putconn(conn, close=bool(conn.closed))
 
-def get_file_url(file_id: str) -> Optional[str]:
-    try:
-        url = f'https://api.telegram.org/bot{BOT_TOKEN}/getFile'
-        response = requests.post(url, json={'file_id': file_id})
-        if response.status_code == 200:
-            file_path = response.json().get('result', {}).get('file_path')
-            if file_path:
-                return f'https://api.telegram.org/file/bot{BOT_TOKEN}/{file_path}'
-        return None
-    except:
-        return None
+def get_db_pool() -> 'psycopg2.pool.ThreadedConnectionPool':
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            _db_pool = psycopg2.pool.ThreadedConnectionPool(
+                0, DB_POOL_MAX_CONNECTIONS, DATABASE_URL, connection_factory=preparing_connection_class()
+            )
+        return _db_pool
 
 def get_db_connection():
-    conn = psycopg2.connect(DATABASE_URL)
+    """Check a connection out of the pool; the wait (including any handshake) feeds the checkout histogram"""
+    started = time.perf_counter()
+    pool = get_db_pool()
+    try:
+        conn = pool.getconn()
+    except psycopg2.pool.PoolError:
+        # Pool exhausted: fall back to a one-off connection rather than failing the update
+        conn = psycopg2.connect(DATABASE_URL, connection_factory=preparing_connection_class())
+        conn.autocommit = True
+        observe_latency(_db_checkout_metrics, 'fallback', time.perf_counter() - started)
+        return conn
+    if conn.closed:
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
     conn.autocommit = True
-    return conn
-
-def escape_sql(value: Any) -> str:
-    if value is None:
-        return 'NULL'
-    if isinstance(value, bool):
-        return 'TRUE' if value else 'FALSE'
-    if isinstance(value, (int, float)):
-        return str(value)
-    return f"'{str(value).replace(chr(39), chr(39)+chr(39))}'"
-
-def get_or_create_user(telegram_id: int, username: Optional[str] = None) -> Dict[str, Any]:
+    observe_latency(_db_checkout_metrics, 'pool', time.perf_counter() - started)
+    return PooledConnection(pool, conn)
+
+@contextmanager
+def pooled_connection():
+    """
+    get_db_connection() for a with block: the connection goes back to the pool even when the block raises.
+    Handlers leave the block before calling the Telegram or VK API, so a slow send never holds a connection.
+    """
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute(f"SELECT * FROM users WHERE telegram_id = {telegram_id}")
-    user = cursor.fetchone()
-    
-    if not user:
-        username_sql = escape_sql(username)
-        cursor.execute(
-            f"INSERT INTO users (telegram_id, username, last_active) VALUES ({telegram_id}, {username_sql}, CURRENT_TIMESTAMP) RETURNING *"
-        )
-        user = cursor.fetchone()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def prepare_statement(cursor, name: str):
+    """PREPARE a PREPARED_STATEMENTS entry unless this connection already has it"""
+    conn = cursor.connection
+    if name not in conn.prepared:
+        arg_types, sql = PREPARED_STATEMENTS[name]
+        cursor.execute(f"PREPARE {name}{f' ({arg_types})' if arg_types else ''} AS {sql}")
+        conn.prepared.add(name)
+
+def execute_prepared(cursor, name: str, params: Tuple = ()):
+    """Execute a PREPARED_STATEMENTS entry by name, preparing it on first use on this connection"""
+    prepare_statement(cursor, name)
+    if params:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
     else:
-        cursor.execute(f"UPDATE users SET last_active = CURRENT_TIMESTAMP WHERE telegram_id = {telegram_id}")
-    
-    cursor.close()
-    conn.close()
-    return dict(user) if user else {}
+        cursor.execute(f"EXECUTE {name}")
+
+def record_stats(cursor, telegram_id: int, counters: Dict[str, int]):
+    """Add counters to the current minute's stats_rollup rows for the user's platform and gender"""
+    if len(counters) == 1:
+        (metric, value), = counters.items()
+        execute_prepared(cursor, 'stats_bump', (metric, value, telegram_id))
+        return
+    values_sql = ', '.join(['(%s, %s)'] * len(counters))
+    params = [item for pair in counters.items() for item in pair]
+    cursor.execute(
+        "INSERT INTO t_p14838969_anon_talk_bot.stats_rollup (bucket, metric, platform, gender, value) "
+        "SELECT date_trunc('minute', CURRENT_TIMESTAMP), c.metric, COALESCE(u.platform, 'telegram'), "
+        "CASE WHEN u.gender IN ('male', 'female') THEN u.gender ELSE 'unknown' END, c.value "
+        f"FROM t_p14838969_anon_talk_bot.users u, (VALUES {values_sql}) AS c(metric, value) "
+        "WHERE u.telegram_id = %s "
+        "ON CONFLICT (bucket, metric, platform, gender) DO UPDATE SET value = stats_rollup.value + EXCLUDED.value",
+        params + [telegram_id]
+    )
+
+def notify_admin(cursor, event: Dict[str, Any]):
+    """Append a dashboard delta to admin_events; its trigger wakes admin-api's long polls on commit"""
+    cursor.execute("INSERT INTO t_p14838969_anon_talk_bot.admin_events (payload) VALUES (%s)", (json.dumps(event),))
+
+def end_chat(cursor, chat_db_id: int, ended_by: int):
+    """Close the chat and count it, with its duration, towards the stats rollup"""
+    cursor.execute(
+        "UPDATE chats SET is_active = FALSE, ended_at = CURRENT_TIMESTAMP WHERE id = %s AND is_active = TRUE "
+        "RETURNING EXTRACT(EPOCH FROM (ended_at - started_at)) AS duration_seconds",
+        (chat_db_id,)
+    )
+    ended = cursor.fetchone()
+    if ended:
+        record_stats(cursor, ended_by, {'chats_ended': 1, 'chat_duration_seconds': int(ended[0] or 0)})
+        notify_admin(cursor, {'type': 'chat_ended', 'chat_id': chat_db_id, 'delta': {'active_chats': -1}})
+
+def fetch_user_row(cursor, statement: str, params: Tuple) -> Optional[UserRow]:
+    """Run a prepared statement that yields USER_COLUMNS and map its row without a dict"""
+    execute_prepared(cursor, statement, params)
+    row = cursor.fetchone()
+    return UserRow._make(row) if row else None
+
+def get_user(cursor, telegram_id: int) -> Optional[UserRow]:
+    return fetch_user_row(cursor, 'user_by_telegram_id', (telegram_id,))
+
+def get_or_create_user(telegram_id: int, username: Optional[str] = None) -> Optional[UserRow]:
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        user = fetch_user_row(cursor, 'user_touch', (telegram_id,))
+        
+        if not user:
+            cursor.execute(
+                f"INSERT INTO users (telegram_id, username, last_active) VALUES (%s, %s, CURRENT_TIMESTAMP) RETURNING {USER_COLUMNS}",
+                (telegram_id, username)
+            )
+            user = UserRow._make(cursor.fetchone())
+    
+    return user
 
 def handle_start(chat_id: int, username: Optional[str]):
     user = get_or_create_user(chat_id, username)
     
-    if user.get('is_blocked'):
+    if user.is_blocked:
         send_message(chat_id, '🚫 Вы заблокированы')
         return
     
-    if not user.get('gender'):
+    if not user.gender:
         handle_set_gender(chat_id)
         return
     
@@ -191,43 +834,16 @@ def handle_set_gender(chat_id: int):
     send_message(chat_id, '👤 Выберите ваш пол для начала:', keyboard)
 
 def update_user_gender(telegram_id: int, gender: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    gender_sql = escape_sql(gender)
-    cursor.execute(f"UPDATE users SET gender = {gender_sql} WHERE telegram_id = {telegram_id}")
-    cursor.close()
-    conn.close()
-
-def get_partner_from_chat(chat_id: int) -> Optional[Dict]:
-    """Get partner info with platform details from active chat"""
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute(f"SELECT * FROM users WHERE telegram_id = {chat_id}")
-    user = cursor.fetchone()
-    
-    if not user or not user['is_in_chat'] or not user['current_chat_id']:
-        cursor.close()
-        conn.close()
-        return None
-    
-    cursor.execute(f"SELECT user1_telegram_id, user2_telegram_id FROM chats WHERE id = {user['current_chat_id']} AND is_active = TRUE")
-    chat_data = cursor.fetchone()
-    
-    if not chat_data:
-        cursor.close()
-        conn.close()
-        return None
-    
-    partner_telegram_id = chat_data['user2_telegram_id'] if chat_data['user1_telegram_id'] == chat_id else chat_data['user1_telegram_id']
-    
-    cursor.execute(f"SELECT * FROM users WHERE telegram_id = {partner_telegram_id}")
-    partner = cursor.fetchone()
-    
-    cursor.close()
-    conn.close()
-    
-    return dict(partner) if partner else None
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        cursor.execute("UPDATE users SET gender = %s WHERE telegram_id = %s", (gender, telegram_id))
+
+def get_partner(cursor, chat_id: int) -> Optional[UserRow]:
+    """Partner of the user's active chat, with platform details"""
+    return fetch_user_row(cursor, 'partner_of_user', (chat_id,))
+
+def get_partner_from_chat(chat_id: int) -> Optional[UserRow]:
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        return get_partner(cursor, chat_id)
 
 def handle_settings(chat_id: int):
     keyboard = {
@@ -239,88 +855,87 @@ def handle_settings(chat_id: int):
     }
     send_message(chat_id, '⚙️ Настройки:', keyboard)
 
-def find_partner(telegram_id: int, preferred_gender: Optional[str] = None) -> Optional[Dict]:
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    query = f"SELECT * FROM users WHERE is_searching = TRUE AND telegram_id != {telegram_id} AND is_blocked = FALSE"
+def find_partner(cursor, telegram_id: int, preferred_gender: Optional[str] = None) -> Optional[UserRow]:
+    query = f"SELECT {USER_COLUMNS} FROM users WHERE is_searching = TRUE AND telegram_id != %s AND is_blocked = FALSE"
+    args = [telegram_id]
     
     if preferred_gender:
-        gender_sql = escape_sql(preferred_gender)
-        query += f" AND gender = {gender_sql}"
+        query += " AND gender = %s"
+        args.append(preferred_gender)
     
     query += " ORDER BY RANDOM() LIMIT 1"
     
-    cursor.execute(query)
+    cursor.execute(query, args)
     partner = cursor.fetchone()
     
-    cursor.close()
-    conn.close()
-    
-    return dict(partner) if partner else None
+    return UserRow._make(partner) if partner else None
 
-def create_chat(user1: Dict, user2: Dict) -> int:
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    user1_platform = user1.get('platform', 'telegram')
-    user1_platform_id = user1.get('platform_id', str(user1['telegram_id']))
-    user2_platform = user2.get('platform', 'telegram')
-    user2_platform_id = user2.get('platform_id', str(user2['telegram_id']))
-    
-    cursor.execute(f"""
-        INSERT INTO chats (user1_telegram_id, user2_telegram_id, user1_platform, user1_platform_id, user2_platform, user2_platform_id) 
-        VALUES ({user1['telegram_id']}, {user2['telegram_id']}, '{user1_platform}', '{user1_platform_id}', '{user2_platform}', '{user2_platform_id}') 
-        RETURNING id
-    """)
+def create_chat(cursor, user1: UserRow, user2: UserRow) -> int:
+    user1_platform = user1.platform or 'telegram'
+    user1_platform_id = user1.platform_id or str(user1.telegram_id)
+    user2_platform = user2.platform or 'telegram'
+    user2_platform_id = user2.platform_id or str(user2.telegram_id)
+    
+    cursor.execute(
+        "INSERT INTO chats (user1_telegram_id, user2_telegram_id, user1_platform, user1_platform_id, user2_platform, user2_platform_id) "
+        "VALUES (%s, %s, %s, %s, %s, %s) RETURNING id",
+        (user1.telegram_id, user2.telegram_id, user1_platform, user1_platform_id, user2_platform, user2_platform_id)
+    )
     chat_id = cursor.fetchone()[0]
     
-    cursor.execute(f"UPDATE users SET is_searching = FALSE, is_in_chat = TRUE, current_chat_id = {chat_id} WHERE telegram_id IN ({user1['telegram_id']}, {user2['telegram_id']})")
+    cursor.execute(
+        "UPDATE users SET is_searching = FALSE, is_in_chat = TRUE, current_chat_id = %s WHERE telegram_id IN (%s, %s)",
+        (chat_id, user1.telegram_id, user2.telegram_id)
+    )
+    notify_admin(cursor, {
+        'type': 'chat_started',
+        'chat': {
+            'id': chat_id,
+            'user1_gender': user1.gender or 'unknown',
+            'user2_gender': user2.gender or 'unknown',
+            'message_count': 0,
+            'duration_minutes': 0
+        },
+        'delta': {'active_chats': 1}
+    })
     
-    cursor.close()
-    conn.close()
     return chat_id
 
 def handle_search(chat_id: int, preferred_gender: Optional[str] = None):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute(f"SELECT * FROM users WHERE telegram_id = {chat_id}")
-    user = cursor.fetchone()
+    partner = None
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        user = get_user(cursor, chat_id)
+        
+        if user and not user.is_blocked and not user.is_in_chat and user.gender:
+            cursor.execute("UPDATE users SET last_search_gender = %s WHERE telegram_id = %s", (preferred_gender, chat_id))
+            
+            partner = find_partner(cursor, chat_id, preferred_gender)
+            
+            if partner:
+                create_chat(cursor, user, partner)
+                record_stats(cursor, chat_id, {'searches': 1, 'chats_started': 1})
+            else:
+                cursor.execute("UPDATE users SET is_searching = TRUE WHERE telegram_id = %s", (chat_id,))
+                record_stats(cursor, chat_id, {'searches': 1})
     
     if not user:
-        cursor.close()
-        conn.close()
         send_message(chat_id, '❌ Ошибка. Используйте /start')
         return
     
-    if user['is_blocked']:
-        cursor.close()
-        conn.close()
+    if user.is_blocked:
         send_message(chat_id, '🚫 Вы заблокированы')
         return
     
-    if user['is_in_chat']:
-        cursor.close()
-        conn.close()
+    if user.is_in_chat:
         send_message(chat_id, '💬 Вы уже в диалоге')
         return
     
-    if not user['gender']:
-        cursor.close()
-        conn.close()
+    if not user.gender:
         send_message(chat_id, '⚠️ Сначала укажите ваш пол')
         handle_set_gender(chat_id)
         return
     
-    gender_sql = escape_sql(preferred_gender)
-    cursor.execute(f"UPDATE users SET last_search_gender = {gender_sql} WHERE telegram_id = {chat_id}")
-    
-    partner = find_partner(chat_id, preferred_gender)
-    
     if partner:
-        chat_db_id = create_chat(user, partner)
-        
         chat_keyboard = {
             'keyboard': [
                 [{'text': '❌ Завершить диалог'}],
@@ -329,13 +944,12 @@ def handle_search(chat_id: int, preferred_gender: Optional[str] = None):
             'resize_keyboard': True
         }
         
-        platform_emoji = '📱 VK' if partner.get('platform') == 'vk' else '✈️ Telegram'
+        platform_emoji = '📱 VK' if partner.platform == 'vk' else '✈️ Telegram'
         send_message(chat_id, f'✅ Собеседник найден! ({platform_emoji})\n\nМожете начинать общение', chat_keyboard)
         
         user_platform_emoji = '✈️ Telegram'
         send_cross_platform_message(partner, f'✅ Собеседник найден! ({user_platform_emoji})\n\nМожете начинать общение', chat_keyboard)
     else:
-        cursor.execute(f"UPDATE users SET is_searching = TRUE WHERE telegram_id = {chat_id}")
         search_text = '🔍 Ищем собеседника...'
         if preferred_gender:
             gender_text = '👨 мужского' if preferred_gender == 'male' else '👩 женского'
@@ -348,9 +962,6 @@ def handle_search(chat_id: int, preferred_gender: Optional[str] = None):
             'resize_keyboard': True
         }
         send_message(chat_id, search_text, searching_keyboard)
-    
-    cursor.close()
-    conn.close()
 
 def handle_gender_search(chat_id: int):
     keyboard = {
@@ -362,16 +973,28 @@ def handle_gender_search(chat_id: int):
     }
     send_message(chat_id, '🎯 Выберите пол собеседника:', keyboard)
 
+def end_user_chat(cursor, user: UserRow) -> Optional[UserRow]:
+    """End the user's active chat and free both members; returns the partner to notify"""
+    partner = get_partner(cursor, user.telegram_id)
+    if partner:
+        end_chat(cursor, user.current_chat_id, user.telegram_id)
+        cursor.execute(
+            "UPDATE users SET is_in_chat = FALSE, current_chat_id = NULL WHERE telegram_id IN (%s, %s)",
+            (user.telegram_id, partner.telegram_id)
+        )
+    return partner
+
 def handle_stop_chat(chat_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute(f"SELECT * FROM users WHERE telegram_id = {chat_id}")
-    user = cursor.fetchone()
+    partner = None
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        user = get_user(cursor, chat_id)
+        
+        if user and user.is_searching:
+            cursor.execute("UPDATE users SET is_searching = FALSE WHERE telegram_id = %s", (chat_id,))
+        elif user and user.is_in_chat and user.current_chat_id:
+            partner = end_user_chat(cursor, user)
     
     if not user:
-        cursor.close()
-        conn.close()
         return
     
     main_keyboard = {
@@ -382,254 +1005,353 @@ def handle_stop_chat(chat_id: int):
         'resize_keyboard': True
     }
     
-    if user['is_searching']:
-        cursor.execute(f"UPDATE users SET is_searching = FALSE WHERE telegram_id = {chat_id}")
+    if user.is_searching:
         send_message(chat_id, '❌ Поиск остановлен', main_keyboard)
-    elif user['is_in_chat'] and user['current_chat_id']:
-        partner = get_partner_from_chat(chat_id)
-        
+    elif user.is_in_chat and user.current_chat_id:
         if partner:
-            cursor.execute(f"UPDATE chats SET is_active = FALSE, ended_at = CURRENT_TIMESTAMP WHERE id = {user['current_chat_id']}")
-            cursor.execute(f"UPDATE users SET is_in_chat = FALSE, current_chat_id = NULL WHERE telegram_id IN ({chat_id}, {partner['telegram_id']})")
-            
             send_message(chat_id, '👋 Диалог завершён', main_keyboard)
             send_cross_platform_message(partner, '👋 Собеседник завершил диалог', main_keyboard)
     else:
         send_message(chat_id, '⚠️ Вы не в диалоге', main_keyboard)
-    
-    cursor.close()
-    conn.close()
 
 def handle_next_chat(chat_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute(f"SELECT * FROM users WHERE telegram_id = {chat_id}")
-    user = cursor.fetchone()
+    partner = None
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        user = get_user(cursor, chat_id)
+        
+        if user and user.is_in_chat and user.current_chat_id:
+            partner = end_user_chat(cursor, user)
     
     if not user:
-        cursor.close()
-        conn.close()
         send_message(chat_id, '❌ Ошибка. Используйте /start')
         return
     
-    if user['is_in_chat'] and user['current_chat_id']:
-        partner = get_partner_from_chat(chat_id)
-        
-        if partner:
-            cursor.execute(f"UPDATE chats SET is_active = FALSE, ended_at = CURRENT_TIMESTAMP WHERE id = {user['current_chat_id']}")
-            cursor.execute(f"UPDATE users SET is_in_chat = FALSE, current_chat_id = NULL WHERE telegram_id IN ({chat_id}, {partner['telegram_id']})")
-            
-            send_cross_platform_message(partner, '👋 Собеседник завершил диалог')
-    
-    cursor.close()
-    conn.close()
+    if partner:
+        send_cross_platform_message(partner, '👋 Собеседник завершил диалог')
     
-    handle_search(chat_id, user.get('last_search_gender'))
+    handle_search(chat_id, user.last_search_gender)
+
+def get_content_type(message: Dict) -> str:
+    for content_type in FILE_CONTENT_TYPES + STRUCTURED_CONTENT_TYPES:
+        if content_type in message:
+            return content_type
+    return 'text' if 'text' in message else 'unknown'
+
+def extract_file(message: Dict, content_type: str) -> Tuple[Optional[str], Optional[str]]:
+    """Return (file_id, file_unique_id) of the message media, largest size for photos"""
+    if content_type not in FILE_CONTENT_TYPES:
+        return None, None
+    media = message[content_type]
+    if content_type == 'photo':
+        media = media[-1]
+    return media.get('file_id'), media.get('file_unique_id')
 
-def handle_message(chat_id: int, text: str):
+def archive_content(message: Dict, content_type: str) -> Optional[str]:
+    """Text kept in the archive: text/caption, or the raw payload for locations, polls etc."""
+    if content_type in STRUCTURED_CONTENT_TYPES:
+        return json.dumps(message[content_type], ensure_ascii=False)
+    return message.get('text') or message.get('caption')
+
+def handle_relay(chat_id: int, message: Dict):
+    """Relay any user message to the chat partner and archive it"""
     partner = get_partner_from_chat(chat_id)
     
     if not partner:
-        send_message(chat_id, '⚠️ Вы не в диалоге. Используйте "Найти собеседника"')
-        return
-    
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute(f"SELECT * FROM users WHERE telegram_id = {chat_id}")
-    user = cursor.fetchone()
-    
-    cursor.execute(f"UPDATE chats SET message_count = message_count + 1 WHERE id = {user['current_chat_id']}")
-    
-    text_escaped = escape_sql(text)
-    cursor.execute(f"INSERT INTO t_p14838969_anon_talk_bot.messages (chat_id, sender_telegram_id, content_type, text_content) VALUES ({user['current_chat_id']}, {chat_id}, 'text', {text_escaped})")
-    
-    cursor.close()
-    conn.close()
-    
-    text_escaped = text.replace('<', '&lt;').replace('>', '&gt;')
-    send_cross_platform_message(partner, text_escaped)
-
-def handle_photo(chat_id: int, photo_id: str, caption: Optional[str] = None):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute(f"SELECT * FROM users WHERE telegram_id = {chat_id}")
-    user = cursor.fetchone()
-    
-    if not user or not user['is_in_chat'] or not user['current_chat_id']:
-        cursor.close()
-        conn.close()
-        send_message(chat_id, '⚠️ Вы не в диалоге. Используйте "Найти собеседника"')
+        send_message(chat_id, NOT_IN_CHAT_TEXT)
         return
     
-    cursor.execute(f"SELECT user1_telegram_id, user2_telegram_id FROM chats WHERE id = {user['current_chat_id']} AND is_active = TRUE")
-    chat_data = cursor.fetchone()
+    content_type = get_content_type(message)
+    file_id, file_unique_id = extract_file(message, content_type)
+    text_content = archive_content(message, content_type)
     
-    if chat_data:
-        partner_id = chat_data['user2_telegram_id'] if chat_data['user1_telegram_id'] == chat_id else chat_data['user1_telegram_id']
-        
-        cursor.execute(f"UPDATE chats SET message_count = message_count + 1 WHERE id = {user['current_chat_id']}")
-        
-        photo_url = get_file_url(photo_id)
-        photo_url_sql = escape_sql(photo_url)
-        caption_sql = escape_sql(caption) if caption else 'NULL'
-        cursor.execute(f"INSERT INTO t_p14838969_anon_talk_bot.messages (chat_id, sender_telegram_id, content_type, photo_url, text_content) VALUES ({user['current_chat_id']}, {chat_id}, 'photo', {photo_url_sql}, {caption_sql})")
-        
-        send_caption = None
-        if caption:
-            caption_escaped = caption.replace('<', '&lt;').replace('>', '&gt;')
-            send_caption = caption_escaped
+    if partner.platform == 'vk':
+        caption = message.get('text') or message.get('caption') or ''
+        if file_id:
+            send_cross_platform_message(partner, caption, media=(content_type, file_id, file_unique_id))
+        else:
+            vk_text = '\n'.join(part for part in (CONTENT_TYPE_LABELS.get(content_type), caption) if part)
+            if vk_text:
+                send_cross_platform_message(partner, vk_text)
+    else:
+        copy_message(partner.telegram_id, chat_id, message['message_id'])
+    
+    current_chat_id = partner.current_chat_id
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        execute_prepared(cursor, 'chat_message_count_bump', (current_chat_id,))
+        execute_prepared(cursor, 'message_insert', (current_chat_id, chat_id, content_type, file_id, file_unique_id, text_content))
+        message_id, sent_at = cursor.fetchone()
+        record_stats(cursor, chat_id, {'messages': 1})
         
-        send_photo(partner_id, photo_id, send_caption)
-    
-    cursor.close()
-    conn.close()
+        if file_id:
+            cursor.execute("SELECT gender FROM users WHERE telegram_id = %s", (chat_id,))
+            sender = cursor.fetchone()
+            notify_admin(cursor, {
+                'type': 'attachment_added',
+                'attachment': {
+                    'id': message_id,
+                    'chat_id': current_chat_id,
+                    'blob_sha256': None,
+                    'content_type': content_type,
+                    'sent_at': sent_at.isoformat(),
+                    'sender_gender': (sender[0] if sender else None) or 'unknown'
+                }
+            })
 
-def handle_video(chat_id: int, video_id: str, caption: Optional[str] = None):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute(f"SELECT * FROM users WHERE telegram_id = {chat_id}")
-    user = cursor.fetchone()
-    
-    if not user or not user['is_in_chat'] or not user['current_chat_id']:
-        cursor.close()
-        conn.close()
-        send_message(chat_id, '⚠️ Вы не в диалоге. Используйте "Найти собеседника"')
-        return
-    
-    cursor.execute(f"SELECT user1_telegram_id, user2_telegram_id FROM chats WHERE id = {user['current_chat_id']} AND is_active = TRUE")
-    chat_data = cursor.fetchone()
-    
-    if chat_data:
-        partner_id = chat_data['user2_telegram_id'] if chat_data['user1_telegram_id'] == chat_id else chat_data['user1_telegram_id']
-        
-        cursor.execute(f"UPDATE chats SET message_count = message_count + 1 WHERE id = {user['current_chat_id']}")
-        
-        video_url = get_file_url(video_id)
-        video_url_sql = escape_sql(video_url)
-        caption_sql = escape_sql(caption) if caption else 'NULL'
-        cursor.execute(f"INSERT INTO t_p14838969_anon_talk_bot.messages (chat_id, sender_telegram_id, content_type, photo_url, text_content) VALUES ({user['current_chat_id']}, {chat_id}, 'video', {video_url_sql}, {caption_sql})")
-        
-        send_caption = None
-        if caption:
-            caption_escaped = caption.replace('<', '&lt;').replace('>', '&gt;')
-            send_caption = caption_escaped
+def handle_complaint(chat_id: int):
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        user = get_user(cursor, chat_id)
         
-        send_video(partner_id, video_id, send_caption)
-    
-    cursor.close()
-    conn.close()
-
-def handle_voice(chat_id: int, voice_id: str):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute(f"SELECT * FROM users WHERE telegram_id = {chat_id}")
-    user = cursor.fetchone()
-    
-    if not user or not user['is_in_chat'] or not user['current_chat_id']:
-        cursor.close()
-        conn.close()
-        send_message(chat_id, '⚠️ Вы не в диалоге. Используйте "Найти собеседника"')
+        if user and user.is_in_chat and user.current_chat_id:
+            reason = 'Жалоба от пользователя'
+            cursor.execute(
+                "INSERT INTO complaints (chat_id, reporter_telegram_id, reason) VALUES (%s, %s, %s) RETURNING id, created_at",
+                (user.current_chat_id, chat_id, reason)
+            )
+            complaint_id, created_at = cursor.fetchone()
+            record_stats(cursor, chat_id, {'complaints': 1})
+            
+            cursor.execute(
+                "SELECT CASE WHEN user1_telegram_id = %s THEN user2_telegram_id ELSE user1_telegram_id END AS reported_user_id "
+                "FROM chats WHERE id = %s",
+                (chat_id, user.current_chat_id)
+            )
+            reported = cursor.fetchone()
+            notify_admin(cursor, {
+                'type': 'complaint_created',
+                'complaint': {
+                    'id': complaint_id,
+                    'chat_id': user.current_chat_id,
+                    'reported_user_id': reported[0] if reported else None,
+                    'reason': reason,
+                    'status': 'pending',
+                    'created_at': created_at.isoformat()
+                },
+                'delta': {'pending_complaints': 1}
+            })
+    
+    if not user or not user.is_in_chat or not user.current_chat_id:
+        send_message(chat_id, '⚠️ Вы не в диалоге')
         return
     
-    cursor.execute(f"SELECT user1_telegram_id, user2_telegram_id FROM chats WHERE id = {user['current_chat_id']} AND is_active = TRUE")
-    chat_data = cursor.fetchone()
-    
-    if chat_data:
-        partner_id = chat_data['user2_telegram_id'] if chat_data['user1_telegram_id'] == chat_id else chat_data['user1_telegram_id']
-        
-        cursor.execute(f"UPDATE chats SET message_count = message_count + 1 WHERE id = {user['current_chat_id']}")
-        
-        voice_url = get_file_url(voice_id)
-        voice_url_sql = escape_sql(voice_url)
-        cursor.execute(f"INSERT INTO t_p14838969_anon_talk_bot.messages (chat_id, sender_telegram_id, content_type, photo_url) VALUES ({user['current_chat_id']}, {chat_id}, 'voice', {voice_url_sql})")
-        
-        send_voice(partner_id, voice_id)
-    
-    cursor.close()
-    conn.close()
+    send_message(chat_id, '✅ Жалоба отправлена администрации')
 
-def handle_sticker(chat_id: int, sticker_id: str):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute(f"SELECT * FROM users WHERE telegram_id = {chat_id}")
-    user = cursor.fetchone()
-    
-    if not user or not user['is_in_chat'] or not user['current_chat_id']:
-        cursor.close()
-        conn.close()
-        send_message(chat_id, '⚠️ Вы не в диалоге. Используйте "Найти собеседника"')
-        return
-    
-    cursor.execute(f"SELECT user1_telegram_id, user2_telegram_id FROM chats WHERE id = {user['current_chat_id']} AND is_active = TRUE")
-    chat_data = cursor.fetchone()
-    
-    if chat_data:
-        partner_id = chat_data['user2_telegram_id'] if chat_data['user1_telegram_id'] == chat_id else chat_data['user1_telegram_id']
-        
-        cursor.execute(f"UPDATE chats SET message_count = message_count + 1 WHERE id = {user['current_chat_id']}")
-        
-        send_sticker(partner_id, sticker_id)
-    
-    cursor.close()
-    conn.close()
+def sender_username(message: Dict[str, Any]) -> Optional[str]:
+    return message.get('from', {}).get('username')
 
-def handle_video_note(chat_id: int, video_note_id: str):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute(f"SELECT * FROM users WHERE telegram_id = {chat_id}")
-    user = cursor.fetchone()
-    
-    if not user or not user['is_in_chat'] or not user['current_chat_id']:
-        cursor.close()
-        conn.close()
-        send_message(chat_id, '⚠️ Вы не в диалоге. Используйте "Найти собеседника"')
-        return
-    
-    cursor.execute(f"SELECT user1_telegram_id, user2_telegram_id FROM chats WHERE id = {user['current_chat_id']} AND is_active = TRUE")
-    chat_data = cursor.fetchone()
-    
-    if chat_data:
-        partner_id = chat_data['user2_telegram_id'] if chat_data['user1_telegram_id'] == chat_id else chat_data['user1_telegram_id']
+def handle_gender_selected(chat_id: int, username: Optional[str], gender: str):
+    update_user_gender(chat_id, gender)
+    send_message(chat_id, '✅ Пол установлен: Мужской' if gender == 'male' else '✅ Пол установлен: Женский')
+    handle_start(chat_id, username)
+
+# Commands work in every state but searching, where only stopping is routed
+COMMAND_STATES = frozenset({'idle', 'no_gender', 'in_chat'})
+
+class Route(NamedTuple):
+    """Button/command texts routed to one handler in the listed user states"""
+    name: str
+    texts: Tuple[str, ...]
+    handler: Callable[[int, Dict[str, Any]], None]
+    states: FrozenSet[str] = COMMAND_STATES
+
+# Labels of both bots' keyboards are accepted, so a button rendered by either platform routes the same way
+ROUTES = (
+    Route('start', ('/start', '◀️ Назад'), lambda chat_id, message: handle_start(chat_id, sender_username(message))),
+    Route('stop', ('/stop', '❌ Завершить диалог', '❌ Отменить поиск', '🛑 Стоп'),
+          lambda chat_id, message: handle_stop_chat(chat_id), COMMAND_STATES | {'searching'}),
+    Route('next', ('/next', '🔍 Найти нового собеседника', '➡️ Далее'), lambda chat_id, message: handle_next_chat(chat_id)),
+    Route('settings', ('/settings', '⚙️ Настройки'), lambda chat_id, message: handle_settings(chat_id)),
+    Route('change_gender', ('🔄 Изменить пол',), lambda chat_id, message: handle_set_gender(chat_id)),
+    Route('set_gender_male', ('👨 Мужской',),
+          lambda chat_id, message: handle_gender_selected(chat_id, sender_username(message), 'male')),
+    Route('set_gender_female', ('👩 Женский',),
+          lambda chat_id, message: handle_gender_selected(chat_id, sender_username(message), 'female')),
+    Route('search', ('🔍 Найти собеседника',), lambda chat_id, message: handle_search(chat_id)),
+    Route('gender_search_menu', ('🎯 Найти по полу',), lambda chat_id, message: handle_gender_search(chat_id)),
+    Route('search_male', ('👨 Искать мужчину', '👨 Найти мужчину'), lambda chat_id, message: handle_search(chat_id, 'male')),
+    Route('search_female', ('👩 Искать женщину', '👩 Найти женщину'), lambda chat_id, message: handle_search(chat_id, 'female')),
+    Route('complaint', ('⚠️ Пожаловаться',), lambda chat_id, message: handle_complaint(chat_id)),
+)
+COMMAND_ROUTES = {(state, text): route for route in ROUTES for state in route.states for text in route.texts}
+# What an unmatched text or media message does in each state
+STATE_FALLBACKS = {
+    'in_chat': Route('relay', (), handle_relay),
+    'no_gender': Route('gender_prompt', (), lambda chat_id, message: handle_set_gender(chat_id)),
+    'searching': Route('search_gate', (), lambda chat_id, message: send_message(chat_id, SEARCH_GATE_TEXT)),
+    'idle': Route('not_in_chat', (), lambda chat_id, message: send_message(chat_id, NOT_IN_CHAT_TEXT)),
+}
+
+def user_state(user: UserRow) -> str:
+    if user.is_in_chat:
+        return 'in_chat'
+    if not user.gender:
+        return 'no_gender'
+    if user.is_searching:
+        return 'searching'
+    return 'idle'
+
+def dispatch_update(chat_id: int, message: Dict[str, Any]):
+    """Route the update by (user state, text) with one user lookup and one dict lookup, time it and trace it if sampled"""
+    trace = start_trace()
+    failed = True
+    try:
+        with pooled_connection() as conn, conn.cursor() as cursor:
+            user = get_user(cursor, chat_id)
         
-        cursor.execute(f"UPDATE chats SET message_count = message_count + 1 WHERE id = {user['current_chat_id']}")
+        if user:
+            state = user_state(user)
+            route = COMMAND_ROUTES.get((state, message.get('text', '')))
+            content_type = 'text' if route is not None else get_content_type(message)
+            route = route or STATE_FALLBACKS[state]
+        else:
+            # Like the VK bot, anything from an unknown user starts registration
+            route, content_type = COMMAND_ROUTES[('idle', '/start')], get_content_type(message)
+        bump_counter(_update_counts, content_type)
         
-        video_note_url = get_file_url(video_note_id)
-        video_note_url_sql = escape_sql(video_note_url)
-        cursor.execute(f"INSERT INTO t_p14838969_anon_talk_bot.messages (chat_id, sender_telegram_id, content_type, photo_url) VALUES ({user['current_chat_id']}, {chat_id}, 'video_note', {video_note_url_sql})")
+        name = route.name
+        if name == 'relay':
+            name = f'relay_{content_type}'
+        tag_route(name)
         
-        send_video_note(partner_id, video_note_id)
-    
-    cursor.close()
-    conn.close()
+        started = time.perf_counter()
+        try:
+            route.handler(chat_id, message)
+            failed = False
+        finally:
+            observe_latency(_route_metrics, name, time.perf_counter() - started, failed)
+    finally:
+        finish_trace(trace, failed)
 
-def handle_complaint(chat_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute(f"SELECT * FROM users WHERE telegram_id = {chat_id}")
-    user = cursor.fetchone()
-    
-    if not user or not user['is_in_chat'] or not user['current_chat_id']:
-        cursor.close()
-        conn.close()
-        send_message(chat_id, '⚠️ Вы не в диалоге')
+def prometheus_labels(labels: Dict[str, Any]) -> str:
+    return ','.join(f'{key}="{str(value).translate(PROMETHEUS_LABEL_ESCAPES)}"' for key, value in labels.items())
+
+def metric_family(lines: List[str], name: str, kind: str, help_text: str):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+
+def sample(lines: List[str], name: str, labels: Dict[str, Any], value: Any):
+    lines.append(f'{name}{{{prometheus_labels(labels)}}} {value}')
+
+def histogram_samples(lines: List[str], name: str, labels: Dict[str, Any], histogram: LatencyHistogram):
+    """Exposition lines of one histogram; buckets are stored per-bucket and emitted cumulatively"""
+    cumulative = 0
+    for bound, bucket_count in zip((*LATENCY_BUCKETS, '+Inf'), histogram.bucket_counts):
+        cumulative += bucket_count
+        sample(lines, f'{name}_bucket', {**labels, 'le': bound}, cumulative)
+    sample(lines, f'{name}_sum', labels, histogram.seconds_sum)
+    sample(lines, f'{name}_count', labels, histogram.count)
+
+def render_metrics() -> str:
+    """This instance's counters in the Prometheus text exposition format"""
+    lines: List[str] = []
+    platform = {'platform': 'telegram'}
+    # Snapshot with list(): another thread may add a key while the page is rendered
+    route_metrics = list(_route_metrics.items())
+    
+    metric_family(lines, 'bot_updates_total', 'counter', 'Updates received, by message content type or update kind')
+    for update_type, total in list(_update_counts.items()):
+        sample(lines, 'bot_updates_total', {**platform, 'type': update_type}, total)
+    
+    metric_family(lines, 'bot_route_duration_seconds', 'histogram', 'Handler latency per route')
+    for route, histogram in route_metrics:
+        histogram_samples(lines, 'bot_route_duration_seconds', {**platform, 'route': route}, histogram)
+    metric_family(lines, 'bot_route_errors_total', 'counter', 'Handler invocations that raised')
+    for route, histogram in route_metrics:
+        sample(lines, 'bot_route_errors_total', {**platform, 'route': route}, histogram.errors)
+    
+    pool = _db_pool
+    if pool is not None:
+        metric_family(lines, 'bot_db_pool_connections', 'gauge', 'Pooled database connections by state')
+        # ThreadedConnectionPool keeps checked-out connections in _used and idle ones in _pool
+        sample(lines, 'bot_db_pool_connections', {**platform, 'state': 'in_use'}, len(pool._used))
+        sample(lines, 'bot_db_pool_connections', {**platform, 'state': 'idle'}, len(pool._pool))
+    metric_family(
+        lines, 'bot_db_checkout_duration_seconds', 'histogram',
+        'Time to obtain a connection; source="fallback" are one-off connections opened while the pool was exhausted'
+    )
+    for source, histogram in list(_db_checkout_metrics.items()):
+        histogram_samples(lines, 'bot_db_checkout_duration_seconds', {**platform, 'source': source}, histogram)
+    
+    metric_family(lines, 'bot_api_request_duration_seconds', 'histogram', 'Outbound Bot API, VK API and upload latency')
+    for api, histogram in list(_api_metrics.items()):
+        histogram_samples(lines, 'bot_api_request_duration_seconds', {**platform, 'api': api}, histogram)
+    metric_family(
+        lines, 'bot_api_responses_total', 'counter',
+        'Outbound responses by HTTP status (429 = rate limited) or exception name'
+    )
+    for (api, status), total in list(_api_responses.items()):
+        sample(lines, 'bot_api_responses_total', {**platform, 'api': api, 'status': status}, total)
+    return '\n'.join(lines) + '\n'
+
+def metrics_response(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Prometheus scrape of this warm instance; 404 unless METRICS_TOKEN is set and presented"""
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    if not METRICS_TOKEN or not secrets.compare_digest(headers.get('authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Not found'})
+        }
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8', 'Cache-Control': 'no-store'},
+        'body': render_metrics()
+    }
+
+def sample_stacks(stopped: threading.Event, stacks: Dict[str, int], handler: threading.Thread):
+    """Sampler thread: count the handler thread's stack, rooted at the thread's name, until stopped"""
+    while not stopped.wait(PROFILE_INTERVAL_SECONDS):
+        frame = sys._current_frames().get(handler.ident)
+        if frame is None:
+            continue
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        frames.append(handler.name)
+        stack = ';'.join(reversed(frames))
+        stacks[stack] = stacks.get(stack, 0) + 1
+
+def write_profile(route: str, stacks: Dict[str, int]):
+    """Append one invocation's collapsed stacks under its route, rotating the file past PROFILE_MAX_BYTES"""
+    if not stacks:
         return
-    
-    reason_sql = escape_sql('Жалоба от пользователя')
-    cursor.execute(f"INSERT INTO complaints (chat_id, reporter_telegram_id, reason) VALUES ({user['current_chat_id']}, {chat_id}, {reason_sql})")
-    
-    send_message(chat_id, '✅ Жалоба отправлена администрации')
-    
-    cursor.close()
-    conn.close()
+    lines = ''.join(f'{route};{stack} {count}\n' for stack, count in stacks.items())
+    try:
+        with _profile_sink_lock:
+            os.makedirs(os.path.dirname(PROFILE_PATH), exist_ok=True)
+            with open(PROFILE_PATH, 'a', encoding='utf-8') as sink:
+                sink.write(lines)
+                full = sink.tell() > PROFILE_MAX_BYTES
+            if full:
+                os.replace(PROFILE_PATH, f'{PROFILE_PATH}.1')
+    except OSError:
+        # Profiles are diagnostics; a full or read-only disk must not fail the invocation
+        pass
 
+def profiled(function: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    """Run a PROFILE_SAMPLE_RATE fraction of invocations under sample_stacks; a no-op when the rate is 0"""
+    if PROFILE_SAMPLE_RATE <= 0:
+        return function
+    
+    @functools.wraps(function)
+    def sampled(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        if secrets.randbelow(1_000_000) >= PROFILE_SAMPLE_RATE * 1_000_000:
+            return function(event, context)
+        _trace_local.route = None
+        stacks: Dict[str, int] = {}
+        stopped = threading.Event()
+        sampler = threading.Thread(target=sample_stacks, args=(stopped, stacks, threading.current_thread()), name='stack-sampler', daemon=True)
+        sampler.start()
+        try:
+            return function(event, context)
+        finally:
+            stopped.set()
+            sampler.join()
+            write_profile(getattr(_trace_local, 'route', None) or 'unrouted', stacks)
+    return sampled
+
+@profiled
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     if event.get('httpMethod') == 'OPTIONS':
         return {
@@ -643,10 +1365,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': ''
         }
     
+    if event.get('httpMethod') == 'GET':
+        return metrics_response(event)
+    
     try:
         body = json.loads(event.get('body', '{}'))
         
         if 'message' not in body:
+            kind = next((key for key in body if key != 'update_id'), 'unknown')
+            bump_counter(_update_counts, kind if kind in UPDATE_KINDS else 'other')
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json'},
@@ -654,89 +1381,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         
         message = body['message']
-        chat_id = message['chat']['id']
-        text = message.get('text', '')
-        username = message.get('from', {}).get('username')
-        photo = message.get('photo')
-        video = message.get('video')
-        voice = message.get('voice')
-        video_note = message.get('video_note')
-        sticker = message.get('sticker')
-        
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute(f"SELECT is_searching FROM users WHERE telegram_id = {chat_id}")
-        user_check = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        
-        if user_check and user_check['is_searching']:
-            if text not in ['/stop', '❌ Завершить диалог', '❌ Отменить поиск']:
-                send_message(chat_id, '⏳ Идёт поиск собеседника... Используйте "❌ Отменить поиск" для отмены')
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json'},
-                    'body': json.dumps({'ok': True})
-                }
-        
-        if photo:
-            largest_photo = photo[-1]
-            photo_id = largest_photo['file_id']
-            caption = message.get('caption')
-            handle_photo(chat_id, photo_id, caption)
-        elif video:
-            video_id = video['file_id']
-            caption = message.get('caption')
-            handle_video(chat_id, video_id, caption)
-        elif voice:
-            voice_id = voice['file_id']
-            handle_voice(chat_id, voice_id)
-        elif video_note:
-            video_note_id = video_note['file_id']
-            handle_video_note(chat_id, video_note_id)
-        elif sticker:
-            sticker_id = sticker['file_id']
-            handle_sticker(chat_id, sticker_id)
-        elif text == '/start':
-            handle_start(chat_id, username)
-        elif text == '/stop':
-            handle_stop_chat(chat_id)
-        elif text == '/next':
-            handle_next_chat(chat_id)
-        elif text == '/settings':
-            handle_settings(chat_id)
-        elif text == '⚙️ Настройки':
-            handle_settings(chat_id)
-        elif text == '◀️ Назад':
-            handle_start(chat_id, username)
-        elif text == '🔄 Изменить пол':
-            handle_set_gender(chat_id)
-        elif text == '👨 Мужской':
-            update_user_gender(chat_id, 'male')
-            send_message(chat_id, '✅ Пол установлен: Мужской')
-            handle_start(chat_id, username)
-        elif text == '👩 Женский':
-            update_user_gender(chat_id, 'female')
-            send_message(chat_id, '✅ Пол установлен: Женский')
-            handle_start(chat_id, username)
-        elif text == '🔍 Найти собеседника':
-            handle_search(chat_id)
-        elif text == '🎯 Найти по полу':
-            handle_gender_search(chat_id)
-        elif text == '👨 Искать мужчину':
-            handle_search(chat_id, 'male')
-        elif text == '👩 Искать женщину':
-            handle_search(chat_id, 'female')
-        elif text == '❌ Завершить диалог':
-            handle_stop_chat(chat_id)
-        elif text == '❌ Отменить поиск':
-            handle_stop_chat(chat_id)
-        elif text == '⚠️ Пожаловаться':
-            handle_complaint(chat_id)
-        elif text == '🔍 Найти нового собеседника':
-            handle_next_chat(chat_id)
-        else:
-            handle_message(chat_id, text)
+        dispatch_update(message['chat']['id'], message)
         
         return {
             'statusCode': 200,
@@ -749,4 +1394,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json'},
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
+
+def warm_up():
+    """Pay the import, connect and PREPARE costs during init instead of on the first update"""
+    http_session()
+    try:
+        with pooled_connection() as conn, conn.cursor() as cursor:
+            for name in PREPARED_STATEMENTS:
+                prepare_statement(cursor, name)
+    except psycopg2.Error:
+        # An unreachable database must not fail init; the first update connects on its own
+        pass
+
+if WARM_START:
+    warm_up()
@@ -4,30 +4,407 @@ Args: event with httpMethod, body; context with request_id
 Returns: HTTP response with statusCode 200
 '''
 
+import functools
+import importlib
 import json
 import os
-from typing import Dict, Any, Optional
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import requests
-import random
+import re
+import secrets
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Tuple, Iterator, NamedTuple, Callable, FrozenSet
+
+class LazyModule:
+    """
+    Stand-in for a heavy module that imports it (plus listed submodules) on first attribute access.
+    Once loaded it rebinds the owning global to the real module, so later lookups cost nothing.
+    """
+    
+    def __init__(self, namespace: Dict[str, Any], name: str, *submodules: str):
+        self._namespace = namespace
+        self._name = name
+        self._submodules = submodules
+        self._module = None
+        self._lock = threading.Lock()
+    
+    def load(self):
+        with self._lock:
+            if self._module is None:
+                module = importlib.import_module(self._name)
+                for submodule in self._submodules:
+                    importlib.import_module(f'{self._name}.{submodule}')
+                self._namespace[self._name] = module
+                self._module = module
+        return self._module
+    
+    def __getattr__(self, attr: str):
+        return getattr(self._module or self.load(), attr)
+
+# psycopg2 and requests (urllib3, charset_normalizer, idna) dominate import time;
+# they load on the first update that needs them, never for an OPTIONS preflight or a confirmation callback
+psycopg2 = LazyModule(globals(), 'psycopg2')
+requests = LazyModule(globals(), 'requests')
 
 GROUP_TOKEN = os.environ.get('VK_GROUP_TOKEN', '')
 DATABASE_URL = os.environ.get('DATABASE_URL', '')
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
 VK_API_VERSION = '5.131'
+# API base URLs are overridable so the bot can be pointed at local stand-in servers
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+VK_API_URL = os.environ.get('VK_API_URL', 'https://api.vk.com/method').rstrip('/')
+
+# Media bridge: files are streamed VK -> Telegram in fixed-size chunks, never held whole in memory
+MEDIA_BRIDGE_CHUNK_SIZE = 64 * 1024
+MEDIA_BRIDGE_MAX_BYTES = int(os.environ.get('MEDIA_BRIDGE_MAX_BYTES', str(50 * 1024 * 1024)))
+MEDIA_BRIDGE_MAX_CONCURRENT = int(os.environ.get('MEDIA_BRIDGE_MAX_CONCURRENT', '2'))
+MEDIA_BRIDGE_TIMEOUT = 30
+# Quote, CR and LF cannot appear inside a quoted multipart filename; escaped the way browsers do
+MULTIPART_FILENAME_ESCAPES = str.maketrans({'"': '%22', '\r': '%0D', '\n': '%0A'})
+# Sent to a Telegram partner in place of an attachment that cannot be bridged as media
+VK_ATTACHMENT_LABELS = {
+    'photo': '📷 Фото',
+    'video': '🎬 Видео',
+    'audio': '🎵 Аудио',
+    'doc': '📎 Файл',
+    'audio_message': '🎤 Голосовое сообщение',
+    'sticker': '🙂 Стикер',
+    'graffiti': '🎨 Граффити',
+    'wall': '📰 Запись',
+    'link': '🔗 Ссылка',
+    'poll': '📊 Опрос',
+    'gift': '🎁 Подарок',
+    'market': '🛍 Товар',
+    'story': '📖 История',
+}
+VK_ATTACHMENT_DEFAULT_LABEL = '📎 Вложение'
+# Callback API event types counted under their own bot_updates_total label; attachment types are
+# limited to VK_ATTACHMENT_LABELS. The webhook body is unauthenticated, so anything else is 'other'
+VK_EVENT_TYPES = frozenset((
+    'message_new', 'message_reply', 'message_edit', 'message_allow', 'message_deny', 'message_typing_state',
+    'message_event', 'message_read', 'photo_new', 'audio_new', 'video_new', 'wall_post_new', 'wall_repost',
+    'wall_reply_new', 'board_post_new', 'group_join', 'group_leave', 'user_block', 'user_unblock',
+    'like_add', 'like_remove', 'group_change_settings', 'group_change_photo', 'vkpay_transaction',
+    'app_payload', 'donut_subscription_create', 'donut_subscription_expired'
+))
+
+# Upper bounds (seconds) of the route, API call and DB connect latency histograms; the last bucket is +Inf
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SEARCH_GATE_TEXT = '⏳ Идёт поиск собеседника... Используйте "❌ Отменить поиск" для отмены'
+
+# Import the heavy modules and create the HTTP session at init rather than on the first event
+WARM_START = os.environ.get('WARM_START', 'false').lower() == 'true'
+
+# Fraction of events traced (0 disables); each sampled event appends its spans as NDJSON lines to TRACE_PATH
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0'))
+TRACE_PATH = os.environ.get('TRACE_PATH', '/tmp/traces/vk-bot.ndjson')
+# Past this size the sink is rotated to TRACE_PATH.1, so a long-lived instance keeps at most two files
+TRACE_MAX_BYTES = int(os.environ.get('TRACE_MAX_BYTES', str(16 * 1024 * 1024)))
+# Table a statement touches, used to name query spans
+SQL_TABLE_PATTERN = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+(?:\w+\.)?(\w+)', re.IGNORECASE)
+
+# GET / serves this instance's metrics in Prometheus text format to a scraper presenting it as a Bearer token;
+# unset disables the endpoint
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+PROMETHEUS_LABEL_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+# Sampling profiler as in admin-api, over the handler thread only (this function has no worker pools)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get('PROFILE_INTERVAL_MS', '5')) / 1000
+PROFILE_PATH = os.path.join(os.environ.get('PROFILE_DIR', '/tmp/profiles'), 'vk-bot.collapsed')
+# Past this size the file is rotated to .collapsed.1, so the directory holds at most about twice the limit
+PROFILE_MAX_BYTES = int(os.environ.get('PROFILE_MAX_BYTES', str(16 * 1024 * 1024)))
+
+_bridge_slots = threading.BoundedSemaphore(MEDIA_BRIDGE_MAX_CONCURRENT)
+
+# VK attachment id -> Telegram file_id; DB-backed (media_bridge_cache) with an in-process LRU in front
+BRIDGE_CACHE_LRU_SIZE = 1024
+BRIDGE_CACHE_TOUCH_INTERVAL = 6 * 3600
+
+_bridge_cache: 'OrderedDict[str, Tuple[str, float]]' = OrderedDict()
+_http_session: 'Optional[requests.Session]' = None
+_http_session_lock = threading.Lock()
+# In-process metrics. Plain int updates without a lock, like every counter here: the GIL keeps them
+# consistent enough for monitoring, and a rare lost increment under thread contention is acceptable
+_update_counts: Dict[str, int] = {}
+_route_metrics: Dict[str, 'LatencyHistogram'] = {}
+_api_metrics: Dict[str, 'LatencyHistogram'] = {}
+_api_responses: Dict[Tuple[str, str], int] = {}
+_db_connect_metrics: Dict[str, 'LatencyHistogram'] = {}
+_cursor_class: Optional[type] = None
+_trace_local = threading.local()
+_trace_sink_lock = threading.Lock()
+_profile_sink_lock = threading.Lock()
+
+class MultipartStream:
+    """
+    multipart/form-data body whose file part is pulled lazily from a chunk iterator.
+    With a known size requests sends it with Content-Length, otherwise with chunked transfer.
+    """
+    
+    def __init__(self, field: str, filename: str, mime_type: str, chunks: Iterator[bytes], size: Optional[int] = None):
+        boundary = secrets.token_hex(16)
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        head = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename.translate(MULTIPART_FILENAME_ESCAPES)}"\r\n'
+            f'Content-Type: {mime_type}\r\n\r\n'
+        ).encode('utf-8')
+        tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+        self.length = len(head) + size + len(tail) if size is not None else None
+        self._parts = self._chain(head, chunks, tail)
+        self._buffer = b''
+    
+    @staticmethod
+    def _chain(head: bytes, chunks: Iterator[bytes], tail: bytes) -> Iterator[bytes]:
+        yield head
+        for chunk in chunks:
+            if chunk:
+                yield chunk
+        yield tail
+    
+    def __len__(self) -> int:
+        return self.length or 0
+    
+    def __iter__(self) -> Iterator[bytes]:
+        if self._buffer:
+            yield self._buffer
+            self._buffer = b''
+        yield from self._parts
+    
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._parts, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+def limited_chunks(response: 'requests.Response', max_bytes: int) -> Iterator[bytes]:
+    """Iterate a streamed download, aborting once it grows past max_bytes"""
+    received = 0
+    for chunk in response.iter_content(MEDIA_BRIDGE_CHUNK_SIZE):
+        received += len(chunk)
+        if received > max_bytes:
+            raise ValueError(f'File exceeds {max_bytes} bytes')
+        yield chunk
+
+class UserRow(NamedTuple):
+    """The users columns the bot reads, in select order; built straight from a plain cursor tuple"""
+    telegram_id: int
+    platform: str
+    platform_id: str
+    gender: Optional[str]
+    is_searching: bool
+    is_in_chat: bool
+    current_chat_id: Optional[int]
+    is_blocked: bool
+
+USER_COLUMNS = ', '.join(UserRow._fields)
+
+class LatencyHistogram:
+    """Invocation count, failures and latency histogram of one route, API method or DB connect"""
+    
+    __slots__ = ('count', 'errors', 'seconds_sum', 'bucket_counts')
+    
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds_sum = 0.0
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    
+    def observe(self, seconds: float, failed: bool):
+        self.count += 1
+        self.errors += failed
+        self.seconds_sum += seconds
+        self.bucket_counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+def observe_latency(histograms: Dict[str, LatencyHistogram], key: str, seconds: float, failed: bool = False) -> None:
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms.setdefault(key, LatencyHistogram())
+    histogram.observe(seconds, failed)
+
+def bump_counter(counters: Dict[Any, int], key: Any) -> None:
+    counters[key] = counters.get(key, 0) + 1
+
+def observe_api_call(label: str, started: float, status: str) -> None:
+    """Record an outbound call's latency and response status (or exception name) under its API method"""
+    if label.startswith('download.'):
+        # VK CDN hosts vary per shard; one series for all of them keeps the label set bounded
+        label = 'download'
+    observe_latency(_api_metrics, label, time.perf_counter() - started, not status.startswith('2'))
+    bump_counter(_api_responses, (label, status))
+
+class Trace:
+    """Spans of one sampled event, kept in memory and appended to the sink when the event finishes"""
+    
+    __slots__ = ('trace_id', 'route', 'started', 'started_at', 'spans')
+    
+    def __init__(self):
+        self.trace_id = secrets.token_hex(8)
+        self.route = 'unrouted'
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.spans: List[Dict[str, Any]] = []
+
+def start_trace() -> Optional[Trace]:
+    """Bind a trace to this thread if the event falls into the sample; unsampled events bind None"""
+    trace = None
+    if TRACE_SAMPLE_RATE > 0 and secrets.randbelow(1_000_000) < TRACE_SAMPLE_RATE * 1_000_000:
+        trace = Trace()
+    _trace_local.trace = trace
+    return trace
+
+def tag_route(name: str) -> None:
+    """Name the event after its route, for its trace and for a sampled profile"""
+    _trace_local.route = name
+    trace = getattr(_trace_local, 'trace', None)
+    if trace is not None:
+        trace.route = name
+
+def record_span(kind: str, name: str, started: float, **attributes: Any) -> None:
+    """Attach a span that began at perf_counter() reading `started` and ends now to the thread's trace"""
+    trace = getattr(_trace_local, 'trace', None)
+    if trace is None:
+        return
+    trace.spans.append({
+        'kind': kind,
+        'name': name,
+        'offset_ms': round((started - trace.started) * 1000, 3),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+        **attributes
+    })
+
+def finish_trace(trace: Optional[Trace], failed: bool) -> None:
+    """Unbind the trace and append its root span and child spans to the NDJSON sink in one write"""
+    _trace_local.trace = None
+    if trace is None:
+        return
+    root = {
+        'kind': 'update',
+        'name': trace.route,
+        'offset_ms': 0.0,
+        'duration_ms': round((time.perf_counter() - trace.started) * 1000, 3),
+        'platform': 'vk',
+        'failed': failed
+    }
+    common = {'trace_id': trace.trace_id, 'route': trace.route, 'started_at': round(trace.started_at, 3)}
+    lines = ''.join(json.dumps({**common, **span}, ensure_ascii=False) + '\n' for span in [root, *trace.spans])
+    try:
+        with _trace_sink_lock:
+            os.makedirs(os.path.dirname(TRACE_PATH) or '.', exist_ok=True)
+            with open(TRACE_PATH, 'a', encoding='utf-8') as sink:
+                sink.write(lines)
+                full = sink.tell() > TRACE_MAX_BYTES
+            if full:
+                os.replace(TRACE_PATH, f'{TRACE_PATH}.1')
+    except OSError:
+        # Traces are diagnostics; a full or read-only disk must not fail the event
+        pass
+
+def statement_label(query: Any) -> str:
+    """Span name for a query: its verb and the table it touches"""
+    if not isinstance(query, str):
+        return 'sql'
+    words = query.split(None, 1)
+    verb = words[0].upper() if words else 'SQL'
+    table = SQL_TABLE_PATTERN.search(query)
+    return f'{verb} {table.group(1)}' if table else verb
+
+def api_method_label(url: str) -> str:
+    """Span name for an outbound call, e.g. vk.messages.send; never contains the token in Bot API paths"""
+    if url.startswith(VK_API_URL):
+        return 'vk.' + url[len(VK_API_URL):].strip('/').split('?', 1)[0]
+    if url.startswith(TELEGRAM_API_URL):
+        path = url[len(TELEGRAM_API_URL):]
+        return 'telegram.file' if path.startswith('/file/') else 'telegram.' + path.rsplit('/', 1)[-1]
+    # VK CDN downloads: the host is enough, the path and query carry signed parameters
+    return 'download.' + url.split('/', 3)[2]
+
+def tracing_cursor_class() -> type:
+    """psycopg2 cursor subclass that records each execute() as a db span while an event is traced"""
+    global _cursor_class
+    if _cursor_class is None:
+        class TracingCursor(psycopg2.extensions.cursor):
+            def execute(self, query, vars=None):
+                if getattr(_trace_local, 'trace', None) is None:
+                    return super().execute(query, vars)
+                started = time.perf_counter()
+                try:
+                    super().execute(query, vars)
+                except Exception as e:
+                    record_span('db', statement_label(query), started, error=type(e).__name__)
+                    raise
+                record_span('db', statement_label(query), started, rows=self.rowcount)
+        _cursor_class = TracingCursor
+    return _cursor_class
+
+def instrumented_request(request: Callable[..., 'requests.Response']) -> Callable[..., 'requests.Response']:
+    """Wrap Session.request so every call feeds the API metrics and, while an event is traced, becomes a span"""
+    def instrumented(method: str, url: str, *args: Any, **kwargs: Any) -> 'requests.Response':
+        label = api_method_label(url)
+        started = time.perf_counter()
+        try:
+            response = request(method, url, *args, **kwargs)
+        except Exception as e:
+            observe_api_call(label, started, type(e).__name__)
+            record_span('http', label, started, method=method, error=type(e).__name__)
+            raise
+        observe_api_call(label, started, str(response.status_code))
+        record_span('http', label, started, method=method, status=response.status_code)
+        return response
+    return instrumented
 
 def get_db_connection():
-    """Get database connection"""
-    return psycopg2.connect(DATABASE_URL)
+    """Get database connection; the handshake feeds the connect histogram and the traced event's spans"""
+    started = time.perf_counter()
+    try:
+        conn = psycopg2.connect(DATABASE_URL, cursor_factory=tracing_cursor_class())
+    except psycopg2.Error as e:
+        observe_latency(_db_connect_metrics, 'connect', time.perf_counter() - started, True)
+        record_span('db', 'connect', started, error=type(e).__name__)
+        raise
+    observe_latency(_db_connect_metrics, 'connect', time.perf_counter() - started)
+    record_span('db', 'connect', started)
+    return conn
+
+@contextmanager
+def db_connection():
+    """get_db_connection() for a with block: commits on success, rolls back on error and always closes"""
+    conn = get_db_connection()
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def http_session() -> 'requests.Session':
+    """Shared session so VK and Bot API calls reuse kept-alive TLS connections"""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                session = requests.Session()
+                # get()/post() go through self.request, so the instance attribute covers every call
+                session.request = instrumented_request(session.request)
+                _http_session = session
+    return _http_session
 
 def vk_api_call(method: str, params: Dict[str, Any]) -> Optional[Dict]:
     """Call VK API method"""
-    url = f'https://api.vk.com/method/{method}'
+    url = f'{VK_API_URL}/{method}'
     params['access_token'] = GROUP_TOKEN
     params['v'] = VK_API_VERSION
     
-    response = requests.post(url, data=params)
+    # Bounded like every bridge request: a stalled VK call must not hang the webhook
+    response = http_session().post(url, data=params, timeout=MEDIA_BRIDGE_TIMEOUT)
     result = response.json()
     
     if 'response' in result:
@@ -38,237 +415,394 @@ def vk_api_call(method: str, params: Dict[str, Any]) -> Optional[Dict]:
     
     return None
 
-def send_message(user_id: int, text: str, keyboard: Optional[Dict] = None) -> bool:
+def send_message(user_id: int, text: str, keyboard: Optional[Dict] = None, attachment: Optional[str] = None) -> bool:
     """Send message to VK user"""
     print(f"[VK] Sending message to {user_id}: {text[:50]}...")
     params = {
         'user_id': user_id,
         'message': text,
-        'random_id': random.randint(0, 2147483647)
+        'random_id': secrets.randbelow(2 ** 31)
     }
     
     if keyboard:
         params['keyboard'] = json.dumps(keyboard)
+    if attachment:
+        params['attachment'] = attachment
     
     result = vk_api_call('messages.send', params)
     success = result is not None
     print(f"[VK] Message send result: {success}, response: {result}")
     return success
 
+def record_stats(user_id: int, counters: Dict[str, int], platform: str = 'vk') -> None:
+    """Add counters to the current minute's stats_rollup rows for the user's platform and gender"""
+    with db_connection() as conn, conn.cursor() as cursor:
+        values_sql = ', '.join(['(%s, %s)'] * len(counters))
+        params = [item for pair in counters.items() for item in pair]
+        cursor.execute(
+            "INSERT INTO t_p14838969_anon_talk_bot.stats_rollup (bucket, metric, platform, gender, value) "
+            "SELECT date_trunc('minute', CURRENT_TIMESTAMP), c.metric, u.platform, "
+            "CASE WHEN u.gender IN ('male', 'female') THEN u.gender ELSE 'unknown' END, c.value "
+            f"FROM t_p14838969_anon_talk_bot.users u, (VALUES {values_sql}) AS c(metric, value) "
+            "WHERE u.platform = %s AND u.platform_id = %s "
+            "ON CONFLICT (bucket, metric, platform, gender) DO UPDATE SET value = stats_rollup.value + EXCLUDED.value",
+            params + [platform, str(user_id)]
+        )
+
+def notify_admin(cursor, event: Dict[str, Any]) -> None:
+    """Append a dashboard delta to admin_events; its trigger wakes admin-api's long polls on commit"""
+    cursor.execute('INSERT INTO t_p14838969_anon_talk_bot.admin_events (payload) VALUES (%s)', (json.dumps(event),))
+
 def get_or_create_user(user_id: int, username: str) -> None:
     """Get or create VK user in database"""
     print(f"[VK] Creating/checking user: {user_id}, username: {username}")
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Check if user exists
-    cursor.execute('SELECT id FROM users WHERE platform = %s AND platform_id = %s', ('vk', str(user_id)))
-    if cursor.fetchone():
-        cursor.close()
-        conn.close()
-        return
-    
-    # Generate unique telegram_id for VK users (use large positive values starting from 10000000000)
-    # This avoids conflicts with real Telegram IDs which are typically < 10 billion
-    vk_telegram_id = 10000000000 + user_id
-    print(f"[VK] Creating new user with telegram_id: {vk_telegram_id}")
-    
-    cursor.execute('''
-        INSERT INTO users (telegram_id, platform, platform_id, username, gender, is_searching, is_in_chat)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-    ''', (vk_telegram_id, 'vk', str(user_id), username, 'not_set', False, False))
-    print(f"[VK] User created successfully")
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cursor:
+        # Check if user exists
+        cursor.execute('SELECT id FROM users WHERE platform = %s AND platform_id = %s', ('vk', str(user_id)))
+        if cursor.fetchone():
+            return
+        
+        # Generate unique telegram_id for VK users (use large positive values starting from 10000000000)
+        # This avoids conflicts with real Telegram IDs which are typically < 10 billion
+        vk_telegram_id = 10000000000 + user_id
+        print(f"[VK] Creating new user with telegram_id: {vk_telegram_id}")
+        
+        cursor.execute('''
+            INSERT INTO users (telegram_id, platform, platform_id, username, gender, is_searching, is_in_chat)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        ''', (vk_telegram_id, 'vk', str(user_id), username, 'not_set', False, False))
+        print(f"[VK] User created successfully")
 
-def get_user(user_id: int) -> Optional[Dict]:
+def get_user(user_id: int) -> Optional[UserRow]:
     """Get VK user from database"""
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute('SELECT * FROM users WHERE platform = %s AND platform_id = %s', ('vk', str(user_id)))
-    user = cursor.fetchone()
-    
-    cursor.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(f'SELECT {USER_COLUMNS} FROM users WHERE platform = %s AND platform_id = %s', ('vk', str(user_id)))
+        user = cursor.fetchone()
     
-    return dict(user) if user else None
+    return UserRow._make(user) if user else None
 
 def update_user_gender(user_id: int, gender: str) -> None:
     """Update VK user gender"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('UPDATE users SET gender = %s WHERE platform = %s AND platform_id = %s', 
-                   (gender, 'vk', str(user_id)))
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cursor:
+        cursor.execute('UPDATE users SET gender = %s WHERE platform = %s AND platform_id = %s', 
+                       (gender, 'vk', str(user_id)))
 
 def set_searching(user_id: int, searching: bool) -> None:
     """Set VK user searching status"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('UPDATE users SET is_searching = %s WHERE platform = %s AND platform_id = %s', 
-                   (searching, 'vk', str(user_id)))
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cursor:
+        cursor.execute('UPDATE users SET is_searching = %s WHERE platform = %s AND platform_id = %s', 
+                       (searching, 'vk', str(user_id)))
 
 def set_in_chat(user_id: int, in_chat: bool, chat_id: Optional[int] = None) -> None:
     """Set VK user in_chat status"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('UPDATE users SET is_in_chat = %s, current_chat_id = %s WHERE platform = %s AND platform_id = %s', 
-                   (in_chat, chat_id, 'vk', str(user_id)))
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cursor:
+        cursor.execute('UPDATE users SET is_in_chat = %s, current_chat_id = %s WHERE platform = %s AND platform_id = %s', 
+                       (in_chat, chat_id, 'vk', str(user_id)))
 
 def create_chat(user1_id: int, user1_platform: str, user2_id: int, user2_platform: str) -> int:
     """Create chat between two users (cross-platform)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Get telegram_id for both users
-    cursor.execute('SELECT telegram_id FROM users WHERE platform = %s AND platform_id = %s', 
-                   (user1_platform, str(user1_id)))
-    user1_telegram_id = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT telegram_id FROM users WHERE platform = %s AND platform_id = %s', 
-                   (user2_platform, str(user2_id)))
-    user2_telegram_id = cursor.fetchone()[0]
-    
-    print(f"[VK] Creating chat: user1={user1_id} (platform={user1_platform}, telegram_id={user1_telegram_id}), user2={user2_id} (platform={user2_platform}, telegram_id={user2_telegram_id})")
-    
-    cursor.execute('''
-        INSERT INTO chats (user1_telegram_id, user2_telegram_id, is_active, user1_platform, user2_platform, 
-                          user1_platform_id, user2_platform_id)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        RETURNING id
-    ''', (user1_telegram_id, user2_telegram_id, True, user1_platform, user2_platform, str(user1_id), str(user2_id)))
-    
-    chat_id = cursor.fetchone()[0]
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cursor:
+        # Get telegram_id for both users
+        cursor.execute('SELECT telegram_id, gender FROM users WHERE platform = %s AND platform_id = %s', 
+                       (user1_platform, str(user1_id)))
+        user1_telegram_id, user1_gender = cursor.fetchone()
+        
+        cursor.execute('SELECT telegram_id, gender FROM users WHERE platform = %s AND platform_id = %s', 
+                       (user2_platform, str(user2_id)))
+        user2_telegram_id, user2_gender = cursor.fetchone()
+        
+        print(f"[VK] Creating chat: user1={user1_id} (platform={user1_platform}, telegram_id={user1_telegram_id}), user2={user2_id} (platform={user2_platform}, telegram_id={user2_telegram_id})")
+        
+        cursor.execute('''
+            INSERT INTO chats (user1_telegram_id, user2_telegram_id, is_active, user1_platform, user2_platform, 
+                              user1_platform_id, user2_platform_id)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            RETURNING id
+        ''', (user1_telegram_id, user2_telegram_id, True, user1_platform, user2_platform, str(user1_id), str(user2_id)))
+        
+        chat_id = cursor.fetchone()[0]
+        notify_admin(cursor, {
+            'type': 'chat_started',
+            'chat': {
+                'id': chat_id,
+                'user1_gender': user1_gender or 'unknown',
+                'user2_gender': user2_gender or 'unknown',
+                'message_count': 0,
+                'duration_minutes': 0
+            },
+            'delta': {'active_chats': 1}
+        })
     
     return chat_id
 
-def get_active_chat(user_id: int) -> Optional[Dict]:
-    """Get active chat for VK user"""
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute('''
-        SELECT * FROM chats 
-        WHERE ((user1_platform = %s AND user1_platform_id = %s) 
-               OR (user2_platform = %s AND user2_platform_id = %s))
-        AND is_active = true
-    ''', ('vk', str(user_id), 'vk', str(user_id)))
-    
-    chat = cursor.fetchone()
-    
-    cursor.close()
-    conn.close()
+def get_active_chat(user_id: int) -> Optional[int]:
+    """Get active chat id for VK user"""
+    with db_connection() as conn, conn.cursor() as cursor:
+        cursor.execute('''
+            SELECT id FROM chats 
+            WHERE ((user1_platform = %s AND user1_platform_id = %s) 
+                   OR (user2_platform = %s AND user2_platform_id = %s))
+            AND is_active = true
+            LIMIT 1
+        ''', ('vk', str(user_id), 'vk', str(user_id)))
+        
+        chat = cursor.fetchone()
     
-    return dict(chat) if chat else None
+    return chat[0] if chat else None
 
 def end_chat(user_id: int) -> None:
     """End active chat for VK user"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        UPDATE chats SET is_active = false, ended_at = CURRENT_TIMESTAMP
-        WHERE ((user1_platform = %s AND user1_platform_id = %s) 
-               OR (user2_platform = %s AND user2_platform_id = %s))
-        AND is_active = true
-    ''', ('vk', str(user_id), 'vk', str(user_id)))
-    
-    conn.commit()
-    cursor.close()
-    conn.close()
+    with db_connection() as conn, conn.cursor() as cursor:
+        cursor.execute('''
+            UPDATE chats SET is_active = false, ended_at = CURRENT_TIMESTAMP
+            WHERE ((user1_platform = %s AND user1_platform_id = %s) 
+                   OR (user2_platform = %s AND user2_platform_id = %s))
+            AND is_active = true
+            RETURNING id, EXTRACT(EPOCH FROM (ended_at - started_at)) AS duration_seconds
+        ''', ('vk', str(user_id), 'vk', str(user_id)))
+        ended = cursor.fetchall()
+        for chat_id, _ in ended:
+            notify_admin(cursor, {'type': 'chat_ended', 'chat_id': chat_id, 'delta': {'active_chats': -1}})
+    
+    if ended:
+        duration = sum(int(duration_seconds or 0) for _, duration_seconds in ended)
+        record_stats(user_id, {'chats_ended': len(ended), 'chat_duration_seconds': duration})
 
-def find_partner(user_id: int, gender_filter: Optional[str] = None) -> Optional[Dict]:
+def find_partner(user_id: int, gender_filter: Optional[str] = None) -> Optional[UserRow]:
     """Find chat partner (cross-platform search)"""
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    with db_connection() as conn, conn.cursor() as cursor:
+        if gender_filter:
+            cursor.execute(f'''
+                SELECT {USER_COLUMNS} FROM users 
+                WHERE NOT (platform = %s AND platform_id = %s)
+                AND is_searching = true 
+                AND is_in_chat = false
+                AND gender = %s
+                ORDER BY RANDOM()
+                LIMIT 1
+            ''', ('vk', str(user_id), gender_filter))
+        else:
+            cursor.execute(f'''
+                SELECT {USER_COLUMNS} FROM users 
+                WHERE NOT (platform = %s AND platform_id = %s)
+                AND is_searching = true 
+                AND is_in_chat = false
+                ORDER BY RANDOM()
+                LIMIT 1
+            ''', ('vk', str(user_id)))
+        
+        partner = cursor.fetchone()
     
-    if gender_filter:
-        cursor.execute('''
-            SELECT * FROM users 
-            WHERE NOT (platform = %s AND platform_id = %s)
-            AND is_searching = true 
-            AND is_in_chat = false
-            AND gender = %s
-            ORDER BY RANDOM()
-            LIMIT 1
-        ''', ('vk', str(user_id), gender_filter))
-    else:
-        cursor.execute('''
-            SELECT * FROM users 
-            WHERE NOT (platform = %s AND platform_id = %s)
-            AND is_searching = true 
-            AND is_in_chat = false
-            ORDER BY RANDOM()
+    return UserRow._make(partner) if partner else None
+
+def get_partner_from_chat(user_id: int) -> Optional[UserRow]:
+    """Get partner info from active chat in one round trip"""
+    with db_connection() as conn, conn.cursor() as cursor:
+        partner_columns = ', '.join(f'p.{column}' for column in UserRow._fields)
+        cursor.execute(f'''
+            SELECT {partner_columns} FROM chats c
+            JOIN users p
+              ON p.platform = CASE WHEN c.user1_platform = %(platform)s AND c.user1_platform_id = %(platform_id)s
+                                   THEN c.user2_platform ELSE c.user1_platform END
+             AND p.platform_id = CASE WHEN c.user1_platform = %(platform)s AND c.user1_platform_id = %(platform_id)s
+                                      THEN c.user2_platform_id ELSE c.user1_platform_id END
+            WHERE ((c.user1_platform = %(platform)s AND c.user1_platform_id = %(platform_id)s) 
+                   OR (c.user2_platform = %(platform)s AND c.user2_platform_id = %(platform_id)s))
+            AND c.is_active = true
             LIMIT 1
-        ''', ('vk', str(user_id)))
-    
-    partner = cursor.fetchone()
-    
-    cursor.close()
-    conn.close()
+        ''', {'platform': 'vk', 'platform_id': str(user_id)})
+        partner = cursor.fetchone()
     
-    return dict(partner) if partner else None
+    return UserRow._make(partner) if partner else None
 
-def get_partner_from_chat(user_id: int) -> Optional[Dict]:
-    """Get partner info from active chat"""
-    chat = get_active_chat(user_id)
-    if not chat:
+def vk_attachment_id(attachment: Dict, with_access_key: bool = True) -> Optional[str]:
+    """VK attachment string (type{owner_id}_{id}[_access_key]) for forwarding inside VK"""
+    kind = attachment.get('type')
+    item = attachment.get(kind) or {}
+    if 'owner_id' not in item or 'id' not in item:
         return None
+    result = f"{kind}{item['owner_id']}_{item['id']}"
+    if with_access_key and item.get('access_key'):
+        result += f"_{item['access_key']}"
+    return result
+
+def largest_image_url(images: List[Dict]) -> Optional[str]:
+    if not images:
+        return None
+    return max(images, key=lambda image: image.get('width', 0) * image.get('height', 0)).get('url')
+
+def telegram_media_source(attachment: Dict) -> Optional[Tuple[str, str, str, str, str]]:
+    """Map a VK attachment to (Bot API method, file field, download url, filename, mime type)"""
+    kind = attachment.get('type')
+    item = attachment.get(kind) or {}
+    
+    if kind == 'photo':
+        url = largest_image_url(item.get('sizes', []))
+        return ('sendPhoto', 'photo', url, 'photo.jpg', 'image/jpeg') if url else None
+    if kind == 'sticker':
+        url = largest_image_url(item.get('images_with_background') or item.get('images', []))
+        return ('sendPhoto', 'photo', url, 'sticker.png', 'image/png') if url else None
+    if kind == 'audio_message':
+        url = item.get('link_ogg') or item.get('link_mp3')
+        return ('sendVoice', 'voice', url, 'voice.ogg', 'audio/ogg') if url else None
+    if kind == 'doc' and item.get('url'):
+        ext = item.get('ext', '')
+        filename = item.get('title') or f'file.{ext}'
+        if ext == 'gif':
+            return ('sendAnimation', 'animation', item['url'], filename, 'image/gif')
+        return ('sendDocument', 'document', item['url'], filename, 'application/octet-stream')
+    return None
+
+def remember_bridged(vk_key: str, file_id: str):
+    _bridge_cache[vk_key] = (file_id, time.monotonic())
+    _bridge_cache.move_to_end(vk_key)
+    while len(_bridge_cache) > BRIDGE_CACHE_LRU_SIZE:
+        _bridge_cache.popitem(last=False)
+
+def get_bridged_file_id(vk_key: str) -> Optional[str]:
+    """Cached Telegram file_id for a VK attachment; DB last_used_at is refreshed at most every few hours"""
+    cached = _bridge_cache.get(vk_key)
+    if cached and time.monotonic() - cached[1] < BRIDGE_CACHE_TOUCH_INTERVAL:
+        _bridge_cache.move_to_end(vk_key)
+        return cached[0]
+    
+    with db_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "UPDATE t_p14838969_anon_talk_bot.media_bridge_cache SET last_used_at = CURRENT_TIMESTAMP "
+            "WHERE source_platform = 'vk' AND source_key = %s RETURNING target_attachment",
+            (vk_key,)
+        )
+        row = cursor.fetchone()
+    
+    if not row:
+        _bridge_cache.pop(vk_key, None)
+        return None
+    remember_bridged(vk_key, row[0])
+    return row[0]
+
+def save_bridged_file_id(vk_key: str, file_id: str):
+    with db_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO t_p14838969_anon_talk_bot.media_bridge_cache (source_platform, source_key, target_attachment) "
+            "VALUES ('vk', %s, %s) "
+            "ON CONFLICT (source_platform, source_key) DO UPDATE SET "
+            "target_attachment = EXCLUDED.target_attachment, last_used_at = CURRENT_TIMESTAMP",
+            (vk_key, file_id)
+        )
+    remember_bridged(vk_key, file_id)
+
+def forget_bridged_file_id(vk_key: str):
+    _bridge_cache.pop(vk_key, None)
+    with db_connection() as conn, conn.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM t_p14838969_anon_talk_bot.media_bridge_cache WHERE source_platform = 'vk' AND source_key = %s",
+            (vk_key,)
+        )
+
+def sent_file_id(result: Dict, field: str) -> Optional[str]:
+    """file_id of the media in a Bot API send* result (largest size for photos)"""
+    media = result.get(field)
+    if isinstance(media, list):
+        media = media[-1] if media else None
+    return media.get('file_id') if media else None
+
+def send_telegram_media(chat_id: int, attachment: Dict, caption: Optional[str] = None) -> bool:
+    """Relay a VK attachment to Telegram, reusing a cached file_id or streaming a multipart upload"""
+    source = telegram_media_source(attachment)
+    if not source:
+        return False
+    method, field, url, filename, mime_type = source
+    vk_key = vk_attachment_id(attachment, with_access_key=False)
+    
+    if vk_key:
+        cached = get_bridged_file_id(vk_key)
+        if cached:
+            data = {'chat_id': chat_id, field: cached}
+            if caption:
+                data['caption'] = caption
+            try:
+                response = http_session().post(
+                    f'{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/{method}', json=data, timeout=MEDIA_BRIDGE_TIMEOUT
+                )
+            except requests.RequestException as e:
+                print(f"[VK] Media bridge failed: {e}")
+                return False
+            if response.status_code == 200:
+                return True
+            forget_bridged_file_id(vk_key)
+    
+    if not _bridge_slots.acquire(timeout=MEDIA_BRIDGE_TIMEOUT):
+        return False
+    try:
+        download = http_session().get(url, stream=True, timeout=MEDIA_BRIDGE_TIMEOUT)
+        try:
+            if download.status_code != 200:
+                return False
+            size = download.headers.get('Content-Length')
+            size = int(size) if size and size.isdigit() else None
+            if size and size > MEDIA_BRIDGE_MAX_BYTES:
+                return False
+            body = MultipartStream(field, filename, mime_type, limited_chunks(download, MEDIA_BRIDGE_MAX_BYTES), size)
+            params = {'chat_id': chat_id}
+            if caption:
+                params['caption'] = caption
+            response = http_session().post(
+                f'{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/{method}',
+                params=params,
+                data=body,
+                headers={'Content-Type': body.content_type},
+                timeout=MEDIA_BRIDGE_TIMEOUT
+            )
+        finally:
+            download.close()
+    except (requests.RequestException, ValueError) as e:
+        print(f"[VK] Media bridge failed: {e}")
+        return False
+    finally:
+        _bridge_slots.release()
     
-    if chat['user1_platform'] == 'vk' and chat['user1_platform_id'] == str(user_id):
-        partner_platform = chat['user2_platform']
-        partner_id = chat['user2_platform_id']
-    else:
-        partner_platform = chat['user1_platform']
-        partner_id = chat['user1_platform_id']
-    
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    cursor.execute('SELECT * FROM users WHERE platform = %s AND platform_id = %s', (partner_platform, partner_id))
-    partner = cursor.fetchone()
-    
-    cursor.close()
-    conn.close()
-    
-    return dict(partner) if partner else None
+    if response.status_code != 200:
+        return False
+    file_id = sent_file_id(response.json().get('result', {}), field)
+    if vk_key and file_id:
+        save_bridged_file_id(vk_key, file_id)
+    return True
+
+def send_telegram_text(chat_id: int, text: str) -> bool:
+    url = f'{TELEGRAM_API_URL}/bot{TELEGRAM_BOT_TOKEN}/sendMessage'
+    response = http_session().post(url, json={'chat_id': chat_id, 'text': text}, timeout=MEDIA_BRIDGE_TIMEOUT)
+    return response.status_code == 200
 
-def send_to_partner(user_id: int, text: str) -> bool:
+def send_to_partner(user_id: int, text: str, attachments: Optional[List[Dict]] = None) -> bool:
     """Send message to chat partner (cross-platform)"""
     partner = get_partner_from_chat(user_id)
     if not partner:
         return False
     
-    partner_platform = partner['platform']
-    partner_id = int(partner['platform_id'])
+    partner_platform = partner.platform
+    partner_id = int(partner.platform_id)
+    attachments = attachments or []
     
     if partner_platform == 'vk':
-        return send_message(partner_id, text)
+        attachment_ids = [att_id for att_id in map(vk_attachment_id, attachments) if att_id]
+        if not text and not attachment_ids:
+            return False
+        return send_message(partner_id, text, attachment=','.join(attachment_ids) or None)
     elif partner_platform == 'telegram':
-        url = f'https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage'
-        response = requests.post(url, json={'chat_id': partner_id, 'text': text})
-        return response.status_code == 200
+        caption = text
+        sent = False
+        labels = []
+        for attachment in attachments:
+            if send_telegram_media(partner_id, attachment, caption):
+                caption = None
+                sent = True
+            else:
+                labels.append(VK_ATTACHMENT_LABELS.get(attachment.get('type'), VK_ATTACHMENT_DEFAULT_LABEL))
+        # Whatever could not be bridged still reaches the partner as a content label plus the text
+        fallback = '\n'.join(labels + ([caption] if caption else []))
+        if fallback:
+            sent = send_telegram_text(partner_id, fallback) or sent
+        return sent
     
     return False
 
@@ -284,8 +818,8 @@ def handle_start(user_id: int, username: str) -> None:
         send_message(user_id, '❌ Ошибка при создании профиля')
         return
     
-    print(f"[VK] User gender: {user.get('gender')}")
-    if user['gender'] == 'not_set':
+    print(f"[VK] User gender: {user.gender}")
+    if user.gender == 'not_set':
         keyboard = {
             'one_time': True,
             'buttons': [
@@ -323,11 +857,12 @@ def handle_search(user_id: int, gender_filter: Optional[str] = None) -> None:
     if partner:
         set_searching(user_id, False)
         
-        partner_platform = partner['platform']
-        partner_id = int(partner['platform_id'])
+        partner_platform = partner.platform
+        partner_id = int(partner.platform_id)
         set_searching(partner_id, False)
         
         chat_id = create_chat(user_id, 'vk', partner_id, partner_platform)
+        record_stats(user_id, {'searches': 1, 'chats_started': 1})
         
         set_in_chat(user_id, True, chat_id)
         set_in_chat(partner_id, True, chat_id)
@@ -345,7 +880,19 @@ def handle_search(user_id: int, gender_filter: Optional[str] = None) -> None:
         send_message(user_id, f'✅ Собеседник найден! ({platform_emoji})\n\nМожете начинать общение 💬', keyboard)
         send_to_partner(user_id, f'✅ Собеседник найден! (📱 VK)\n\nМожете начинать общение 💬')
     else:
-        send_message(user_id, '🔍 Ищем собеседника...\n\nОжидайте подключения')
+        record_stats(user_id, {'searches': 1})
+        keyboard = {
+            'buttons': [
+                [{'action': {'type': 'text', 'label': '❌ Отменить поиск'}}]
+            ]
+        }
+        send_message(user_id, '🔍 Ищем собеседника...\n\nОжидайте подключения', keyboard)
+
+def handle_cancel_search(user_id: int) -> None:
+    """Stop searching and return to the main menu"""
+    set_searching(user_id, False)
+    send_message(user_id, '❌ Поиск остановлен')
+    handle_start(user_id, '')
 
 def handle_stop_chat(user_id: int) -> None:
     """Handle stop chat command"""
@@ -359,7 +906,7 @@ def handle_stop_chat(user_id: int) -> None:
     
     partner = get_partner_from_chat(user_id)
     if partner:
-        partner_id = int(partner['platform_id'])
+        partner_id = int(partner.platform_id)
         set_in_chat(partner_id, False, None)
     
     end_chat(user_id)
@@ -408,72 +955,246 @@ def handle_gender_search(user_id: int) -> None:
     
     send_message(user_id, '🎯 Выбери пол собеседника:', keyboard)
 
-def handle_message(user_id: int, username: str, text: str) -> None:
-    """Handle incoming message"""
-    print(f"[VK] handle_message for user {user_id}, text: {text}")
+def handle_gender_selected(user_id: int, username: str, gender: str) -> None:
+    """Save the chosen gender and show the main menu"""
+    update_user_gender(user_id, gender)
+    send_message(user_id, '✅ Пол установлен: Мужской' if gender == 'male' else '✅ Пол установлен: Женский')
+    handle_start(user_id, username)
+
+def handle_gender_prompt(user_id: int) -> None:
+    """Ask a user without a gender to pick one"""
+    keyboard = {
+        'one_time': True,
+        'buttons': [
+            [{'action': {'type': 'text', 'label': '👨 Мужской'}}],
+            [{'action': {'type': 'text', 'label': '👩 Женский'}}]
+        ]
+    }
+    send_message(user_id, '👋 Привет! Это анонимный чат для общения.\n\n🔹 Выбери свой пол:', keyboard)
+
+def update_content_type(attachments: List[Dict]) -> str:
+    """Metric and route label for a message: its first attachment's type from the allow-list, or text"""
+    if not attachments:
+        return 'text'
+    attachment_type = attachments[0].get('type')
+    return attachment_type if attachment_type in VK_ATTACHMENT_LABELS else 'other'
+
+def handle_relay(update: 'Update') -> None:
+    """Forward an in-chat message to the partner; only delivered messages are counted"""
+    if send_to_partner(update.user_id, update.text, update.attachments):
+        record_stats(update.user_id, {'messages': 1})
+
+class Update(NamedTuple):
+    user_id: int
+    username: str
+    text: str
+    attachments: List[Dict]
+
+class Route(NamedTuple):
+    """Button/command texts routed to one handler in the listed user states"""
+    name: str
+    texts: Tuple[str, ...]
+    handler: Callable[[Update], None]
+    states: FrozenSet[str] = frozenset({'idle'})
+
+# Labels of both bots' keyboards are accepted: Telegram keyboards reach VK users in
+# cross-platform chats, so '❌ Завершить диалог' must work here as well as '🛑 Стоп'
+STOP_TEXTS = ('🛑 Стоп', '/stop', '❌ Завершить диалог', '❌ Отменить поиск')
+ROUTES = (
+    Route('start', ('начать', 'Начать', 'start', '/start', '◀️ Назад'), lambda update: handle_start(update.user_id, update.username)),
+    Route('stop', STOP_TEXTS, lambda update: handle_stop_chat(update.user_id), frozenset({'in_chat'})),
+    # Like the Telegram bot's search gate: while searching only cancelling is routed
+    Route('cancel_search', STOP_TEXTS, lambda update: handle_cancel_search(update.user_id), frozenset({'searching'})),
+    Route('next', ('➡️ Далее', '/next', '🔍 Найти нового собеседника'),
+          lambda update: handle_next_chat(update.user_id), frozenset({'in_chat'})),
+    Route('settings', ('⚙️ Настройки', '/settings'), lambda update: handle_settings(update.user_id)),
+    Route('change_gender', ('🔄 Изменить пол',), lambda update: handle_set_gender(update.user_id)),
+    Route('set_gender_male', ('👨 Мужской',),
+          lambda update: handle_gender_selected(update.user_id, update.username, 'male'), frozenset({'no_gender'})),
+    Route('set_gender_female', ('👩 Женский',),
+          lambda update: handle_gender_selected(update.user_id, update.username, 'female'), frozenset({'no_gender'})),
+    Route('search', ('🔍 Найти собеседника',), lambda update: handle_search(update.user_id)),
+    Route('gender_search_menu', ('🎯 Найти по полу',), lambda update: handle_gender_search(update.user_id)),
+    Route('search_male', ('👨 Найти мужчину', '👨 Искать мужчину'), lambda update: handle_search(update.user_id, 'male')),
+    Route('search_female', ('👩 Найти женщину', '👩 Искать женщину'), lambda update: handle_search(update.user_id, 'female')),
+)
+COMMAND_ROUTES = {(state, text): route for route in ROUTES for state in route.states for text in route.texts}
+# What an unmatched text does in each state; idle users get no reply
+STATE_FALLBACKS = {
+    'in_chat': Route('relay', (), handle_relay),
+    'no_gender': Route('gender_prompt', (), lambda update: handle_gender_prompt(update.user_id)),
+    'searching': Route('search_gate', (), lambda update: send_message(update.user_id, SEARCH_GATE_TEXT)),
+}
+
+def user_state(user: UserRow) -> str:
+    if user.is_in_chat:
+        return 'in_chat'
+    if user.gender == 'not_set':
+        return 'no_gender'
+    if user.is_searching:
+        return 'searching'
+    return 'idle'
+
+def handle_message(user_id: int, username: str, text: str, attachments: Optional[List[Dict]] = None) -> None:
+    """Route an incoming message by (user state, text) with one dict lookup and time the handler"""
+    update = Update(user_id, username, text, attachments or [])
     user = get_user(user_id)
-    print(f"[VK] User found: {user is not None}")
     
     if not user:
-        print(f"[VK] User not found, calling handle_start")
-        handle_start(user_id, username)
-        return
-    
-    if user['is_in_chat']:
-        print(f"[VK] User is in chat, handling chat commands")
-        if text == '🛑 Стоп':
-            handle_stop_chat(user_id)
-        elif text == '➡️ Далее':
-            handle_next_chat(user_id)
-        else:
-            send_to_partner(user_id, text)
-        return
-    
-    print(f"[VK] User gender: {user.get('gender')}")
-    if user['gender'] == 'not_set':
-        print(f"[VK] Gender not set, showing gender selection")
-        if text == '👨 Мужской':
-            update_user_gender(user_id, 'male')
-            send_message(user_id, '✅ Пол установлен: Мужской')
-            handle_start(user_id, username)
-        elif text == '👩 Женский':
-            update_user_gender(user_id, 'female')
-            send_message(user_id, '✅ Пол установлен: Женский')
-            handle_start(user_id, username)
-        else:
-            # Show gender selection keyboard
-            keyboard = {
-                'one_time': True,
-                'buttons': [
-                    [{'action': {'type': 'text', 'label': '👨 Мужской'}}],
-                    [{'action': {'type': 'text', 'label': '👩 Женский'}}]
-                ]
-            }
-            send_message(user_id, '👋 Привет! Это анонимный чат для общения.\n\n🔹 Выбери свой пол:', keyboard)
+        route = COMMAND_ROUTES[('idle', '/start')]
+    else:
+        state = user_state(user)
+        route = COMMAND_ROUTES.get((state, text)) or STATE_FALLBACKS.get(state)
+        if route is None:
+            return
+    
+    name = route.name
+    if name == 'relay':
+        name = f'relay_{update_content_type(update.attachments)}'
+    print(f"[VK] Route {name} for user {user_id}")
+    tag_route(name)
+    
+    started = time.perf_counter()
+    failed = True
+    try:
+        route.handler(update)
+        failed = False
+    finally:
+        observe_latency(_route_metrics, name, time.perf_counter() - started, failed)
+
+def prometheus_labels(labels: Dict[str, Any]) -> str:
+    return ','.join(f'{key}="{str(value).translate(PROMETHEUS_LABEL_ESCAPES)}"' for key, value in labels.items())
+
+def metric_family(lines: List[str], name: str, kind: str, help_text: str) -> None:
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+
+def sample(lines: List[str], name: str, labels: Dict[str, Any], value: Any) -> None:
+    lines.append(f'{name}{{{prometheus_labels(labels)}}} {value}')
+
+def histogram_samples(lines: List[str], name: str, labels: Dict[str, Any], histogram: LatencyHistogram) -> None:
+    """Exposition lines of one histogram; buckets are stored per-bucket and emitted cumulatively"""
+    cumulative = 0
+    for bound, bucket_count in zip((*LATENCY_BUCKETS, '+Inf'), histogram.bucket_counts):
+        cumulative += bucket_count
+        sample(lines, f'{name}_bucket', {**labels, 'le': bound}, cumulative)
+    sample(lines, f'{name}_sum', labels, histogram.seconds_sum)
+    sample(lines, f'{name}_count', labels, histogram.count)
+
+def render_metrics() -> str:
+    """This instance's counters in the Prometheus text exposition format"""
+    lines: List[str] = []
+    platform = {'platform': 'vk'}
+    # Snapshot with list(): another thread may add a key while the page is rendered
+    route_metrics = list(_route_metrics.items())
+    
+    metric_family(lines, 'bot_updates_total', 'counter', 'Events received, by message content type or event type')
+    for update_type, total in list(_update_counts.items()):
+        sample(lines, 'bot_updates_total', {**platform, 'type': update_type}, total)
+    
+    metric_family(lines, 'bot_route_duration_seconds', 'histogram', 'Handler latency per route')
+    for route, histogram in route_metrics:
+        histogram_samples(lines, 'bot_route_duration_seconds', {**platform, 'route': route}, histogram)
+    metric_family(lines, 'bot_route_errors_total', 'counter', 'Handler invocations that raised')
+    for route, histogram in route_metrics:
+        sample(lines, 'bot_route_errors_total', {**platform, 'route': route}, histogram.errors)
+    
+    # No pool here: every helper opens its own connection, so the handshake is the DB wait
+    connects = _db_connect_metrics.get('connect')
+    if connects is not None:
+        metric_family(lines, 'bot_db_connect_duration_seconds', 'histogram', 'Time to open a database connection')
+        histogram_samples(lines, 'bot_db_connect_duration_seconds', platform, connects)
+        metric_family(lines, 'bot_db_connect_errors_total', 'counter', 'Database connections that failed to open')
+        sample(lines, 'bot_db_connect_errors_total', platform, connects.errors)
+    
+    metric_family(lines, 'bot_api_request_duration_seconds', 'histogram', 'Outbound VK API, Bot API and CDN download latency')
+    for api, histogram in list(_api_metrics.items()):
+        histogram_samples(lines, 'bot_api_request_duration_seconds', {**platform, 'api': api}, histogram)
+    metric_family(
+        lines, 'bot_api_responses_total', 'counter',
+        'Outbound responses by HTTP status (429 = rate limited) or exception name'
+    )
+    for (api, status), total in list(_api_responses.items()):
+        sample(lines, 'bot_api_responses_total', {**platform, 'api': api, 'status': status}, total)
+    return '\n'.join(lines) + '\n'
+
+def metrics_response(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Prometheus scrape of this warm instance; 404 unless METRICS_TOKEN is set and presented"""
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    if not METRICS_TOKEN or not secrets.compare_digest(headers.get('authorization', ''), f'Bearer {METRICS_TOKEN}'):
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'text/plain'},
+            'body': 'not found',
+            'isBase64Encoded': False
+        }
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8', 'Cache-Control': 'no-store'},
+        'body': render_metrics(),
+        'isBase64Encoded': False
+    }
+
+def sample_stacks(stopped: threading.Event, stacks: Dict[str, int], handler: threading.Thread) -> None:
+    """Sampler thread: count the handler thread's stack, rooted at the thread's name, until stopped"""
+    while not stopped.wait(PROFILE_INTERVAL_SECONDS):
+        frame = sys._current_frames().get(handler.ident)
+        if frame is None:
+            continue
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        frames.append(handler.name)
+        stack = ';'.join(reversed(frames))
+        stacks[stack] = stacks.get(stack, 0) + 1
+
+def write_profile(route: str, stacks: Dict[str, int]) -> None:
+    """Append one invocation's collapsed stacks under its route, rotating the file past PROFILE_MAX_BYTES"""
+    if not stacks:
         return
-    
-    if text in ['начать', 'start', '/start', 'Начать']:
-        handle_start(user_id, username)
-    elif text == '⚙️ Настройки':
-        handle_settings(user_id)
-    elif text == '◀️ Назад':
-        handle_start(user_id, username)
-    elif text == '🔄 Изменить пол':
-        handle_set_gender(user_id)
-    elif text == '🔍 Найти собеседника':
-        handle_search(user_id)
-    elif text == '🎯 Найти по полу':
-        handle_gender_search(user_id)
-    elif text == '👨 Найти мужчину':
-        handle_search(user_id, 'male')
-    elif text == '👩 Найти женщину':
-        handle_search(user_id, 'female')
+    lines = ''.join(f'{route};{stack} {count}\n' for stack, count in stacks.items())
+    try:
+        with _profile_sink_lock:
+            os.makedirs(os.path.dirname(PROFILE_PATH), exist_ok=True)
+            with open(PROFILE_PATH, 'a', encoding='utf-8') as sink:
+                sink.write(lines)
+                full = sink.tell() > PROFILE_MAX_BYTES
+            if full:
+                os.replace(PROFILE_PATH, f'{PROFILE_PATH}.1')
+    except OSError:
+        # Profiles are diagnostics; a full or read-only disk must not fail the invocation
+        pass
 
+def profiled(function: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    """Run a PROFILE_SAMPLE_RATE fraction of invocations under sample_stacks; a no-op when the rate is 0"""
+    if PROFILE_SAMPLE_RATE <= 0:
+        return function
+    
+    @functools.wraps(function)
+    def sampled(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        if secrets.randbelow(1_000_000) >= PROFILE_SAMPLE_RATE * 1_000_000:
+            return function(event, context)
+        _trace_local.route = None
+        stacks: Dict[str, int] = {}
+        stopped = threading.Event()
+        sampler = threading.Thread(target=sample_stacks, args=(stopped, stacks, threading.current_thread()), name='stack-sampler', daemon=True)
+        sampler.start()
+        try:
+            return function(event, context)
+        finally:
+            stopped.set()
+            sampler.join()
+            write_profile(getattr(_trace_local, 'route', None) or 'unrouted', stacks)
+    return sampled
+
+@profiled
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: VK webhook handler for anonymous chat bot
-    Args: event - dict with httpMethod, body
-    Returns: HTTP response dict with statusCode 200
+    Args: event - dict with httpMethod, body, headers
+    Returns: HTTP response dict with statusCode 200; Prometheus metrics text for a GET bearing METRICS_TOKEN
     '''
     method = event.get('httpMethod', 'POST')
     
@@ -490,6 +1211,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    if method == 'GET':
+        return metrics_response(event)
+    
     body = json.loads(event.get('body', '{}'))
     
     # VK Callback API confirmation
@@ -506,19 +1230,39 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         message = body['object']['message']
         user_id = message['from_id']
         text = message.get('text', '')
-        print(f"[VK] Received message from user {user_id}: {text}")
+        attachments = message.get('attachments', [])
+        print(f"[VK] Received message from user {user_id}: {text} ({len(attachments)} attachments)")
+        bump_counter(_update_counts, update_content_type(attachments))
         
-        # Get username
-        user_info = vk_api_call('users.get', {'user_ids': str(user_id)})
-        username = f"{user_info[0]['first_name']} {user_info[0]['last_name']}" if user_info else 'User'
-        print(f"[VK] Username: {username}")
-        
-        handle_message(user_id, username, text)
+        trace = start_trace()
+        failed = True
+        try:
+            # Get username
+            user_info = vk_api_call('users.get', {'user_ids': str(user_id)})
+            username = f"{user_info[0]['first_name']} {user_info[0]['last_name']}" if user_info else 'User'
+            print(f"[VK] Username: {username}")
+            
+            handle_message(user_id, username, text, attachments)
+            failed = False
+        finally:
+            finish_trace(trace, failed)
         print(f"[VK] Message handled successfully")
+    else:
+        event_type = body.get('type')
+        bump_counter(_update_counts, event_type if event_type in VK_EVENT_TYPES else 'other')
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'text/plain'},
         'body': 'ok',
         'isBase64Encoded': False
-    }
\ No newline at end of file
+    }
+
+def warm_up():
+    """Pay the import and HTTP session setup costs during init instead of on the first event"""
+    if isinstance(psycopg2, LazyModule):
+        psycopg2.load()
+    http_session()
+
+if WARM_START:
+    warm_up()
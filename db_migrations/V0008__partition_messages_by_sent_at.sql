@@ -0,0 +1,59 @@
+-- Переводим messages на секционирование по sent_at (одна секция на сутки).
+-- Очистка старых данных теперь делается через DETACH + DROP целой секции вместо UPDATE по строкам.
+
+ALTER TABLE t_p14838969_anon_talk_bot.messages RENAME TO messages_legacy;
+ALTER INDEX t_p14838969_anon_talk_bot.messages_pkey RENAME TO messages_legacy_pkey;
+ALTER INDEX t_p14838969_anon_talk_bot.idx_messages_chat_id RENAME TO idx_messages_legacy_chat_id;
+ALTER INDEX t_p14838969_anon_talk_bot.idx_messages_photo_url RENAME TO idx_messages_legacy_photo_url;
+ALTER INDEX t_p14838969_anon_talk_bot.idx_messages_photo_sent_at RENAME TO idx_messages_legacy_photo_sent_at;
+
+-- Ключ секционирования обязан входить в первичный ключ, поэтому PK = (id, sent_at)
+CREATE TABLE t_p14838969_anon_talk_bot.messages (
+    id BIGINT NOT NULL DEFAULT nextval('t_p14838969_anon_talk_bot.messages_id_seq'),
+    chat_id BIGINT NOT NULL REFERENCES t_p14838969_anon_talk_bot.chats(id),
+    sender_telegram_id BIGINT NOT NULL REFERENCES t_p14838969_anon_talk_bot.users(telegram_id),
+    content_type VARCHAR(20) NOT NULL DEFAULT 'text',
+    photo_url TEXT NULL,
+    text_content TEXT NULL,
+    sent_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, sent_at)
+) PARTITION BY RANGE (sent_at);
+
+-- Индексы из V0004/V0005: создаются на родительской таблице и автоматически на каждой секции
+CREATE INDEX idx_messages_chat_id ON t_p14838969_anon_talk_bot.messages(chat_id);
+CREATE INDEX idx_messages_photo_url ON t_p14838969_anon_talk_bot.messages(photo_url) WHERE photo_url IS NOT NULL;
+CREATE INDEX idx_messages_photo_sent_at ON t_p14838969_anon_talk_bot.messages(sent_at) WHERE photo_url IS NOT NULL;
+
+-- Секция по умолчанию на случай, если суточные секции не были созданы заранее
+CREATE TABLE t_p14838969_anon_talk_bot.messages_default
+    PARTITION OF t_p14838969_anon_talk_bot.messages DEFAULT;
+
+-- Суточные секции: от самого старого сообщения до недели вперёд (messages_pYYYYMMDD)
+DO $$
+DECLARE
+    day DATE;
+    last_day DATE := CURRENT_DATE + 7;
+BEGIN
+    SELECT COALESCE(MIN(COALESCE(sent_at, created_at))::date, CURRENT_DATE)
+    INTO day
+    FROM t_p14838969_anon_talk_bot.messages_legacy;
+
+    WHILE day <= last_day LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS t_p14838969_anon_talk_bot.%I PARTITION OF t_p14838969_anon_talk_bot.messages FOR VALUES FROM (%L) TO (%L)',
+            'messages_p' || to_char(day, 'YYYYMMDD'), day, day + 1
+        );
+        day := day + 1;
+    END LOOP;
+END $$;
+
+INSERT INTO t_p14838969_anon_talk_bot.messages
+    (id, chat_id, sender_telegram_id, content_type, photo_url, text_content, sent_at, created_at)
+SELECT id, chat_id, sender_telegram_id, content_type, photo_url, text_content,
+       COALESCE(sent_at, created_at, CURRENT_TIMESTAMP), created_at
+FROM t_p14838969_anon_talk_bot.messages_legacy;
+
+ALTER SEQUENCE t_p14838969_anon_talk_bot.messages_id_seq OWNED BY t_p14838969_anon_talk_bot.messages.id;
+
+DROP TABLE t_p14838969_anon_talk_bot.messages_legacy;
@@ -0,0 +1,9 @@
+-- Курсор пакетной очистки вложений: позволяет продолжить с места остановки при следующем запуске
+CREATE TABLE t_p14838969_anon_talk_bot.cleanup_state (
+    job VARCHAR(32) PRIMARY KEY,
+    last_sent_at TIMESTAMP NULL,
+    last_id BIGINT NULL,
+    cutoff TIMESTAMP NULL,
+    rows_processed BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
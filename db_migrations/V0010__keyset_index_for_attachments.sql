@@ -0,0 +1,4 @@
+-- Индекс по (sent_at, id) для keyset-пагинации вложений в админке и пакетной очистки
+DROP INDEX IF EXISTS t_p14838969_anon_talk_bot.idx_messages_photo_sent_at;
+CREATE INDEX idx_messages_photo_sent_at ON t_p14838969_anon_talk_bot.messages(sent_at, id)
+WHERE photo_url IS NOT NULL;
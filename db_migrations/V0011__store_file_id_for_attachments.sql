@@ -0,0 +1,11 @@
+-- Вложения хранятся как file_id/file_unique_id Telegram вместо ссылки getFile (ссылка живёт ~1 час и содержит токен бота)
+ALTER TABLE t_p14838969_anon_talk_bot.messages ADD COLUMN file_id TEXT NULL;
+ALTER TABLE t_p14838969_anon_talk_bot.messages ADD COLUMN file_unique_id VARCHAR(64) NULL;
+
+-- Старые ссылки уже просрочены, их нечем заменить
+UPDATE t_p14838969_anon_talk_bot.messages SET photo_url = NULL WHERE photo_url IS NOT NULL;
+
+DROP INDEX IF EXISTS t_p14838969_anon_talk_bot.idx_messages_photo_url;
+DROP INDEX IF EXISTS t_p14838969_anon_talk_bot.idx_messages_photo_sent_at;
+CREATE INDEX idx_messages_file_sent_at ON t_p14838969_anon_talk_bot.messages(sent_at, id)
+WHERE file_id IS NOT NULL;
@@ -0,0 +1,12 @@
+-- Кэш загруженных вложений для моста Telegram <-> VK:
+-- telegram/file_unique_id -> строка вложения VK, vk/photo123_456 -> file_id Telegram
+CREATE TABLE t_p14838969_anon_talk_bot.media_bridge_cache (
+    source_platform VARCHAR(16) NOT NULL,
+    source_key VARCHAR(255) NOT NULL,
+    target_attachment TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (source_platform, source_key)
+);
+
+CREATE INDEX idx_media_bridge_cache_last_used ON t_p14838969_anon_talk_bot.media_bridge_cache(last_used_at);
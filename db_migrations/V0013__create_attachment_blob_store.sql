@@ -0,0 +1,18 @@
+-- Контентно-адресуемое хранилище вложений: файл лежит на диске по SHA-256, одинаковые файлы хранятся один раз
+CREATE TABLE t_p14838969_anon_talk_bot.attachment_blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    size_bytes BIGINT NOT NULL,
+    mime_type VARCHAR(100) NULL,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_attachment_blobs_orphaned ON t_p14838969_anon_talk_bot.attachment_blobs(sha256) WHERE refcount <= 0;
+
+ALTER TABLE t_p14838969_anon_talk_bot.messages ADD COLUMN blob_sha256 CHAR(64) NULL;
+
+-- Поиск уже сохранённого файла по file_unique_id (дедупликация без повторной загрузки из Telegram)
+CREATE INDEX idx_messages_file_unique_blob ON t_p14838969_anon_talk_bot.messages(file_unique_id) WHERE blob_sha256 IS NOT NULL;
+
+-- Очередь вложений, ещё не сохранённых в хранилище
+CREATE INDEX idx_messages_uncaptured ON t_p14838969_anon_talk_bot.messages(sent_at, id) WHERE file_id IS NOT NULL AND blob_sha256 IS NULL;
@@ -0,0 +1,14 @@
+-- Поминутные счётчики для дашборда админки: боты увеличивают их при каждом событии,
+-- get_stats читает только агрегаты за 24 часа вместо сканирования chats/users.
+-- metric: chats_started, chats_ended, chat_duration_seconds, messages, searches, complaints
+CREATE TABLE t_p14838969_anon_talk_bot.stats_rollup (
+    bucket TIMESTAMP NOT NULL,
+    metric VARCHAR(32) NOT NULL,
+    platform VARCHAR(16) NOT NULL DEFAULT 'unknown',
+    gender VARCHAR(10) NOT NULL DEFAULT 'unknown',
+    value BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, metric, platform, gender)
+);
+
+-- Счётчик активных пользователей за 5 минут/24 часа берётся по индексу, а не полным сканом
+CREATE INDEX idx_users_last_active ON t_p14838969_anon_talk_bot.users(last_active);
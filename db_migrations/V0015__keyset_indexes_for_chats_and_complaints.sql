@@ -0,0 +1,9 @@
+-- Постраничный вывод активных чатов и жалоб по курсору (started_at, id) / (created_at, id)
+CREATE INDEX idx_chats_active_started ON t_p14838969_anon_talk_bot.chats(started_at, id) WHERE is_active = TRUE;
+
+CREATE INDEX idx_complaints_created ON t_p14838969_anon_talk_bot.complaints(created_at, id);
+
+-- Частичный индекс по ожидающим жалобам теперь ещё и упорядочен по (created_at, id),
+-- поэтому основной фильтр админки status = 'pending' обходится без сортировки
+DROP INDEX IF EXISTS t_p14838969_anon_talk_bot.idx_complaints_status;
+CREATE INDEX idx_complaints_status ON t_p14838969_anon_talk_bot.complaints(created_at, id) WHERE status = 'pending';
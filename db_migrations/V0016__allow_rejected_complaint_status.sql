@@ -0,0 +1,4 @@
+-- Админка отклоняет жалобы статусом 'rejected', который не проходил исходную проверку
+ALTER TABLE t_p14838969_anon_talk_bot.complaints DROP CONSTRAINT IF EXISTS complaints_status_check;
+ALTER TABLE t_p14838969_anon_talk_bot.complaints ADD CONSTRAINT complaints_status_check
+    CHECK (status IN ('pending', 'reviewed', 'resolved', 'rejected'));
@@ -0,0 +1,2 @@
+-- Список отозванных, но ещё не истёкших сессий, который admin-auth и admin-api периодически кэшируют в памяти
+CREATE INDEX idx_admin_sessions_revoked ON t_p14838969_anon_talk_bot.admin_sessions(expires_at) WHERE is_active = FALSE;
@@ -0,0 +1,13 @@
+-- Счётчики попыток входа по IP поминутно: проверка лимита читает не больше ATTEMPT_WINDOW_MINUTES строк
+-- вместо COUNT(*) по всем попыткам. bucket = unix-время в минутах
+CREATE TABLE t_p14838969_anon_talk_bot.login_attempt_buckets (
+    ip_address VARCHAR(45) NOT NULL,
+    bucket BIGINT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (ip_address, bucket)
+);
+
+CREATE INDEX idx_login_attempt_buckets_bucket ON t_p14838969_anon_talk_bot.login_attempt_buckets(bucket);
+
+-- Для пакетного удаления старых записей журнала входов
+CREATE INDEX idx_login_attempts_attempted_at ON t_p14838969_anon_talk_bot.login_attempts(attempted_at);
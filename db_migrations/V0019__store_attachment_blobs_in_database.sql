@@ -0,0 +1,9 @@
+-- Файлы хранилища вложений переносятся с диска в БД: функции не разделяют /tmp,
+-- поэтому admin-api не видел файлов, сохранённых cleanup-attachments.
+-- STORAGE EXTERNAL хранит bytea без сжатия, и substring() читает из TOAST только запрошенный диапазон.
+ALTER TABLE t_p14838969_anon_talk_bot.attachment_blobs ADD COLUMN content BYTEA NULL;
+ALTER TABLE t_p14838969_anon_talk_bot.attachment_blobs ALTER COLUMN content SET STORAGE EXTERNAL;
+
+-- Записи о файлах, сохранённых только на диск, удаляются: вложения последних суток будут сохранены заново
+UPDATE t_p14838969_anon_talk_bot.messages SET blob_sha256 = NULL WHERE blob_sha256 IS NOT NULL;
+DELETE FROM t_p14838969_anon_talk_bot.attachment_blobs;
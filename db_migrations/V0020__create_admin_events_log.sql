@@ -0,0 +1,21 @@
+-- Журнал событий живого дашборда. Курсор клиента — id события из общей последовательности,
+-- поэтому long-poll можно продолжить на любом экземпляре admin-api, а пропущенные NOTIFY не теряют событий.
+CREATE TABLE t_p14838969_anon_talk_bot.admin_events (
+    id BIGSERIAL PRIMARY KEY,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_admin_events_created_at ON t_p14838969_anon_talk_bot.admin_events(created_at);
+
+-- NOTIFY только будит ожидающие запросы admin-api; сами события читаются из таблицы
+CREATE FUNCTION t_p14838969_anon_talk_bot.notify_admin_event() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('admin_events', NEW.id::text);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER admin_events_notify
+    AFTER INSERT ON t_p14838969_anon_talk_bot.admin_events
+    FOR EACH ROW EXECUTE FUNCTION t_p14838969_anon_talk_bot.notify_admin_event();
@@ -0,0 +1,109 @@
+'''
+Business: Cold-start benchmark for the serverless functions in backend/
+Args: optional function names; --runs, --python (interpreter with the functions' requirements installed)
+Returns: per-function `-X importtime` totals against the import budget; exit code 1 when a budget is exceeded
+'''
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+# Milliseconds to import index.py with warm bytecode caches. Functions that defer their
+# heavy dependencies stay well under these; cleanup-attachments is a cron job and imports eagerly
+IMPORT_BUDGET_MS = {
+    'admin-api': 120,
+    'admin-auth': 80,
+    'cleanup-attachments': 300,
+    'telegram-bot': 80,
+    'vk-bot': 80,
+}
+DEFAULT_BUDGET_MS = 120
+
+# Modules that should only load on the paths that need them
+HEAVY_MODULES = ('psycopg2', 'requests', 'bcrypt')
+
+PROBE = (
+    'import sys, index; '
+    f'print(",".join(name for name in {HEAVY_MODULES!r} if name in sys.modules))'
+)
+
+def parse_importtime(stderr: str) -> Tuple[Optional[int], List[Tuple[int, str]]]:
+    """Cumulative microseconds for index and its direct imports from `-X importtime` output"""
+    total = None
+    children: List[Tuple[int, str]] = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        # One separator space, then two more per nesting level
+        name = name[1:].rstrip()
+        if name == 'index':
+            total = int(cumulative_us)
+        elif name.startswith('  ') and not name.startswith('   '):
+            children.append((int(cumulative_us), name.strip()))
+    return total, children
+
+def measure(function: str, python: str, runs: int) -> Dict[str, object]:
+    cwd = os.path.join(BACKEND_DIR, function)
+    env = dict(os.environ, WARM_START='false')
+    # First run writes __pycache__, so the measured runs reflect a warm container image
+    subprocess.run([python, '-c', 'import index'], cwd=cwd, env=env, capture_output=True)
+
+    totals: List[int] = []
+    children: List[Tuple[int, str]] = []
+    eager = ''
+    for _ in range(runs):
+        result = subprocess.run([python, '-X', 'importtime', '-c', PROBE], cwd=cwd, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            return {'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'import failed'}
+        total, children = parse_importtime(result.stderr)
+        if total is not None:
+            totals.append(total)
+        eager = result.stdout.strip()
+    if not totals:
+        return {'error': 'no importtime line for index'}
+
+    return {
+        'total_ms': statistics.median(totals) / 1000,
+        'top': sorted(children, reverse=True)[:5],
+        'eager': eager,
+    }
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('functions', nargs='*', help='function directories under backend/ (default: all)')
+    parser.add_argument('--runs', type=int, default=5, help='measured runs per function; the median is reported')
+    parser.add_argument('--python', default=sys.executable, help='interpreter that has the functions\' requirements')
+    args = parser.parse_args()
+
+    functions = args.functions or sorted(
+        name for name in os.listdir(BACKEND_DIR) if os.path.isfile(os.path.join(BACKEND_DIR, name, 'index.py'))
+    )
+
+    over_budget = False
+    for function in functions:
+        budget = IMPORT_BUDGET_MS.get(function, DEFAULT_BUDGET_MS)
+        result = measure(function, args.python, args.runs)
+        if 'error' in result:
+            print(f'{function:22} ERROR  {result["error"]}')
+            over_budget = True
+            continue
+
+        total_ms = result['total_ms']
+        status = 'ok' if total_ms <= budget else 'OVER'
+        over_budget = over_budget or status == 'OVER'
+        print(f'{function:22} {total_ms:8.1f} ms  budget {budget:4d} ms  {status}')
+        if result['eager']:
+            print(f'{"":22} eager heavy imports: {result["eager"]}')
+        for cumulative_us, name in result['top']:
+            print(f'{"":22}   {cumulative_us / 1000:7.1f} ms  {name}')
+
+    return 1 if over_budget else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
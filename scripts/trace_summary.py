@@ -0,0 +1,79 @@
+'''
+Business: Summary of the NDJSON traces the bots write when TRACE_SAMPLE_RATE is set
+Args: trace files (rotated .1 files included); --route, --top
+Returns: per-route update latency and the slowest span names (db statements, API methods) by total time
+'''
+
+import argparse
+import json
+import math
+import sys
+from collections import defaultdict
+from typing import Dict, Iterator, List, Tuple
+
+def read_spans(paths: List[str]) -> Iterator[Dict]:
+    for path in paths:
+        with open(path, encoding='utf-8') as sink:
+            for line in sink:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line of a file being written may be cut off
+                    continue
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+def summarize(spans: Iterator[Dict]) -> Dict[str, Tuple[List[float], Dict[Tuple[str, str], List[float]], int]]:
+    """route -> (update durations, (kind, name) -> span durations, failed updates)"""
+    updates: Dict[str, List[float]] = defaultdict(list)
+    children: Dict[str, Dict[Tuple[str, str], List[float]]] = defaultdict(lambda: defaultdict(list))
+    failures: Dict[str, int] = defaultdict(int)
+    for span in spans:
+        route = span.get('route', 'unrouted')
+        if span.get('kind') == 'update':
+            updates[route].append(span['duration_ms'])
+            failures[route] += bool(span.get('failed'))
+        else:
+            children[route][(span.get('kind', '?'), span.get('name', '?'))].append(span['duration_ms'])
+    return {route: (sorted(durations), children[route], failures[route]) for route, durations in updates.items()}
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='+', help='NDJSON trace files, e.g. /tmp/traces/telegram-bot.ndjson')
+    parser.add_argument('--route', action='append', help='only these routes (repeatable)')
+    parser.add_argument('--top', type=int, default=5, help='span names listed per route')
+    args = parser.parse_args()
+
+    routes = summarize(read_spans(args.paths))
+    if args.route:
+        routes = {route: summary for route, summary in routes.items() if route in args.route}
+    if not routes:
+        print('no traced updates')
+        return 1
+
+    # Routes with the most total traced time first: that is where a fix pays off
+    for route, (durations, children, failed) in sorted(routes.items(), key=lambda item: -sum(item[1][0])):
+        total_ms = sum(durations)
+        print(
+            f'{route}  updates {len(durations)}  failed {failed}  '
+            f'p50 {percentile(durations, 0.5):.1f} ms  p95 {percentile(durations, 0.95):.1f} ms  '
+            f'max {durations[-1]:.1f} ms'
+        )
+        ranked = sorted(children.items(), key=lambda item: -sum(item[1]))
+        for (kind, name), values in ranked[:args.top]:
+            values.sort()
+            share = sum(values) / total_ms * 100 if total_ms else 0.0
+            print(
+                f'    {kind:4} {name:36} calls {len(values):5}  '
+                f'p50 {percentile(values, 0.5):8.1f} ms  p95 {percentile(values, 0.95):8.1f} ms  '
+                f'max {values[-1]:8.1f} ms  {share:5.1f}% of route time'
+            )
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,17 @@
-import { useState } from 'react';
+import { useEffect, useState, type ImgHTMLAttributes } from 'react';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
 import Icon from '@/components/ui/icon';
 import { useToast } from '@/hooks/use-toast';
+import { downloadAttachment, fetchAttachmentBlob } from '@/lib/attachments';
 
 const CLEANUP_API_URL = 'https://functions.poehali.dev/44deba1f-2392-4866-9015-8df267216a6c';
+const ADMIN_API_URL = 'https://functions.poehali.dev/3d80763a-6e9c-47e8-ad39-f66f686907a6';
 
 interface Attachment {
   id: number;
   chat_id: number;
-  photo_url: string;
+  blob_sha256: string | null;
   content_type: string;
   sent_at: string;
   sender_gender: string;
@@ -20,6 +22,57 @@ interface AttachmentsListProps {
   onCleanupComplete: () => void;
 }
 
+const PLAYABLE_TYPES = ['voice', 'video_note', 'video'];
+
+// Media is fetched with the X-Session-Token header and shown from an object URL, so the
+// session token never ends up in a media URL
+function useAttachmentObjectUrl(url: string | null): string | null {
+  const [objectUrl, setObjectUrl] = useState<string | null>(null);
+
+  useEffect(() => {
+    if (!url) return;
+    let cancelled = false;
+    let created: string | null = null;
+    fetchAttachmentBlob(url)
+      .then((blob) => {
+        if (cancelled) return;
+        created = URL.createObjectURL(blob);
+        setObjectUrl(created);
+      })
+      .catch(() => undefined);
+    return () => {
+      cancelled = true;
+      if (created) URL.revokeObjectURL(created);
+      setObjectUrl(null);
+    };
+  }, [url]);
+
+  return objectUrl;
+}
+
+function AttachmentImage({ src, ...props }: ImgHTMLAttributes<HTMLImageElement> & { src: string }) {
+  const objectUrl = useAttachmentObjectUrl(src);
+  return objectUrl ? <img src={objectUrl} {...props} /> : <div className={props.className} />;
+}
+
+function AttachmentPlayer({ src, kind, type }: { src: string; kind: 'audio' | 'video'; type: string }) {
+  const objectUrl = useAttachmentObjectUrl(src);
+  if (!objectUrl) {
+    return <Icon name="Loader2" size={32} className="text-primary animate-spin mx-auto" />;
+  }
+  return kind === 'audio' ? (
+    <audio controls className="w-full">
+      <source src={objectUrl} type={type} />
+      Ваш браузер не поддерживает аудио.
+    </audio>
+  ) : (
+    <video controls className="w-full rounded-lg">
+      <source src={objectUrl} type={type} />
+      Ваш браузер не поддерживает видео.
+    </video>
+  );
+}
+
 export default function AttachmentsList({ attachments, onCleanupComplete }: AttachmentsListProps) {
   const [selectedImage, setSelectedImage] = useState<string | null>(null);
   const [selectedMedia, setSelectedMedia] = useState<{ url: string; type: string } | null>(null);
@@ -38,8 +91,10 @@ export default function AttachmentsList({ attachments, onCleanupComplete }: Atta
       
       if (response.ok) {
         toast({
-          title: 'Очистка завершена',
-          description: `Удалено вложений: ${data.deleted_count}`,
+          title: data.done ? 'Очистка завершена' : 'Очистка продолжится при следующем запуске',
+          description: data.done
+            ? `Удалено вложений: ${data.deleted_count}`
+            : `Удалено вложений: ${data.deleted_count}, осталось ~${data.remaining_estimate}`,
         });
         onCleanupComplete();
       } else {
@@ -72,8 +127,10 @@ export default function AttachmentsList({ attachments, onCleanupComplete }: Atta
       
       if (response.ok) {
         toast({
-          title: 'Все вложения удалены',
-          description: `Удалено: ${data.deleted_count}`,
+          title: data.done ? 'Все вложения удалены' : 'Удаление продолжится при следующем запуске',
+          description: data.done
+            ? `Удалено: ${data.deleted_count}`
+            : `Удалено: ${data.deleted_count}, осталось ~${data.remaining_estimate}`,
         });
         onCleanupComplete();
       } else {
@@ -126,14 +183,32 @@ export default function AttachmentsList({ attachments, onCleanupComplete }: Atta
     if (type === 'voice') return { icon: 'Mic', label: 'Голосовое' };
     if (type === 'video_note') return { icon: 'VideoIcon', label: 'Кружок' };
     if (type === 'video') return { icon: 'Video', label: 'Видео' };
-    return { icon: 'Image', label: 'Фото' };
+    if (type === 'photo') return { icon: 'Image', label: 'Фото' };
+    return { icon: 'File', label: 'Файл' };
+  };
+
+  const getMediaUrl = (attachment: Attachment) =>
+    `${ADMIN_API_URL}?endpoint=file&id=${attachment.id}&sent_at=${encodeURIComponent(attachment.sent_at)}`;
+
+  const handleDownload = async (attachment: Attachment) => {
+    try {
+      await downloadAttachment(getMediaUrl(attachment), `attachment-${attachment.id}`);
+    } catch (error) {
+      toast({
+        title: 'Ошибка',
+        description: 'Не удалось скачать вложение',
+        variant: 'destructive',
+      });
+    }
   };
 
   const handleMediaClick = (attachment: Attachment) => {
     if (attachment.content_type === 'photo') {
-      setSelectedImage(attachment.photo_url);
+      setSelectedImage(getMediaUrl(attachment));
+    } else if (PLAYABLE_TYPES.includes(attachment.content_type)) {
+      setSelectedMedia({ url: getMediaUrl(attachment), type: attachment.content_type });
     } else {
-      setSelectedMedia({ url: attachment.photo_url, type: attachment.content_type });
+      void handleDownload(attachment);
     }
   };
 
@@ -210,11 +285,10 @@ export default function AttachmentsList({ attachments, onCleanupComplete }: Atta
                     onClick={() => handleMediaClick(attachment)}
                   >
                     {isPhoto ? (
-                      <img
-                        src={attachment.photo_url}
+                      <AttachmentImage
+                        src={getMediaUrl(attachment)}
                         alt={`Фото из чата ${attachment.chat_id}`}
                         className="w-full h-full object-cover"
-                        loading="lazy"
                       />
                     ) : (
                       <div className="w-full h-full flex flex-col items-center justify-center bg-gradient-to-br from-primary/20 to-primary/5">
@@ -258,7 +332,7 @@ export default function AttachmentsList({ attachments, onCleanupComplete }: Atta
           >
             <Icon name="X" size={32} />
           </button>
-          <img
+          <AttachmentImage
             src={selectedImage}
             alt="Просмотр фото"
             className="max-w-full max-h-full object-contain rounded-lg"
@@ -285,10 +359,7 @@ export default function AttachmentsList({ attachments, onCleanupComplete }: Atta
                   <Icon name="Mic" size={24} className="text-primary" />
                   <h3 className="text-lg font-semibold">Голосовое сообщение</h3>
                 </div>
-                <audio controls className="w-full">
-                  <source src={selectedMedia.url} type="audio/ogg" />
-                  Ваш браузер не поддерживает аудио.
-                </audio>
+                <AttachmentPlayer src={selectedMedia.url} kind="audio" type="audio/ogg" />
               </div>
             )}
             {selectedMedia.type === 'video_note' && (
@@ -297,10 +368,7 @@ export default function AttachmentsList({ attachments, onCleanupComplete }: Atta
                   <Icon name="VideoIcon" size={24} className="text-primary" />
                   <h3 className="text-lg font-semibold">Видео-кружок</h3>
                 </div>
-                <video controls className="w-full rounded-lg">
-                  <source src={selectedMedia.url} type="video/mp4" />
-                  Ваш браузер не поддерживает видео.
-                </video>
+                <AttachmentPlayer src={selectedMedia.url} kind="video" type="video/mp4" />
               </div>
             )}
             {selectedMedia.type === 'video' && (
@@ -309,10 +377,7 @@ export default function AttachmentsList({ attachments, onCleanupComplete }: Atta
                   <Icon name="Video" size={24} className="text-primary" />
                   <h3 className="text-lg font-semibold">Видео</h3>
                 </div>
-                <video controls className="w-full rounded-lg">
-                  <source src={selectedMedia.url} type="video/mp4" />
-                  Ваш браузер не поддерживает видео.
-                </video>
+                <AttachmentPlayer src={selectedMedia.url} kind="video" type="video/mp4" />
               </div>
             )}
           </div>
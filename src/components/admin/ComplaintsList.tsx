@@ -2,7 +2,9 @@ import { useState } from 'react';
 import { Card } from '@/components/ui/card';
 import { Badge } from '@/components/ui/badge';
 import { Button } from '@/components/ui/button';
+import { Checkbox } from '@/components/ui/checkbox';
 import Icon from '@/components/ui/icon';
+import { sessionHeaders } from '@/lib/session';
 
 interface Complaint {
   id: number;
@@ -22,6 +24,71 @@ const API_URL = 'https://functions.poehali.dev/3d80763a-6e9c-47e8-ad39-f66f68690
 
 export default function ComplaintsList({ complaints, onAction }: ComplaintsListProps) {
   const [loading, setLoading] = useState<number | null>(null);
+  const [selected, setSelected] = useState<Set<number>>(new Set());
+  const [bulkLoading, setBulkLoading] = useState(false);
+
+  const selectedComplaints = complaints.filter(c => selected.has(c.id) && c.status === 'pending');
+
+  const toggleSelected = (complaintId: number, checked: boolean) => {
+    setSelected(prev => {
+      const next = new Set(prev);
+      if (checked) {
+        next.add(complaintId);
+      } else {
+        next.delete(complaintId);
+      }
+      return next;
+    });
+  };
+
+  const runBulkAction = async (body: Record<string, unknown>, errorMessage: string) => {
+    setBulkLoading(true);
+
+    try {
+      const response = await fetch(API_URL, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', ...sessionHeaders() },
+        body: JSON.stringify(body)
+      });
+
+      if (response.ok) {
+        setSelected(new Set());
+        onAction();
+      } else {
+        alert(errorMessage);
+      }
+    } catch (error) {
+      alert('Ошибка подключения к серверу');
+    } finally {
+      setBulkLoading(false);
+    }
+  };
+
+  const handleBulkBlock = async () => {
+    const userIds = [...new Set(selectedComplaints.map(c => c.reported_user_id).filter((id): id is number => id !== null))];
+    if (userIds.length === 0) {
+      alert('Не удалось определить пользователей для блокировки');
+      return;
+    }
+
+    if (!confirm(`Заблокировать пользователей: ${userIds.length}?`)) {
+      return;
+    }
+
+    await runBulkAction({
+      action: 'bulk_block',
+      telegram_ids: userIds,
+      complaint_ids: selectedComplaints.map(c => c.id)
+    }, 'Ошибка при блокировке пользователей');
+  };
+
+  const handleBulkReject = async () => {
+    await runBulkAction({
+      action: 'bulk_resolve',
+      complaint_ids: selectedComplaints.map(c => c.id),
+      status: 'rejected'
+    }, 'Ошибка при обновлении статуса');
+  };
 
   const formatDate = (dateString: string) => {
     const date = new Date(dateString);
@@ -62,7 +129,7 @@ export default function ComplaintsList({ complaints, onAction }: ComplaintsListP
     try {
       const response = await fetch(API_URL, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...sessionHeaders() },
         body: JSON.stringify({
           action: 'block_user',
           telegram_id: complaint.reported_user_id,
@@ -88,7 +155,7 @@ export default function ComplaintsList({ complaints, onAction }: ComplaintsListP
     try {
       const response = await fetch(API_URL, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...sessionHeaders() },
         body: JSON.stringify({
           action: 'resolve_complaint',
           complaint_id: complaintId,
@@ -110,6 +177,25 @@ export default function ComplaintsList({ complaints, onAction }: ComplaintsListP
 
   return (
     <div className="space-y-3">
+      {selectedComplaints.length > 0 && (
+        <Card className="p-3 flex items-center justify-between gap-4">
+          <span className="text-sm text-muted-foreground">Выбрано жалоб: {selectedComplaints.length}</span>
+          <div className="flex items-center gap-2">
+            <Button variant="destructive" size="sm" onClick={handleBulkBlock} disabled={bulkLoading}>
+              {bulkLoading ? (
+                <Icon name="Loader2" size={14} className="mr-1 animate-spin" />
+              ) : (
+                <Icon name="Ban" size={14} className="mr-1" />
+              )}
+              Забанить выбранных
+            </Button>
+            <Button variant="outline" size="sm" onClick={handleBulkReject} disabled={bulkLoading}>
+              <Icon name="X" size={14} className="mr-1" />
+              Отклонить выбранные
+            </Button>
+          </div>
+        </Card>
+      )}
       {complaints.length === 0 ? (
         <Card className="p-8 text-center">
           <Icon name="CheckCircle2" size={48} className="text-green-500 mx-auto mb-3 opacity-50" />
@@ -120,6 +206,13 @@ export default function ComplaintsList({ complaints, onAction }: ComplaintsListP
           <Card key={complaint.id} className="p-4 hover:bg-accent/5 transition-colors">
             <div className="flex items-start justify-between gap-4">
               <div className="flex items-start gap-4 flex-1">
+                {complaint.status === 'pending' && (
+                  <Checkbox
+                    className="mt-3"
+                    checked={selected.has(complaint.id)}
+                    onCheckedChange={(checked) => toggleSelected(complaint.id, checked === true)}
+                  />
+                )}
                 <div className="w-10 h-10 rounded-full bg-red-500/20 flex items-center justify-center flex-shrink-0">
                   <Icon name="Flag" size={20} className="text-red-500" />
                 </div>
@@ -0,0 +1,55 @@
+import { sessionHeaders } from '@/lib/session';
+
+// Mirrors ATTACHMENT_MAX_RESPONSE_BYTES in admin-api: a larger file is only served in ranges
+const RANGE_CHUNK_BYTES = 2 * 1024 * 1024;
+
+export async function fetchAttachmentBlob(url: string): Promise<Blob> {
+  const parts: Blob[] = [];
+  let start = 0;
+  let total = Infinity;
+  let type = '';
+
+  while (start < total) {
+    const response = await fetch(url, {
+      headers: { ...sessionHeaders(), Range: `bytes=${start}-${start + RANGE_CHUNK_BYTES - 1}` },
+    });
+    if (response.status === 200) {
+      return response.blob();
+    }
+    if (response.status === 416 && start === 0) {
+      return new Blob([]);
+    }
+    if (response.status !== 206) {
+      throw new Error(`Attachment request failed: ${response.status}`);
+    }
+
+    const contentRange = /\/(\d+)$/.exec(response.headers.get('Content-Range') ?? '');
+    if (!contentRange) {
+      throw new Error('Attachment response has no Content-Range');
+    }
+    total = Number(contentRange[1]);
+    type = response.headers.get('Content-Type') ?? type;
+
+    const part = await response.blob();
+    if (part.size === 0) {
+      throw new Error('Attachment range response is empty');
+    }
+    parts.push(part);
+    start += part.size;
+  }
+
+  return new Blob(parts, { type });
+}
+
+export async function downloadAttachment(url: string, filename: string): Promise<void> {
+  const objectUrl = URL.createObjectURL(await fetchAttachmentBlob(url));
+  try {
+    const link = document.createElement('a');
+    link.href = objectUrl;
+    link.download = filename;
+    link.click();
+  } finally {
+    // The click starts the download asynchronously; keep the URL alive long enough for it
+    setTimeout(() => URL.revokeObjectURL(objectUrl), 60_000);
+  }
+}
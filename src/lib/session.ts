@@ -0,0 +1,10 @@
+const SESSION_STORAGE_KEY = 'admin_session';
+
+export function getSessionToken(): string | null {
+  return localStorage.getItem(SESSION_STORAGE_KEY);
+}
+
+export function sessionHeaders(): Record<string, string> {
+  const token = getSessionToken();
+  return token ? { 'X-Session-Token': token } : {};
+}
@@ -10,6 +10,7 @@ import StatsMetrics from '@/components/admin/StatsMetrics';
 import ActiveChatsList from '@/components/admin/ActiveChatsList';
 import ComplaintsList from '@/components/admin/ComplaintsList';
 import AttachmentsList from '@/components/admin/AttachmentsList';
+import { sessionHeaders } from '@/lib/session';
 
 const API_URL = 'https://functions.poehali.dev/3d80763a-6e9c-47e8-ad39-f66f686907a6';
 const AUTH_API_URL = 'https://functions.poehali.dev/7c36ba9c-1436-4f94-ac57-6e4d16640f39';
@@ -47,12 +48,25 @@ interface Complaint {
 interface Attachment {
   id: number;
   chat_id: number;
-  photo_url: string;
+  blob_sha256: string | null;
   content_type: string;
   sent_at: string;
   sender_gender: string;
 }
 
+interface AdminEvent {
+  type: 'chat_started' | 'chat_ended' | 'complaint_created' | 'complaints_updated' | 'attachment_added';
+  delta?: Partial<Record<'active_chats' | 'pending_complaints', number>>;
+  chat?: Chat;
+  chat_id?: number;
+  complaint?: Complaint;
+  complaint_ids?: number[];
+  status?: string;
+  attachment?: Attachment;
+}
+
+const EVENTS_RETRY_DELAY_MS = 5000;
+
 export default function Index() {
   const [activeTab, setActiveTab] = useState('stats');
   const [stats, setStats] = useState<Stats | null>(null);
@@ -119,43 +133,20 @@ export default function Index() {
     checkAuth();
   }, []);
 
-  const fetchStats = async () => {
-    try {
-      const response = await fetch(`${API_URL}?endpoint=stats`);
-      const data = await response.json();
-      setStats(data);
-    } catch (error) {
-      console.error('Failed to fetch stats:', error);
-    }
-  };
-
-  const fetchChats = async () => {
-    try {
-      const response = await fetch(`${API_URL}?endpoint=chats`);
-      const data = await response.json();
-      setChats(data.chats || []);
-    } catch (error) {
-      console.error('Failed to fetch chats:', error);
-    }
-  };
-
-  const fetchComplaints = async () => {
-    try {
-      const response = await fetch(`${API_URL}?endpoint=complaints`);
-      const data = await response.json();
-      setComplaints(data.complaints || []);
-    } catch (error) {
-      console.error('Failed to fetch complaints:', error);
-    }
-  };
-
-  const fetchAttachments = async () => {
+  const fetchDashboard = async () => {
     try {
-      const response = await fetch(`${API_URL}?endpoint=attachments`);
+      const response = await fetch(`${API_URL}?endpoint=dashboard`, { headers: sessionHeaders() });
       const data = await response.json();
-      setAttachments(data.attachments || []);
+      if (!response.ok) {
+        // Keep showing the last loaded dashboard rather than replacing it with an error body
+        throw new Error(data.error || `Dashboard request failed: ${response.status}`);
+      }
+      setStats(data.stats);
+      setChats(data.chats?.chats || []);
+      setComplaints(data.complaints?.complaints || []);
+      setAttachments(data.attachments?.attachments || []);
     } catch (error) {
-      console.error('Failed to fetch attachments:', error);
+      console.error('Failed to fetch dashboard:', error);
     }
   };
 
@@ -163,16 +154,73 @@ export default function Index() {
     if (isAuthenticated) {
       const loadData = async () => {
         setLoading(true);
-        await Promise.all([fetchStats(), fetchChats(), fetchComplaints(), fetchAttachments()]);
+        await fetchDashboard();
         setLoading(false);
       };
       loadData();
     }
   }, [isAuthenticated]);
 
+  const applyEvent = (event: AdminEvent) => {
+    const delta = event.delta;
+    if (delta) {
+      setStats(prev => prev && {
+        ...prev,
+        active_chats: prev.active_chats + (delta.active_chats || 0),
+        pending_complaints: prev.pending_complaints + (delta.pending_complaints || 0),
+      });
+    }
+    if (event.type === 'chat_started' && event.chat) {
+      const chat = event.chat;
+      setChats(prev => [chat, ...prev.filter(item => item.id !== chat.id)]);
+    } else if (event.type === 'chat_ended') {
+      setChats(prev => prev.filter(item => item.id !== event.chat_id));
+    } else if (event.type === 'complaint_created' && event.complaint) {
+      const complaint = event.complaint;
+      setComplaints(prev => [complaint, ...prev.filter(item => item.id !== complaint.id)]);
+    } else if (event.type === 'complaints_updated') {
+      const updated = new Set(event.complaint_ids || []);
+      setComplaints(prev => prev.map(item => updated.has(item.id) ? { ...item, status: event.status || item.status } : item));
+    } else if (event.type === 'attachment_added' && event.attachment) {
+      const attachment = event.attachment;
+      setAttachments(prev => [attachment, ...prev.filter(item => item.id !== attachment.id)]);
+    }
+  };
+
+  useEffect(() => {
+    if (!isAuthenticated) return;
+    let cancelled = false;
+
+    const listen = async () => {
+      let cursor = '';
+      while (!cancelled) {
+        try {
+          const response = await fetch(`${API_URL}?endpoint=events&cursor=${encodeURIComponent(cursor)}`, { headers: sessionHeaders() });
+          if (!response.ok) throw new Error(`HTTP ${response.status}`);
+          const data = await response.json();
+          if (cancelled) break;
+          if (data.reset) {
+            await fetchDashboard();
+          } else {
+            data.events.forEach(applyEvent);
+          }
+          cursor = data.cursor;
+        } catch (error) {
+          console.error('Event stream error:', error);
+          await new Promise(resolve => setTimeout(resolve, EVENTS_RETRY_DELAY_MS));
+        }
+      }
+    };
+    listen();
+
+    return () => {
+      cancelled = true;
+    };
+  }, [isAuthenticated]);
+
   const handleRefresh = async () => {
     setLoading(true);
-    await Promise.all([fetchStats(), fetchChats(), fetchComplaints(), fetchAttachments()]);
+    await fetchDashboard();
     setLoading(false);
   };
 